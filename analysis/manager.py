@@ -1,12 +1,14 @@
 import time, os, sys, copy, yaml
 from collections import defaultdict
 from functools import lru_cache
+from torch.utils.data import DataLoader
 
-from mlreco.iotools.factories import loader_factory
+from mlreco.iotools.factories import loader_factory, writer_factory
 from mlreco.trainval import trainval
 from mlreco.main_funcs import cycle, process_config
-from mlreco.iotools.readers import HDF5Reader
-from mlreco.iotools.writers import CSVWriter, HDF5Writer
+from mlreco.iotools.datasets import HDF5Dataset
+from mlreco.iotools.collates import CollateHDF5
+from mlreco.iotools.writers import CSVWriter
 from mlreco.utils import pixel_to_cm
 from mlreco.utils.globals import *
 
@@ -68,6 +70,7 @@ class AnaToolsManager:
 
         self._data_reader  = None
         self._reader_state = None
+        self._data_loader  = None
         self.verbose       = verbose
         self.writers       = {}
         self.profile       = self.ana_config['analysis'].get('profile', False)
@@ -123,18 +126,33 @@ class AnaToolsManager:
             n_skip = self.ana_config['reader'].get('n_skip', -1)
             entry_list = self.ana_config['reader'].get('entry_list', [])
             skip_entry_list = self.ana_config['reader'].get('skip_entry_list', [])
-            Reader = HDF5Reader(file_keys, n_entry, n_skip, entry_list, skip_entry_list, to_larcv=True)
+            catalog = self.ana_config['reader'].get('catalog', None)
+            keys = self.ana_config['reader'].get('keys', None)
+            skip_keys = self.ana_config['reader'].get('skip_keys', [])
+            lazy_rows = self.ana_config['reader'].get('lazy_rows', None)
+            num_workers = self.ana_config['reader'].get('num_workers', 0)
+            batch_size = self.ana_config['reader'].get('batch_size', 1)
+            dataset = HDF5Dataset(file_keys, n_entry=n_entry, n_skip=n_skip, entry_list=entry_list,
+                                  skip_entry_list=skip_entry_list, to_larcv=True, catalog=catalog,
+                                  keys=keys, skip_keys=skip_keys, lazy_rows=lazy_rows)
+            Reader = dataset.reader
             self._data_reader = Reader
             self._reader_state = 'hdf5'
-            self._set_iteration(Reader)
+            if num_workers > 0 or batch_size > 1:
+                assert lazy_rows is None or num_workers == 0,\
+                        'Lazy arrays cannot be sent from DataLoader workers'
+                # Read and build the entries in DataLoader worker processes
+                loader = DataLoader(dataset, batch_size=batch_size, shuffle=False,
+                                    num_workers=num_workers, collate_fn=CollateHDF5)
+                self._data_loader = iter(loader)
+                self._set_iteration(loader)
+            else:
+                self._set_iteration(Reader)
             
 
         if 'writer' in self.ana_config:
-            writer_cfg = copy.deepcopy(self.ana_config['writer'])
-            assert 'name' in writer_cfg
-            writer_cfg.pop('name')
-
-            Writer = HDF5Writer(**writer_cfg)
+            assert 'name' in self.ana_config['writer']
+            Writer = writer_factory({'iotool': {'writer': self.ana_config['writer']}})
             self._data_writer = Writer
 
     def forward(self, iteration=None):
@@ -154,7 +172,9 @@ class AnaToolsManager:
             Result dictionary containing full chain outputs
             
         """
-        if self._reader_state == 'hdf5':
+        if self._reader_state == 'hdf5' and self._data_loader is not None:
+            data, res = next(self._data_loader)
+        elif self._reader_state == 'hdf5':
             assert iteration is not None
             data, res = self._data_reader.get(iteration, nested=True)
         elif self._reader_state == 'trainval':
@@ -670,6 +690,16 @@ class AnaToolsManager:
             if self.profile:
                 self.log(iteration)
 
+        # Write the events left in the writer buffer
+        if self._data_writer is not None:
+            self._data_writer.close()
+
+        # Report which keys were actually read from the HDF5 files
+        if self.profile and self._reader_state == 'hdf5' and self._data_loader is None:
+            print('HDF5 reads (events requested, events read, MB read):')
+            for key, stats in self._data_reader.read_summary().items():
+                print(f"  {key:<30} {stats['requested']:>8} {stats['loaded']:>8} {stats['bytes']/1e6:>10.1f}")
+
 
     def extract_ttree_data(self, root_file_path, tree_name, branch_names, result):
         """
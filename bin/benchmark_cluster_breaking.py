@@ -0,0 +1,73 @@
+# Script to benchmark the cluster breaking step of parse_cluster3d
+# ===============================================================
+#
+# Usage: python3 bin/benchmark_cluster_breaking.py --num_clusters 500 --num_events 10
+#
+# Compares the per-cluster DBSCAN loop (previous implementation) with the
+# single-pass lattice connected-components labeling, on synthetic events
+# made of random walks (track-like clusters) in a 768^3 image.
+#
+# Output: will write in stdout the time per event of each method and
+# check that the fragment labels are identical.
+
+import os
+import sys
+import time
+import numpy as np
+import argparse
+from sklearn.cluster import DBSCAN
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.utils.dbscan import lattice_components
+
+
+def make_event(num_clusters, max_size, image_size=768, seed=0):
+    rng = np.random.default_rng(seed)
+    voxels, cluster_ids = [], []
+    for c in range(num_clusters):
+        size = rng.integers(1, max_size)
+        steps = rng.integers(-1, 2, size=(size, 3))
+        steps[rng.uniform(size=size) < 0.02] *= 3 # Gaps break the cluster
+        walk = rng.integers(0, image_size, size=3) + np.cumsum(steps, axis=0)
+        voxels.append(np.clip(walk, 0, image_size-1).astype(np.int32))
+        cluster_ids.append(np.full(size, c))
+
+    return np.concatenate(voxels), np.concatenate(cluster_ids)
+
+
+def break_loop(voxels, cluster_ids):
+    frag_ids, id_offset = [], 0
+    for c in np.unique(cluster_ids):
+        dbscan = DBSCAN(eps=1.1, min_samples=1, metric='chebyshev')
+        frag_labels = np.unique(dbscan.fit(voxels[cluster_ids == c]).labels_, return_inverse=True)[-1]
+        frag_ids.append(id_offset + frag_labels)
+        id_offset += max(frag_labels) + 1
+
+    return np.concatenate(frag_ids)
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Benchmark cluster breaking")
+    argparse.add_argument("--num_clusters", type=int, default=500, help="number of clusters per event")
+    argparse.add_argument("--max_size", type=int, default=500, help="maximum number of voxels per cluster")
+    argparse.add_argument("--num_events", type=int, default=10, help="number of events")
+
+    args = argparse.parse_args()
+    lattice_components(*make_event(2, 10)) # Compile
+
+    times = {'loop': 0., 'lattice': 0.}
+    for i in range(args.num_events):
+        voxels, cluster_ids = make_event(args.num_clusters, args.max_size, seed=i)
+        start = time.time()
+        ref = break_loop(voxels, cluster_ids)
+        times['loop'] += time.time() - start
+        start = time.time()
+        out = lattice_components(voxels, cluster_ids)
+        times['lattice'] += time.time() - start
+        assert np.array_equal(ref, out), 'Fragment labels do not match'
+
+    for k, v in times.items():
+        print("%-8s %8.2f ms/event" % (k, 1e3*v/args.num_events))
+    print("Speedup: %.1fx, labels identical" % (times['loop']/times['lattice']))
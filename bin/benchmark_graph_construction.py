@@ -0,0 +1,155 @@
+# Script to benchmark the GNN graph constructors
+# ==============================================
+#
+# Usage: python3 bin/benchmark_graph_construction.py --num_clusters 100 300 1000 --num_batches 4
+#
+# Compares the previous kNN, MST and bipartite graph constructors (which
+# grow their edge list one block at a time and call scipy's MST in object
+# mode) with the preallocated, batch-parallel ones, and the kNN/MST graphs
+# built from the sparse set of cluster pairs closer than `--max_dist`
+# with those built from the dense distance matrix. Also times the Delaunay
+# graph and the Gabriel graph (beta-skeleton) that can replace it. The
+# events are made of random walks (track-like clusters) in a 768^3 image.
+#
+# Output: will write in stdout the time per event of each method, for each
+# event size, and check that the graphs are identical to the previous ones.
+
+import os
+import sys
+import time
+import numpy as np
+import numba as nb
+import argparse
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+import mlreco.utils.numba_local as nbl
+from mlreco.utils.gnn.network import complete_graph, delaunay_graph, mst_graph, knn_graph, \
+        bipartite_graph, mst_graph_sparse, knn_graph_sparse, skeleton_graph, inter_cluster_distance
+
+
+def make_event(num_clusters, num_batches, max_size=100, image_size=768, seed=0):
+    rng = np.random.default_rng(seed)
+    voxels, clusts, offset = [], [], 0
+    for c in range(num_clusters):
+        size = rng.integers(2, max_size)
+        walk = rng.integers(0, image_size, size=3) + np.cumsum(rng.integers(-1, 2, size=(size, 3)), axis=0)
+        voxels.append(walk)
+        clusts.append(np.arange(offset, offset+size))
+        offset += size
+    batch_ids = np.sort(rng.integers(0, num_batches, size=num_clusters))
+
+    return np.vstack(voxels).astype(np.float32), clusts, batch_ids
+
+
+@nb.njit(cache=True)
+def mst_graph_legacy(batch_ids, dist_mat, directed=False):
+    ret = np.empty((0, 2), dtype=np.int64)
+    for b in np.unique(batch_ids):
+        clust_ids = np.where(batch_ids == b)[0]
+        if len(clust_ids) > 1:
+            submat = np.triu(nbl.submatrix(dist_mat, clust_ids, clust_ids))
+            with nb.objmode(mst_mat = 'float32[:,:]'):
+                mst_mat = minimum_spanning_tree(submat).toarray().astype(np.float32)
+            edges = np.where(mst_mat > 0.)
+            edges = np.vstack((clust_ids[edges[0]],clust_ids[edges[1]])).T
+            ret   = np.vstack((ret, edges))
+
+    if not directed:
+        ret = np.vstack((ret, ret[:,::-1]))
+
+    return ret.T
+
+
+@nb.njit(cache=True)
+def knn_graph_legacy(batch_ids, k, dist_mat, directed=False):
+    ret = np.empty((0, 2), dtype=np.int64)
+    for b in np.unique(batch_ids):
+        clust_ids = np.where(batch_ids == b)[0]
+        if len(clust_ids) > 1:
+            subk = min(k+1, len(clust_ids))
+            submat = nbl.submatrix(dist_mat, clust_ids, clust_ids)
+            for i in range(len(submat)):
+                idxs = np.argsort(submat[i])[1:subk]
+                edges = np.empty((subk-1,2), dtype=np.int64)
+                for j, idx in enumerate(np.sort(idxs)):
+                    edges[j] = [clust_ids[i], clust_ids[idx]]
+                if len(edges):
+                    ret = np.vstack((ret, edges))
+
+    if not directed:
+        ret = np.vstack((ret, ret[:,::-1]))
+
+    return ret.T
+
+
+@nb.njit(cache=True)
+def bipartite_graph_legacy(batch_ids, primaries, directed=True):
+    ret = np.empty((0,2), dtype=np.int64)
+    for i in np.where(primaries)[0]:
+        for j in np.where(~primaries)[0]:
+            if batch_ids[i] ==  batch_ids[j]:
+                ret = np.vstack((ret, np.array([[i,j]])))
+
+    if not directed:
+        ret = np.vstack((ret, ret[:,::-1]))
+
+    return ret.T
+
+
+def timed(times, key, fn, *args, **kwargs):
+    start = time.time()
+    out = fn(*args, **kwargs)
+    times[key] = times.get(key, 0.) + time.time() - start
+    return out
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Benchmark graph construction")
+    argparse.add_argument("--num_clusters", type=int, nargs='+', default=[100, 300, 1000], help="number of clusters per event")
+    argparse.add_argument("--num_batches", type=int, default=4, help="number of batch entries per event")
+    argparse.add_argument("--num_events", type=int, default=5, help="number of events per size")
+    argparse.add_argument("--knn_k", type=int, default=5, help="number of neighbors of the kNN graph")
+    argparse.add_argument("--max_dist", type=float, default=100., help="maximum length of the sparse candidate edges")
+
+    args = argparse.parse_args()
+
+    for num_clusters in args.num_clusters:
+        times = {}
+        for i in range(args.num_events + 1): # First event compiles
+            voxels, clusts, batch_ids = make_event(num_clusters, args.num_batches, seed=i)
+            dist_mat = inter_cluster_distance(voxels, clusts, batch_ids, algorithm='kdtree').astype(np.float64)
+            primaries = np.arange(num_clusters) % 10 == 0
+            if i == 1:
+                times = {}
+
+            ref = timed(times, 'knn (previous)', knn_graph_legacy, batch_ids, args.knn_k, dist_mat)
+            out = timed(times, 'knn', knn_graph, batch_ids, args.knn_k, dist_mat)
+            assert np.array_equal(ref, out), 'kNN graphs do not match'
+
+            ref = timed(times, 'mst (previous)', mst_graph_legacy, batch_ids, dist_mat)
+            out = timed(times, 'mst', mst_graph, batch_ids, dist_mat)
+            assert np.array_equal(ref, out), 'MST graphs do not match'
+
+            ref = timed(times, 'bipartite (previous)', bipartite_graph_legacy, batch_ids, primaries, False)
+            out = timed(times, 'bipartite', bipartite_graph, batch_ids, primaries, False)
+            assert np.array_equal(ref, out), 'Bipartite graphs do not match'
+
+            # Sparse variants, from the pairs of clusters closer than max_dist
+            edges, dists = timed(times, 'candidates (sparse)', inter_cluster_distance, voxels, clusts, batch_ids, algorithm='kdtree', max_dist=args.max_dist, sparse=True)
+            dists = dists.astype(np.float64)
+            timed(times, 'knn (sparse)', knn_graph_sparse, batch_ids, args.knn_k, edges, dists)
+            timed(times, 'mst (sparse)', mst_graph_sparse, batch_ids, edges, dists)
+
+            data = np.hstack((np.zeros((len(voxels), 1)), voxels))
+            timed(times, 'delaunay', delaunay_graph, data, nb.typed.List(clusts), batch_ids)
+            timed(times, 'gabriel', skeleton_graph, voxels, clusts, batch_ids)
+            timed(times, 'gabriel (sparse)', skeleton_graph, voxels, clusts, batch_ids, max_dist=args.max_dist)
+
+        print("%d clusters, %d batches:" % (num_clusters, args.num_batches))
+        for k, v in times.items():
+            print("  %-22s %8.2f ms/event" % (k, 1e3*v/args.num_events))
+        for k in ['knn', 'mst', 'bipartite']:
+            print("  %-22s %8.1fx speedup, graphs identical" % (k, times[k+' (previous)']/times[k]))
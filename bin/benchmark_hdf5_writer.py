@@ -0,0 +1,82 @@
+# Script to benchmark the HDF5 writer configurations
+# ==================================================
+#
+# Usage: python3 bin/benchmark_hdf5_writer.py --num_batches 20 --batch_size 4
+#
+# Writes synthetic inference batches (point clouds, per-point scores and
+# fragment index lists) with different `HDF5Writer` settings:
+# - per_event : one resize per event and dataset (previous write pattern)
+# - per_batch : default, one resize per batch, file closed after each batch
+# - buffered  : file kept open, one resize every `buffer_size` events
+# - chunked   : buffered, with `chunk_size` rows per chunk
+# - gzip, lzf : chunked, with a compression filter
+#
+# Output: will write in stdout the time per event and the size of the
+# output file of each configuration.
+
+import os
+import sys
+import time
+import numpy as np
+import argparse
+import tempfile
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.writers import HDF5Writer
+
+
+def make_batch(batch_id, batch_size, num_points, num_fragments, seed=0):
+    rng = np.random.default_rng(seed + batch_id)
+    data_blob, result_blob = {'index': [], 'input_data': []}, {'segmentation': [], 'fragment_clusts': []}
+    for i in range(batch_size):
+        n = rng.integers(num_points//2, 2*num_points)
+        voxels = np.hstack([rng.integers(0, 768, size=(n, 3)), rng.uniform(size=(n, 2))])
+        data_blob['index'].append(batch_id*batch_size + i)
+        data_blob['input_data'].append(voxels.astype(np.float32))
+        result_blob['segmentation'].append(rng.normal(size=(n, 5)).astype(np.float32))
+        bounds = np.sort(rng.choice(n, size=num_fragments-1, replace=False))
+        result_blob['fragment_clusts'].append(np.split(np.arange(n), bounds))
+
+    return data_blob, result_blob
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Benchmark the HDF5 writer")
+    argparse.add_argument("--num_batches", type=int, default=20, help="number of batches")
+    argparse.add_argument("--batch_size", type=int, default=4, help="number of events per batch")
+    argparse.add_argument("--num_points", type=int, default=20000, help="average number of points per event")
+    argparse.add_argument("--num_fragments", type=int, default=200, help="number of fragments per event")
+    argparse.add_argument("--buffer_size", type=int, default=64, help="number of buffered events")
+    argparse.add_argument("--chunk_size", type=int, default=16384, help="number of rows per chunk")
+    argparse.add_argument("--version", type=int, default=2, help="file layout version")
+
+    args = argparse.parse_args()
+    configs = {
+        'per_event': {'buffer_size': 1},
+        'per_batch': {},
+        'buffered':  {'buffer_size': args.buffer_size},
+        'chunked':   {'buffer_size': args.buffer_size, 'chunk_size': args.chunk_size},
+        'gzip':      {'buffer_size': args.buffer_size, 'chunk_size': args.chunk_size, 'compression': 'gzip', 'compression_opts': 1},
+        'lzf':       {'buffer_size': args.buffer_size, 'chunk_size': args.chunk_size, 'compression': 'lzf'}
+    }
+
+    batches = [make_batch(b, args.batch_size, args.num_points, args.num_fragments) for b in range(args.num_batches)]
+    num_events = args.num_batches * args.batch_size
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, config in configs.items():
+            file_name = os.path.join(tmp_dir, f'{name}.h5')
+            start = time.time()
+            with HDF5Writer(file_name, version=args.version, **config) as writer:
+                for data_blob, result_blob in batches:
+                    if config.get('buffer_size', 0) == 1:
+                        # Write the events one at a time
+                        for i in range(args.batch_size):
+                            writer.append({k: v[i:i+1] for k, v in data_blob.items()},
+                                          {k: v[i:i+1] for k, v in result_blob.items()})
+                    else:
+                        writer.append(data_blob, result_blob)
+            duration = time.time() - start
+            size = os.path.getsize(file_name)
+            print("%-10s %8.2f ms/event %8.1f MB" % (name, 1e3*duration/num_events, size/1e6))
@@ -0,0 +1,121 @@
+# Script to benchmark the torch geometric node encoder
+# ====================================================
+#
+# Usage: python3 bin/benchmark_node_encoder.py --num_clusters 100 1000 5000 --device cpu
+#
+# Compares the per-cluster loop of the torch ClustGeoNodeEncoder (previous
+# implementation) with the batched segment reductions, on synthetic events
+# made of random walks (track-like clusters, some of a single point). Pairs
+# of points are excluded, as the orientation of their axis is arbitrary.
+#
+# Output: will write in stdout the time per event of each method, for each
+# number of clusters, and check that the node features are equivalent (up
+# to the orientation of the principal axis of nearly symmetric clusters).
+
+import os
+import sys
+import time
+import numpy as np
+import torch
+import argparse
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.models.layers.gnn.encoders.geometric import ClustGeoNodeEncoder
+
+
+def make_event(num_clusters, max_size=100, image_size=768, seed=0, device='cpu'):
+    rng = np.random.default_rng(seed)
+    points, clusts, offset = [], [], 0
+    for c in range(num_clusters):
+        size = rng.integers(3, max_size) if c % 5 else 1 # Pairs have an arbitrary orientation
+        walk = rng.uniform(0, image_size, size=3) + np.cumsum(rng.uniform(-1, 1, size=(size, 3)), axis=0)
+        points.append(walk)
+        clusts.append(np.arange(offset, offset+size))
+        offset += size
+    data = np.hstack((np.zeros((offset, 1)), np.vstack(points),
+        rng.uniform(0, 1, size=(offset, 1)), rng.integers(0, 5, size=(offset, 1))))
+
+    return torch.tensor(data, dtype=torch.float32, device=device), clusts
+
+
+def encode_loop(data, clusts, more_feats):
+    voxels    = data[:, 1:4].float()
+    values    = data[:, 4].float()
+    sem_types = data[:, -1].float()
+    feats = []
+    for c in clusts:
+        x = voxels[c]
+        size = torch.tensor([len(c)], dtype=voxels.dtype, device=voxels.device)
+        if len(c) < 2:
+            if not more_feats:
+                feats.append(torch.cat((x.flatten(), torch.zeros(12, dtype=voxels.dtype, device=voxels.device), size)))
+            else:
+                extra_feats = torch.tensor([values[c[0]], 0., sem_types[c[0]]], dtype=voxels.dtype, device=voxels.device)
+                feats.append(torch.cat((x.flatten(), torch.zeros(12, dtype=voxels.dtype, device=voxels.device), size, extra_feats)))
+            continue
+
+        center = x.mean(dim=0)
+        x = x - center
+        A = x.t().mm(x)
+        w, v = torch.linalg.eigh(A, UPLO='U')
+        dirwt = 1.0 - w[1] / w[2]
+        B = A / w[2]
+        v0 = v[:,2]
+        x0 = x.mv(v0)
+        xp0 = x - torch.ger(x0, v0)
+        np0 = torch.norm(xp0, dim=1)
+        sc = torch.dot(x0, np0)
+        if sc < 0:
+            v0 = -v0
+        v0 = dirwt * v0
+        if not more_feats:
+            feats.append(torch.cat((center, B.flatten(), v0, size)))
+        else:
+            extra_feats = torch.tensor([values[c].mean(), values[c].std(), sem_types[c].mode()[0]], dtype=voxels.dtype, device=voxels.device)
+            feats.append(torch.cat((center, B.flatten(), v0, size, extra_feats)))
+
+    return torch.stack(feats, dim=0)
+
+
+def synchronize(device):
+    if device != 'cpu':
+        torch.cuda.synchronize()
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Benchmark the geometric node encoder")
+    argparse.add_argument("--num_clusters", type=int, nargs='+', default=[100, 1000, 5000], help="number of clusters per event")
+    argparse.add_argument("--num_events", type=int, default=5, help="number of events per size")
+    argparse.add_argument("--more_feats", action='store_true', help="add the energy and semantic type features")
+    argparse.add_argument("--device", type=str, default='cpu', help="device on which to run the encoders")
+
+    args = argparse.parse_args()
+    encoder = ClustGeoNodeEncoder({'use_numpy': False, 'more_feats': args.more_feats})
+
+    for num_clusters in args.num_clusters:
+        times, flips = {'loop': 0., 'batched': 0.}, 0
+        for i in range(args.num_events):
+            data, clusts = make_event(num_clusters, seed=i, device=args.device)
+            synchronize(args.device)
+            start = time.time()
+            ref = encode_loop(data, clusts, args.more_feats)
+            synchronize(args.device)
+            times['loop'] += time.time() - start
+            start = time.time()
+            out = encoder(data, clusts)
+            synchronize(args.device)
+            times['batched'] += time.time() - start
+
+            # The orientation of the principal axis is arbitrary for clusters with a
+            # (nearly) symmetric spread around it: compare its sign separately
+            cols = [i for i in range(ref.shape[1]) if i not in [12, 13, 14]]
+            assert torch.allclose(ref[:,cols], out[:,cols], rtol=1e-4, atol=1e-4), 'Node features do not match'
+            assert torch.allclose(ref[:,12:15].abs(), out[:,12:15].abs(), rtol=1e-4, atol=1e-4), 'Node directions do not match'
+            flips += int(torch.sum(torch.sum(ref[:,12:15]*out[:,12:15], dim=1) < 0))
+
+        print("%d clusters:" % num_clusters)
+        for k, v in times.items():
+            print("  %-8s %8.2f ms/event" % (k, 1e3*v/args.num_events))
+        print("  Speedup: %.1fx, features equivalent (%d ambiguous orientations flipped)" % (times['loop']/times['batched'], flips))
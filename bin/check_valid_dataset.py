@@ -3,6 +3,9 @@
 #
 # Usage: python3 bin/check_valid_dataset.py bad_files.txt file1.root file2.root ... fileN.root
 #
+# Optionally, use `--catalog catalog.json` to reuse (and update) a dataset catalog,
+# and `--num_workers N` to scan the files in parallel.
+#
 # Output: will write a list of bad files in bad_files.txt
 # (one per line) that can then be used to move or remove
 # these bad files before doing hadd. For example using:
@@ -13,18 +16,23 @@
 # Loop over all TTrees in a given ROOT file and check that
 # they have the same number of entries.
 #
-from ROOT import TCanvas, TPad, TFile, TPaveLabel, TPaveText, TChain
-from ROOT import gROOT
-import ROOT
-import pandas as pd
+import os
+import sys
 import numpy as np
 import argparse
 
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.catalog import DatasetCatalog
+
 
 if __name__ == "__main__":
     argparse = argparse.ArgumentParser(description="Check validity of dataset")
     argparse.add_argument("output_file", type=str, help="output text file to write bad files names")
     argparse.add_argument("files", type=str, nargs="+", help="files to check")
+    argparse.add_argument("--catalog", type=str, default=None, help="path to the dataset catalog")
+    argparse.add_argument("--num_workers", type=int, default=1, help="number of processes used to scan files")
 
     args = argparse.parse_args()
 
@@ -39,36 +47,15 @@ if __name__ == "__main__":
         output.write(file + '\n')
         bad_files.append(file)
 
+    catalog = DatasetCatalog(args.catalog, args.num_workers)
+    records = catalog.update(args.files)
     for idx, file in enumerate(args.files):
         print(file)
-        f = TFile(file)
-        keys = [key.GetName() for key in f.GetListOfKeys()]
+        keys = list(records[idx]['entries'].keys())
         global_keys.append(keys)
 
-        # If keys is a subset of global_keys or global_keys is shorter
-        # if global_keys is None:
-        #     global_keys = keys
-        # elif len(np.intersect1d(keys, global_keys)) < len(global_keys):
-        #     # keys is a subset of global keys
-        #     mark_bad_file(file)
-        #     continue
-        # elif len(np.intersect1d(keys, global_keys)) < len(keys):
-        #     # global_keys is a subset of keys
-        #     if arg.files[idx-1] not in bad_files:
-        #         mark_bad_file(arg.files[idx-1])
-        #         global_keys = keys
-                # note that's assuming we don't get 2 files in a row with bad keys...
-
-        # print(keys)
-
-        trees = [f.Get(key) for key in keys]
-
-        nentries = [tree.GetEntries() for tree in trees]
+        nentries = list(records[idx]['entries'].values())
         counts.append(len(np.unique(nentries)))
-        # print(nentries)
-
-        # if len(np.unique(nentries)) != 1:
-        #     mark_bad_file(file)
 
     all_keys = np.unique(np.hstack(global_keys))
     #print(all_keys)
@@ -3,28 +3,32 @@
 #
 # Usage: python3 bin/count_events_in_dataset.py sparse3d_reco_cryoE file1.rot file2.root ... fileN.root
 #
+# Optionally, use `--catalog catalog.json` to reuse (and update) a dataset catalog,
+# and `--num_workers N` to scan the files in parallel.
+#
 # Output: will write in stdout the total event count.
 
-from ROOT import TCanvas, TPad, TFile, TPaveLabel, TPaveText, TChain
-from ROOT import gROOT
-import ROOT
-import pandas as pd
+import os
+import sys
 import numpy as np
 import argparse
 
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.catalog import DatasetCatalog
+
 if __name__ == "__main__":
     argparse = argparse.ArgumentParser(description="Count events in dataset")
     argparse.add_argument("key", type=str, help="TTree name to use to count events")
     argparse.add_argument("files", type=str, nargs="+", help="files to check")
+    argparse.add_argument("--catalog", type=str, default=None, help="path to the dataset catalog")
+    argparse.add_argument("--num_workers", type=int, default=1, help="number of processes used to scan files")
 
     args = argparse.parse_args()
-    entries_count = []
-    for idx, file in enumerate(args.files):
-        f = TFile(file)
-        tree = f.Get("%s_tree" % args.key)
-        nentries = tree.GetEntries()
-        entries_count.append(nentries)
-        f.Close()
+    catalog = DatasetCatalog(args.catalog, args.num_workers)
+    entries_count = catalog.entries(args.files, "%s_tree" % args.key)
+    for file, nentries in zip(args.files, entries_count):
         print("%s... done. (%d events)" % (file, nentries))
 
     print("Counted %d events" % np.sum(entries_count))
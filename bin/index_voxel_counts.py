@@ -0,0 +1,59 @@
+# Script to build the voxel count index of a dataset
+# =================================================
+#
+# Usage: python3 bin/index_voxel_counts.py config.cfg input_data voxel_counts.npy
+#
+# Loads the dataset described in the `iotool` block of the configuration
+# and counts the number of voxels (rows) of the given schema key in each
+# event. Use `--num_workers N` to parse the events in parallel.
+#
+# Output: will write a numpy array with the number of voxels of each TChain
+# entry (-1 for entries which are not part of the dataset), to be used as
+# the `index` of the `VoxelBudgetBatchSampler`.
+
+import os
+import sys
+import yaml
+import numpy as np
+import argparse
+from functools import partial
+from torch.utils.data import DataLoader
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.factories import dataset_factory
+
+
+def count_voxels(batch, key):
+    counts = []
+    for sample in batch:
+        data = sample[key][0] if isinstance(sample[key], tuple) else sample[key]
+        counts.append((sample['index'], len(data)))
+    return counts
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Build the voxel count index of a dataset")
+    argparse.add_argument("config", type=str, help="configuration file")
+    argparse.add_argument("key", type=str, help="schema key used to count voxels")
+    argparse.add_argument("output", type=str, help="path to the output .npy file")
+    argparse.add_argument("--num_workers", type=int, default=1, help="number of DataLoader workers")
+
+    args = argparse.parse_args()
+    cfg = yaml.load(open(args.config, 'r'), Loader=yaml.Loader)
+    schema = cfg['iotool']['dataset']['schema']
+    assert args.key in schema, "Key %s not found in the dataset schema" % args.key
+    cfg['iotool']['dataset']['schema'] = {args.key: schema[args.key]}
+
+    ds = dataset_factory(cfg)
+    event_ids = ds.event_ids()
+    counts = np.full(np.max(event_ids)+1, -1, dtype=np.int64)
+    loader = DataLoader(ds, batch_size=64, num_workers=args.num_workers,
+                        collate_fn=partial(count_voxels, key=args.key))
+    for batch in loader:
+        for index, count in batch:
+            counts[index] = count
+
+    np.save(args.output, counts)
+    print("Indexed %d events (%d voxels on average)" % (len(event_ids), np.mean(counts[event_ids])))
@@ -0,0 +1,33 @@
+# Script to merge the shards of a sharded HDF5 output
+# ===================================================
+#
+# Usage: python3 bin/merge_hdf5_shards.py output.h5 "output_shard*.h5"
+#
+# Builds an index file which exposes the shards written by `HDF5Writer`
+# instances configured with `shard_id` as a single file, using HDF5 virtual
+# datasets (the data of the shards is not copied). The shards are ordered
+# by name. Keep the shards next to the index file (relative paths are used).
+#
+# Output: will write the index file and print the total number of events.
+
+import os
+import sys
+import glob
+import argparse
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.shards import merge_shards
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Merge the shards of a sharded HDF5 output")
+    argparse.add_argument("output", type=str, help="path to the index file to create")
+    argparse.add_argument("shards", type=str, nargs='+', help="paths (or glob patterns) of the shard files")
+
+    args = argparse.parse_args()
+    shard_paths = sorted(set(p for pattern in args.shards for p in glob.glob(pattern)))
+    assert len(shard_paths), 'No shard file found'
+    num_events = merge_shards(args.output, shard_paths)
+    print("Merged %d shards (%d events) into %s" % (len(shard_paths), num_events, args.output))
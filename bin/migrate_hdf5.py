@@ -0,0 +1,127 @@
+# Script to convert HDF5 files to the offset-index (version 2) layout
+# ===================================================================
+#
+# Usage: python3 bin/migrate_hdf5.py input.h5 output.h5
+#
+# Converts a file written by `HDF5Writer` with the version 1 layout (one
+# region reference per event and key) to the version 2 layout (flat arrays,
+# int64 offsets and an events offsets table). The events are processed in
+# blocks of `--block_size` to bound the memory usage. Use `--chunk_size` and
+# `--compression` to set the storage options of the output datasets.
+#
+# Output: will write the converted file and check that it holds the same
+# number of events as the input file.
+
+import os
+import sys
+import h5py
+import numpy as np
+import argparse
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.readers import HDF5Reader
+
+
+def create_dataset(group, key, like, args, offsets=False):
+    width = like.shape[1:] if not offsets else (like.shape[1:] if len(like.shape) > 1 else ())
+    dtype = like.dtype if not offsets else np.int64
+    options = {}
+    if args.chunk_size is not None:
+        options['chunks'] = (args.chunk_size, *width)
+    if args.compression is not None and not offsets:
+        options['compression'] = args.compression
+    dataset = group.create_dataset(key, (int(offsets), *width), maxshape=(None, *width), dtype=dtype, **options)
+    for k, v in like.attrs.items():
+        dataset.attrs[k] = v
+    return dataset
+
+
+def append(dataset, array):
+    first = len(dataset)
+    dataset.resize(first + len(array), axis=0)
+    dataset[first:] = array
+
+
+def concatenate(arrays, like):
+    return np.concatenate(arrays) if len(arrays) else np.empty((0, *like.shape[1:]), dtype=like.dtype)
+
+
+def migrate_key(src, dst, refs):
+    '''
+    Copies the content of one key for a block of events, returns
+    the number of rows (or elements) added for each event.
+    '''
+    if isinstance(src, h5py.Dataset):
+        arrays = HDF5Reader.read_slabs(src, HDF5Reader.region_bounds(src, refs))
+        append(dst, concatenate(arrays, src))
+        return [len(a) for a in arrays]
+
+    index = src['index']
+    rows = HDF5Reader.read_slabs(index, HDF5Reader.region_bounds(index, refs))
+    if len(index.shape) == 1:
+        elements = src['elements']
+        el_refs = np.concatenate(rows)
+        arrays = HDF5Reader.read_slabs(elements, HDF5Reader.region_bounds(elements, el_refs))
+        append(dst['elements'], concatenate(arrays, elements))
+        offsets = dst['index'][-1] + np.cumsum([len(a) for a in arrays])
+        append(dst['index'], offsets)
+        return [len(row) for row in rows]
+
+    offsets = np.empty((len(rows), index.shape[1]), dtype=np.int64)
+    for i in range(index.shape[1]):
+        elements = src[f'element_{i}']
+        arrays = HDF5Reader.read_slabs(elements, HDF5Reader.region_bounds(elements, [row[0, i] for row in rows]))
+        append(dst[f'element_{i}'], concatenate(arrays, elements))
+        offsets[:, i] = dst['index'][-1, i] + np.cumsum([len(a) for a in arrays])
+    append(dst['index'], offsets)
+    return [1] * len(rows)
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser(description="Convert an HDF5 file to the version 2 layout")
+    argparse.add_argument("input", type=str, help="path to the input (version 1) HDF5 file")
+    argparse.add_argument("output", type=str, help="path to the output (version 2) HDF5 file")
+    argparse.add_argument("--block_size", type=int, default=1000, help="number of events converted at once")
+    argparse.add_argument("--chunk_size", type=int, default=None, help="number of rows per chunk")
+    argparse.add_argument("--compression", type=str, default=None, help="compression filter")
+
+    args = argparse.parse_args()
+    with h5py.File(args.input, 'r') as src, h5py.File(args.output, 'w') as dst:
+        assert src.attrs.get('version', 1) == 1, 'The input file is already in the version 2 layout'
+        dst.attrs['version'] = 2
+        if 'info' in src:
+            src.copy('info', dst)
+
+        # Recreate the structure of the file
+        keys = {}
+        names = src['events'].dtype.names
+        for key in names:
+            path = key
+            for cat in ['data', 'result']:
+                if cat in src and key in src[cat]:
+                    path = f'{cat}/{key}'
+            keys[key] = path
+            group = dst.require_group(os.path.dirname(path)) if '/' in path else dst
+            if isinstance(src[path], h5py.Dataset):
+                create_dataset(group, key, src[path], args)
+            else:
+                subgroup = group.create_group(key)
+                for name, dataset in src[path].items():
+                    create_dataset(subgroup, name, dataset, args, offsets=name=='index')
+
+        events = dst.create_dataset('events', (1,), maxshape=(None,), dtype=[(k, np.int64) for k in names])
+
+        # Convert the events, block by block
+        num_events = len(src['events'])
+        for start in range(0, num_events, args.block_size):
+            block = src['events'][start:start + args.block_size]
+            offsets = np.empty(len(block), dtype=events.dtype)
+            for key in names:
+                counts = migrate_key(src[keys[key]], dst[keys[key]], block[key])
+                offsets[key] = events[-1][key] + np.cumsum(counts)
+            append(events, offsets)
+
+        assert len(dst['events']) == num_events + 1
+        print("Converted %d events to %s" % (num_events, args.output))
@@ -0,0 +1,142 @@
+import queue
+import atexit
+import traceback
+import multiprocessing as mp
+
+
+def _write_batches(writer_class, writer_cfg, batch_queue, error_queue):
+    '''
+    Body of the background writer process.
+
+    Parameters
+    ----------
+    writer_class : type
+        Writer class, instantiated in the writer process
+    writer_cfg : dict
+        Writer configuration
+    batch_queue : multiprocessing.Queue
+        Queue of (data_blob, result_blob, cfg) batches, `None` to stop
+    error_queue : multiprocessing.Queue
+        Queue used to report an error (formatted traceback) to the main process
+    '''
+    try:
+        writer = writer_class(**writer_cfg)
+        while True:
+            batch = batch_queue.get()
+            if batch is None:
+                break
+            writer.append(*batch)
+        if hasattr(writer, 'close'):
+            writer.close()
+    except BaseException:
+        error_queue.put(traceback.format_exc())
+
+
+class BackgroundWriter:
+    '''
+    Writer which hands the batches over to a dedicated process through a
+    bounded queue. The writer process instantiates the actual writer and
+    appends the batches in the order they are received.
+
+    When the queue is full, `append` blocks until the writer process has
+    caught up. An error raised in the writer process is raised in the
+    main process by the next call to `append` or `close`. Closing the
+    writer (done automatically at exit) waits for all the queued batches
+    to be written and the file to be closed.
+
+    .. code-block:: yaml
+
+        iotool:
+          writer:
+            name: HDF5Writer
+            file_name: output.h5
+            background: True
+            queue_size: 8
+    '''
+
+    def __init__(self, writer_class, writer_cfg, queue_size=8):
+        '''
+        Start the writer process.
+
+        Parameters
+        ----------
+        writer_class : type
+            Writer class (e.g. `HDF5Writer`)
+        writer_cfg : dict
+            Writer configuration (keyword arguments of the writer class)
+        queue_size : int, default 8
+            Maximum number of batches waiting to be written
+        '''
+        # Spawn the process, as forking a process with CUDA and I/O threads is unsafe
+        context = mp.get_context('spawn')
+        self._batch_queue = context.Queue(maxsize=queue_size)
+        self._error_queue = context.Queue()
+        self._process = context.Process(target=_write_batches,
+                args=(writer_class, writer_cfg, self._batch_queue, self._error_queue), daemon=True)
+        self._process.start()
+        self._cfg_sent = False
+        self._closed = False
+        atexit.register(self.close)
+
+    def append(self, data_blob=None, result_blob=None, cfg=None):
+        '''
+        Queues a batch to be written, blocks if the queue is full.
+
+        Parameters
+        ----------
+        data_blob : dict
+            Dictionary containing the input data
+        result_blob : dict
+            Dictionary containing the output of the reconstruction chain
+        cfg : dict
+            Dictionary containing the ML chain configuration
+        '''
+        assert not self._closed, 'Cannot append to a closed writer'
+        self._put((data_blob, result_blob, cfg if not self._cfg_sent else None))
+        self._cfg_sent = True
+
+    def close(self):
+        '''
+        Waits for the queued batches to be written, stops the writer process.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._put(None)
+        self._process.join()
+        self._check()
+
+    def _put(self, item):
+        '''
+        Puts an item in the queue, checks for errors while waiting.
+
+        Parameters
+        ----------
+        item : tuple
+            Batch to write, `None` to stop the writer process
+        '''
+        while True:
+            self._check()
+            try:
+                self._batch_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _check(self):
+        '''
+        Raises the error reported by the writer process, if any.
+        '''
+        try:
+            error = self._error_queue.get_nowait()
+        except queue.Empty:
+            if self._process.is_alive() or self._process.exitcode == 0:
+                return
+            error = f'Writer process exited with code {self._process.exitcode}'
+
+        self._closed = True
+        atexit.unregister(self.close)
+        self._batch_queue.cancel_join_thread()
+        self._process.join()
+        raise RuntimeError(f'Background writer failed:\n{error}')
@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import glob
+import shutil
+import socket
+import hashlib
+import numpy as np
+
+
+class ParserCache:
+    '''
+    Memory-mapped, offset-indexed store of parser outputs.
+
+    The store is keyed by a hash of the file list (paths, sizes and
+    modification times), of the data schema (parsers and their arguments)
+    and of the cache format version. Any change to one of these produces
+    a new key, which invalidates the previous cache.
+
+    On the first pass over a dataset, every process which parses an event
+    appends the array outputs of the parsers to its own shard. A shard is
+    made of three files:
+    - `<shard>.json`: layout of the cached keys (dtype and trailing shape)
+    - `<shard>.bin`: raw bytes of the arrays, appended event by event
+    - `<shard>.idx`: fixed-width int64 records (entry, offsets, lengths)
+
+    Any process can then read the events stored by any other process as
+    zero-copy views into the memory-mapped data files, without touching
+    the ROOT files. Only numpy arrays (or tuples of numpy arrays) are
+    cached, other parser outputs are always parsed on the fly.
+
+    .. code-block:: yaml
+
+        iotool:
+          dataset:
+            cache:
+              path: /scratch/mlreco_cache
+              max_size: 100 # GB
+              clear: false
+    '''
+    VERSION = 1
+    ALIGN   = 8
+
+    def __init__(self, files, schema, path, max_size=-1, clear=False):
+        '''
+        Initialize the cache directory associated with a dataset.
+
+        Parameters
+        ----------
+        files : list
+            List of ROOT file paths which make up the dataset
+        schema : dict
+            Data schema (parser names and arguments) of the dataset
+        path : str
+            Root directory under which all the caches are stored
+        max_size : float, default -1
+            Size budget of the cache root directory in GB. Stale caches
+            are evicted first (least recently used first). Once the budget
+            is reached, new events are no longer cached. If negative,
+            the cache size is not limited.
+        clear : bool, default False
+            If `True`, remove any existing cache associated with this dataset
+        '''
+        # Store the basic parameters
+        self.root     = path
+        self.key      = self.get_key(files, schema)
+        self.path     = os.path.join(path, self.key)
+        self.max_size = int(max_size * 1e9) if max_size > 0 else -1
+
+        # Initialize the cache directory, evict stale caches if needed
+        if clear and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path, exist_ok=True)
+        os.utime(self.path)
+        self.evict()
+
+        # Process-specific attributes are initialized lazily, so that
+        # each DataLoader worker has its own shard and its own file handles
+        self._pid = None
+
+    @classmethod
+    def get_key(cls, files, schema):
+        '''
+        Computes the hash which identifies a dataset.
+
+        Parameters
+        ----------
+        files : list
+            List of ROOT file paths which make up the dataset
+        schema : dict
+            Data schema (parser names and arguments) of the dataset
+
+        Returns
+        -------
+        str
+            Hexadecimal hash of the dataset
+        '''
+        files = [[os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)] for f in files]
+        content = {'version': cls.VERSION, 'files': files, 'schema': schema}
+        content = json.dumps(content, sort_keys=True, default=str)
+
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def get_size(path):
+        '''
+        Computes the total size of the files in a directory.
+
+        Parameters
+        ----------
+        path : str
+            Path to the directory
+
+        Returns
+        -------
+        int
+            Total size in bytes
+        '''
+        size = 0
+        for f in glob.glob(os.path.join(path, '*')):
+            try:
+                size += os.path.getsize(f)
+            except OSError:
+                pass # File removed in the meantime
+
+        return size
+
+    def evict(self):
+        '''
+        If the cache root directory exceeds the size budget, remove stale
+        caches (i.e. caches of other datasets or of modified files),
+        starting with the least recently used one.
+        '''
+        if self.max_size < 0:
+            return
+
+        caches = [d for d in glob.glob(os.path.join(self.root, '*')) if os.path.isdir(d)]
+        sizes  = {d: self.get_size(d) for d in caches}
+        total  = sum(sizes.values())
+        for d in sorted(caches, key=os.path.getmtime):
+            if total <= self.max_size:
+                break
+            if d == self.path:
+                continue
+            print('Evicting stale parser cache', d)
+            shutil.rmtree(d, ignore_errors=True)
+            total -= sizes[d]
+
+    def _check_process(self):
+        '''
+        Resets the process-specific attributes if the cache is used by
+        a new process for the first time (e.g. a forked DataLoader worker).
+        '''
+        if self._pid == os.getpid():
+            return
+
+        self._pid      = os.getpid()
+        self._shard    = None
+        self._layout   = None
+        self._full     = False
+        self._index    = {}
+        self._shards   = {}
+
+    def _refresh(self):
+        '''
+        Reads the records appended to the shard indexes since the last refresh.
+        '''
+        for idx_path in glob.glob(os.path.join(self.path, '*.idx')):
+            name = os.path.basename(idx_path)[:-4]
+            if name not in self._shards:
+                with open(os.path.join(self.path, name+'.json'), 'r') as f:
+                    layout = json.load(f)
+                rec_size = 1 + 2*sum([len(v['slots']) for v in layout.values()])
+                self._shards[name] = {'layout': layout, 'rec_size': rec_size,
+                        'pos': 0, 'records': None, 'data': None}
+
+            # Only read complete records
+            shard = self._shards[name]
+            nbytes = 8 * shard['rec_size']
+            with open(idx_path, 'rb') as f:
+                f.seek(shard['pos'])
+                buff = f.read()
+            num_records = len(buff) // nbytes
+            if not num_records:
+                continue
+            records = np.frombuffer(buff[:num_records*nbytes], dtype=np.int64).reshape(-1, shard['rec_size'])
+            shard['records'] = records if shard['records'] is None else np.vstack([shard['records'], records])
+            shard['pos'] += num_records * nbytes
+            offset = len(shard['records']) - num_records
+            for i, entry in enumerate(records[:, 0]):
+                if entry not in self._index:
+                    self._index[entry] = (name, offset + i)
+
+    def load(self, entry):
+        '''
+        Fetches the cached parser outputs of one event.
+
+        Parameters
+        ----------
+        entry : int
+            Index of the event in the TChain
+
+        Returns
+        -------
+        dict
+            Dictionary of cached parser outputs (empty if the event is not cached)
+        '''
+        self._check_process()
+        if entry not in self._index:
+            self._refresh()
+            if entry not in self._index:
+                return {}
+
+        # Make sure the memory map covers the whole record
+        name, rec_id = self._index[entry]
+        shard = self._shards[name]
+        record = shard['records'][rec_id]
+        end = np.max(record[1::2] + record[2::2]) if len(record) > 1 else 0
+        if shard['data'] is None or len(shard['data']) < end:
+            data_path = os.path.join(self.path, name+'.bin')
+            if os.path.getsize(data_path):
+                shard['data'] = np.memmap(data_path, dtype=np.uint8, mode='c')
+            else:
+                shard['data'] = np.empty(0, dtype=np.uint8)
+
+        # Build views into the data file
+        result, col = {}, 1
+        for key, value in shard['layout'].items():
+            arrays = []
+            for dtype, shape in value['slots']:
+                start, nbytes = record[col], record[col+1]
+                array = shard['data'][start:start+nbytes].view(dtype)
+                arrays.append(array.reshape(-1, *shape))
+                col += 2
+            result[key] = tuple(arrays) if value['type'] == 'tuple' else arrays[0]
+
+        return result
+
+    @staticmethod
+    def _get_layout(value):
+        '''
+        Finds the layout of a parser output, if it can be cached.
+
+        Parameters
+        ----------
+        value : object
+            Output of a parser
+
+        Returns
+        -------
+        dict
+            Layout of the output, `None` if it cannot be cached
+        '''
+        arrays = value if isinstance(value, tuple) else [value]
+        for array in arrays:
+            if not isinstance(array, np.ndarray) or not array.ndim or array.dtype.hasobject:
+                return None
+
+        slots = [[a.dtype.str, list(a.shape[1:])] for a in arrays]
+        return {'type': 'tuple' if isinstance(value, tuple) else 'array', 'slots': slots}
+
+    def _open_shard(self, result):
+        '''
+        Creates the shard owned by the current process.
+
+        Parameters
+        ----------
+        result : dict
+            Dictionary of parser outputs used to define the layout
+        '''
+        layout = {}
+        for key, value in result.items():
+            key_layout = self._get_layout(value)
+            if key_layout is not None:
+                layout[key] = key_layout
+
+        name = f'{socket.gethostname()}_{os.getpid()}_{int(time.time()*1e6)}'
+        base = os.path.join(self.path, name)
+        with open(base+'.json.tmp', 'w') as f:
+            json.dump(layout, f)
+        os.replace(base+'.json.tmp', base+'.json')
+
+        self._layout = layout
+        self._shard  = {'name': name, 'data': open(base+'.bin', 'ab'),
+                'index': open(base+'.idx', 'ab'), 'size': 0}
+
+    def store(self, entry, result):
+        '''
+        Appends the parser outputs of one event to the shard of the current process.
+
+        Parameters
+        ----------
+        entry : int
+            Index of the event in the TChain
+        result : dict
+            Dictionary of parser outputs
+        '''
+        self._check_process()
+        if self._full or entry in self._index:
+            return
+
+        # Initialize the shard on the first call
+        if self._shard is None:
+            self._open_shard(result)
+
+        # Check that the output matches the layout, gather the arrays to store
+        arrays = []
+        for key, value in self._layout.items():
+            if key not in result or self._get_layout(result[key]) != value:
+                return
+            arrays.extend(result[key] if value['type'] == 'tuple' else [result[key]])
+
+        # Check the size budget
+        nbytes = [a.nbytes + (-a.nbytes) % self.ALIGN for a in arrays]
+        if self.max_size > 0 and self.get_size(self.path) + sum(nbytes) > self.max_size:
+            print('Parser cache reached its size budget, new events will not be cached')
+            self._full = True
+            return
+
+        # Write the data first, then the index record which points to it
+        record = [entry]
+        for a, n in zip(arrays, nbytes):
+            record.extend([self._shard['size'], a.nbytes])
+            self._shard['data'].write(np.ascontiguousarray(a).tobytes() + bytes(n - a.nbytes))
+            self._shard['size'] += n
+        self._shard['data'].flush()
+        self._shard['index'].write(np.array(record, dtype=np.int64).tobytes())
+        self._shard['index'].flush()
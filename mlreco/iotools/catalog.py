@@ -0,0 +1,225 @@
+import os
+import json
+import numpy as np
+from multiprocessing import Pool
+
+
+def scan_root_file(path):
+    '''
+    Lists the objects stored in a ROOT file and their entry counts.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ROOT file
+
+    Returns
+    -------
+    dict
+        Dictionary of (object name, number of entries) pairs (empty
+        if the file cannot be opened)
+    '''
+    from ROOT import TFile
+    f = TFile.Open(path, 'READ')
+    if not f or f.IsZombie():
+        return {}
+    entries = {}
+    for key in f.GetListOfKeys():
+        name = key.GetName()
+        obj  = f.Get(name)
+        entries[name] = int(obj.GetEntries()) if hasattr(obj, 'GetEntries') else 0
+    f.Close()
+
+    return entries
+
+
+def scan_hdf5_file(path):
+    '''
+    Lists the top-level objects stored in an HDF5 file. Only the
+    `events` dataset has a meaningful number of entries (in the version 2
+    layout, the `events` offsets table has one more row than events).
+
+    Parameters
+    ----------
+    path : str
+        Path to the HDF5 file
+
+    Returns
+    -------
+    dict
+        Dictionary of (object name, number of entries) pairs (empty
+        if the file cannot be opened)
+    '''
+    import h5py
+    try:
+        with h5py.File(path, 'r') as f:
+            entries = {k: len(f[k]) if isinstance(f[k], h5py.Dataset) else 0 for k in f.keys()}
+            if 'events' in entries and f.attrs.get('version', 1) > 1:
+                entries['events'] -= 1
+    except OSError:
+        return {}
+
+    return entries
+
+
+def scan_file(path):
+    '''
+    Scans a single file based on its extension. A file which cannot be
+    opened is recorded with no entries, so that it can be flagged as bad.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ROOT or HDF5 file
+
+    Returns
+    -------
+    tuple
+        (path, file record)
+    '''
+    record = {'mtime': os.path.getmtime(path), 'size': os.path.getsize(path)}
+    if os.path.splitext(path)[-1] in ['.h5', '.hdf5']:
+        record['entries'] = scan_hdf5_file(path)
+    else:
+        record['entries'] = scan_root_file(path)
+
+    return path, record
+
+
+class DatasetCatalog:
+    '''
+    Sidecar catalog of the content of a set of ROOT/HDF5 files.
+
+    For each file, the catalog records the names of the stored objects
+    (e.g. the `*_tree` TTrees of a LArCV file or the `events` dataset of
+    an HDF5 file), their number of entries, the file size and its
+    modification time. The catalog is stored as a JSON file and reused
+    across jobs. Only files which are new or whose size or modification
+    time changed are rescanned, in parallel over a pool of processes.
+
+    .. code-block:: yaml
+
+        iotool:
+          dataset:
+            catalog:
+              path: /path/to/catalog.json
+              num_workers: 8
+    '''
+
+    def __init__(self, path=None, num_workers=1):
+        '''
+        Loads an existing catalog, if it exists.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path to the JSON catalog file. If not specified, the
+            catalog is only kept in memory.
+        num_workers : int, default 1
+            Number of processes used to scan files
+        '''
+        self.path        = path
+        self.num_workers = num_workers
+        self.records     = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.records = json.load(f)
+
+    def is_stale(self, path):
+        '''
+        Checks whether a file must be (re)scanned.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file
+
+        Returns
+        -------
+        bool
+            `True` if the file is not in the catalog or if it changed
+        '''
+        if path not in self.records:
+            return True
+        record = self.records[path]
+        return record['mtime'] != os.path.getmtime(path) or record['size'] != os.path.getsize(path)
+
+    def update(self, files):
+        '''
+        Scans the files which are missing from the catalog (or which
+        changed since they were scanned) and saves the catalog.
+
+        Parameters
+        ----------
+        files : list
+            List of file paths
+
+        Returns
+        -------
+        list
+            List of file records, in the order of the input files
+        '''
+        paths = [os.path.abspath(f) for f in files]
+        stale = [p for p in np.unique(paths) if self.is_stale(p)]
+        if len(stale):
+            print(f'Scanning {len(stale)} file(s) to update the dataset catalog')
+            if self.num_workers > 1 and len(stale) > 1:
+                with Pool(min(self.num_workers, len(stale))) as pool:
+                    scanned = pool.map(scan_file, stale)
+            else:
+                scanned = [scan_file(p) for p in stale]
+            self.records.update(dict(scanned))
+            self.save()
+
+        return [self.records[p] for p in paths]
+
+    def save(self):
+        '''
+        Writes the catalog to its JSON file (atomically).
+        '''
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.records, f)
+        os.replace(tmp_path, self.path)
+
+    def entries(self, files, name):
+        '''
+        Returns the number of entries of an object in each file.
+
+        Parameters
+        ----------
+        files : list
+            List of file paths
+        name : str
+            Name of the object (e.g. `sparse3d_pcluster_tree` or `events`)
+
+        Returns
+        -------
+        np.ndarray
+            (F) Number of entries in each file
+        '''
+        counts = []
+        for f, record in zip(files, self.update(files)):
+            assert len(record['entries']), f'Could not read file {f}'
+            assert name in record['entries'], f'Object {name} not found in {f}'
+            counts.append(record['entries'][name])
+
+        return np.array(counts, dtype=np.int64)
+
+    def keys(self, files):
+        '''
+        Returns the list of object names stored in each file.
+
+        Parameters
+        ----------
+        files : list
+            List of file paths
+
+        Returns
+        -------
+        list
+            List of object names for each file
+        '''
+        return [list(record['entries'].keys()) for record in self.update(files)]
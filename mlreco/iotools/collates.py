@@ -9,10 +9,67 @@ import numpy as np
 from mlreco.utils.volumes import VolumeBoundaries
 
 
-def CollateSparse(batch, boundaries=None):
+def _batch_fill(blocks, batch_dtype, vb=None, dim=None):
+    '''
+    Fills a single preallocated buffer with the batched version of a list
+    of per-sample column blocks, i.e. [batch_id, block_0, block_1, ...].
+
+    Parameters
+    ----------
+    blocks : list
+        List (one per sample) of lists of 2D arrays with aligned rows
+    batch_dtype : np.dtype
+        Type of the batch ID column, which takes part in the output type
+    vb : VolumeBoundaries, optional
+        If provided, the (batch_id, coordinates) columns of each sample are
+        split into virtual volumes and the sample rows are lexsorted in place
+    dim : int, optional
+        Number of coordinate columns following the batch ID column
+
+    Returns
+    -------
+    np.ndarray
+        (N, 1+C) Batched tensor
+    np.ndarray
+        (B*V+1) Offsets of each (virtual) batch entry in the batched tensor
+    '''
+    # Size the output buffer once, with the type numpy would promote to
+    lengths = np.array([len(sample[0]) for sample in blocks], dtype=np.int64)
+    starts  = np.concatenate([[0], np.cumsum(lengths)])
+    widths  = [b.shape[1] for b in blocks[0]]
+    dtype   = np.result_type(batch_dtype, *[b.dtype for sample in blocks for b in sample])
+    output  = np.empty((starts[-1], 1+sum(widths)), dtype=dtype)
+
+    # Fill the buffer sample by sample, sort each sample within its slice
+    num_volumes = vb.num_volumes() if vb is not None else 1
+    counts = np.zeros((len(blocks), num_volumes), dtype=np.int64)
+    for batch_id, sample in enumerate(blocks):
+        view = output[starts[batch_id]:starts[batch_id+1]]
+        view[:, 0] = batch_id
+        col = 1
+        for b, w in zip(sample, widths):
+            view[:, col:col+w] = b
+            col += w
+        if vb is not None:
+            view[:, :dim+1], perm = vb.split(view[:, :dim+1])
+            view[:] = view[perm]
+            volume_ids = view[:, 0].astype(np.int64) - batch_id*num_volumes
+            counts[batch_id] = np.bincount(volume_ids, minlength=num_volumes)
+        else:
+            counts[batch_id] = len(view)
+
+    offsets = np.concatenate([[0], np.cumsum(counts.flatten())])
+
+    return output, offsets
+
+
+def CollateSparse(batch, boundaries=None, batch_offsets=False):
     '''
     Collate sparse input.
 
+    Each tensor is filled in place into a single buffer sized up front,
+    with a leading batch ID column.
+
     Parameters
     ----------
     batch : a list of dictionary
@@ -20,6 +77,11 @@ def CollateSparse(batch, boundaries=None):
     boundaries: list, optional, default is None
         This contains a list of volume boundaries if you want to process distinct volumes independently. See VolumeBoundaries
         documentation for more details and explanations.
+    batch_offsets: bool, optional, default is False
+        If True, the output contains an additional `batch_offsets` key which maps each batched
+        tensor key to an array of (B*V+1) offsets, such that the rows of (virtual) batch entry
+        b are [offsets[b], offsets[b+1]). This can be used to slice tensors by batch entry
+        without rebuilding batch masks (see `Unwrapper`).
 
     Returns
     -------
@@ -33,43 +95,16 @@ def CollateSparse(batch, boundaries=None):
     - The input batch is a tuple of length >=1. Length 0 tuple will fail (IndexError).
     - The dictionaries in the input batch tuple are assumed to have identical list of keys.
     '''
-    import MinkowskiEngine as ME
-
     split_boundaries = boundaries is not None
     vb = VolumeBoundaries(boundaries) if split_boundaries else None
 
-    result = {}
+    result, offsets = {}, {}
     concat = np.concatenate
     for key in batch[0].keys():
         if key == 'particles_label':
-
-            coords = [sample[key][0] for sample in batch]
-            features = [sample[key][1] for sample in batch]
-
-            batch_index = np.full(shape=(coords[0].shape[0], 1),
-                                  fill_value=0,
-                                  dtype=np.float32)
-
-            coords_minibatch = []
-            #feats_minibatch = []
-
-            for bidx, sample in enumerate(batch):
-                batch_index = np.full(shape=(coords[bidx].shape[0], 1),
-                                      fill_value=bidx, dtype=np.float32)
-                batched_coords = concat([batch_index,
-                                         coords[bidx],
-                                         features[bidx]], axis=1)
-
-                coords_minibatch.append(batched_coords)
-
-            #coords = torch.Tensor(concat(coords_minibatch, axis=0))
-            dim = coords[0].shape[1]
-            coords = concat(coords_minibatch, axis=0)
-            if split_boundaries:
-                coords[:, :dim+1], perm = vb.split(coords[:, :dim+1])
-                coords = coords[perm]
-
-            result[key] = coords
+            dim = batch[0][key][0].shape[1]
+            blocks = [[sample[key][0], sample[key][1]] for sample in batch]
+            result[key], offsets[key] = _batch_fill(blocks, np.float32, vb, dim)
         else:
             if isinstance(batch[0][key], tuple) and \
                isinstance(batch[0][key][0], np.ndarray) and \
@@ -89,46 +124,21 @@ def CollateSparse(batch, boundaries=None):
                 # + forces us to convert input data to .numpy() in visualization,
                 # event if we do not run any network.
                 # Hence keeping the homemade collate for now.
-
-                # coords = [sample[key][0] for sample in batch]
-                # features = [sample[key][1] for sample in batch]
-                # print(coords, features)
-                # coords, features = ME.utils.sparse_collate(coords, features)
-                # print('after', coords, features)
-                # result[key] = torch.cat([coords.float(),
-                #                          features.float()], dim=1)
-                voxels = concat( [ concat( [np.full(shape=[len(sample[key][0]),1], fill_value=batch_id, dtype=np.int32),
-                                            sample[key][0]],
-                                           axis=1 ) for batch_id, sample in enumerate(batch) ],
-                                 axis = 0)
-                data = concat([sample[key][1] for sample in batch], axis=0)
-
-                if split_boundaries:
-                    voxels, perm = vb.split(voxels)
-                    voxels = voxels[perm]
-                    data = data[perm]
-
-                result[key] = concat([voxels, data], axis=1)
+                dim = batch[0][key][0].shape[1]
+                blocks = [[sample[key][0], sample[key][1]] for sample in batch]
+                result[key], offsets[key] = _batch_fill(blocks, np.int32, vb, dim)
 
             elif isinstance(batch[0][key],np.ndarray) and \
                  len(batch[0][key].shape) == 1:
                 #
-                result[key] = concat( [ concat( [np.full(shape=[len(sample[key]),1],
-                                                 fill_value=batch_id,
-                                                 dtype=np.float32),
-                                                 np.expand_dims(sample[key],1)],
-                                                 axis=1 ) \
-                    for batch_id,sample in enumerate(batch) ], axis=0)
+                blocks = [[np.expand_dims(sample[key], 1)] for sample in batch]
+                result[key], offsets[key] = _batch_fill(blocks, np.float32)
 
             elif isinstance(batch[0][key],np.ndarray) and len(batch[0][key].shape)==2:
                 # for tensors that does not come with a coordinate tensor
                 # ex. particle_graph
-                result[key] =  concat( [ concat( [np.full(shape=[len(sample[key]),1],
-                                                          fill_value=batch_id,
-                                                          dtype=np.float32),
-                                                  sample[key]],
-                                                axis=1 ) for batch_id,sample in enumerate(batch) ],
-                                    axis=0)
+                blocks = [[sample[key]] for sample in batch]
+                result[key], offsets[key] = _batch_fill(blocks, np.float32)
 
             elif isinstance(batch[0][key], list) and len(batch[0][key]) and isinstance(batch[0][key][0], tuple):
                 # For multi-scale labels (probably deprecated)
@@ -145,8 +155,11 @@ def CollateSparse(batch, boundaries=None):
             else:
 
                 result[key] = [sample[key] for sample in batch]
-    return result
 
+    if batch_offsets:
+        result['batch_offsets'] = offsets
+
+    return result
 
 
 def CollateDense(batch):
@@ -163,3 +176,31 @@ def CollateDense(batch):
     for key in batch[0].keys():
         result[key] = np.array([sample[key] for sample in batch])
     return result
+
+
+def CollateHDF5(batch):
+    """
+    Collate entries read back from HDF5 files by the `HDF5Dataset`.
+
+    Each value is nested in a list with one element per batch entry, which
+    is the format `HDF5Reader.get(idx, nested=True)` produces for a single
+    entry and the one the analysis tools builders expect.
+
+    Parameters
+    ----------
+    batch : list
+        List of (data_blob, result_blob) pairs (or merged blobs if the
+        files do not split input data and results)
+
+    Returns
+    -------
+    Union[dict, tuple]
+        Batched data_blob and result_blob (or batched merged blob)
+    """
+    def nest(blobs):
+        return {key: [blob[key] for blob in blobs] for key in blobs[0].keys()}
+
+    if isinstance(batch[0], tuple):
+        return tuple(nest(list(blobs)) for blobs in zip(*batch))
+
+    return nest(batch)
@@ -2,6 +2,7 @@ import os, glob, inspect
 import numpy as np
 from torch.utils.data import Dataset
 import mlreco.iotools.parsers
+from mlreco.iotools.parsers.memo import EventMemo
 
 class LArCVDataset(Dataset):
     """
@@ -13,7 +14,7 @@ class LArCVDataset(Dataset):
     can be configured with arbitrary number of parser functions where each function can take arbitrary number of
     LArCV event data objects. The assumption is that each data chunk respects the LArCV event boundary.
     """
-    def __init__(self, data_schema, data_keys, limit_num_files=0, limit_num_samples=0, event_list=None, skip_event_list=None):
+    def __init__(self, data_schema, data_keys, limit_num_files=0, limit_num_samples=0, event_list=None, skip_event_list=None, cache=None, catalog=None, parser_report_step=0):
         """
         Instantiates the LArCVDataset.
 
@@ -36,6 +37,13 @@ class LArCVDataset(Dataset):
             a list of integers to specify which event (ttree index) to process
         skip_event_list : list
             a list of integers to specify which events (ttree index) to skip
+        cache : dict, optional
+            configuration of the parser output cache (see `ParserCache`)
+        catalog : dict, optional
+            configuration of the dataset catalog used to count entries (see `DatasetCatalog`)
+        parser_report_step : int
+            if positive, print the time spent per parser and the number of parser memo hits
+            every `parser_report_step` events (in each DataLoader worker)
         """
 
         # Create file list
@@ -59,6 +67,7 @@ class LArCVDataset(Dataset):
         # Instantiate parsers
         self._data_keys = []
         self._data_parsers = []
+        self._data_trees = []
         self._trees = {}
         for key, value in data_schema.items():
             # Check that the schema is a dictionary
@@ -79,26 +88,40 @@ class LArCVDataset(Dataset):
             # Append data key and parsers
             self._data_keys.append(key)
             self._data_parsers.append((getattr(mlreco.iotools.parsers, value['parser']), value['args']))
+            self._data_trees.append([])
             for arg_name, data_key in value['args'].items():
                 if 'event' not in arg_name: continue
                 if 'event_list' not in arg_name: data_key = [data_key]
                 for k in data_key:
                     if k not in self._trees: self._trees[k] = None
+                    if k not in self._data_trees[-1]: self._data_trees[-1].append(k)
 
         self._data_keys.append('index')
 
-        # Prepare TTrees and load files
-        from ROOT import TChain
+        # Prepare TTrees and load files. If a catalog is provided, use
+        # it to count the entries instead of opening every file.
+        if catalog is not None:
+            from mlreco.iotools.catalog import DatasetCatalog
+            catalog = DatasetCatalog(**catalog)
         self._entries = None
+        self._file_entries = None
         for data_key in self._trees.keys():
             # Check data TTree exists, and entries are identical across >1 trees.
             # However do NOT register these TTrees in self._trees yet in order to support >1 workers by DataLoader
             print('Loading tree',data_key)
-            chain = TChain(data_key + "_tree")
-            for f in self._files:
-                chain.AddFile(f)
-            if self._entries is not None: assert(self._entries == chain.GetEntries())
-            else: self._entries = chain.GetEntries()
+            if catalog is not None:
+                file_entries = catalog.entries(self._files, data_key + '_tree')
+                if self._file_entries is not None: assert(np.all(self._file_entries == file_entries))
+                else: self._file_entries = file_entries
+                entries = int(np.sum(file_entries))
+            else:
+                from ROOT import TChain
+                chain = TChain(data_key + "_tree")
+                for f in self._files:
+                    chain.AddFile(f)
+                entries = chain.GetEntries()
+            if self._entries is not None: assert(self._entries == entries)
+            else: self._entries = entries
 
         # If event list is provided, register
         if event_list is None:
@@ -131,6 +154,17 @@ class LArCVDataset(Dataset):
         # Flag to identify if Trees are initialized or not
         self._trees_ready=False
 
+        # Initialize the per-event memo shared by the parsers
+        self._memo = EventMemo()
+        self._parser_report_step = parser_report_step
+
+        # If requested, initialize the parser output cache
+        self._cache = None
+        if cache is not None:
+            from mlreco.iotools.cache import ParserCache
+            self._cache = ParserCache(self._files, data_schema, **cache)
+            print('Caching parser outputs in', self._cache.path)
+
     @staticmethod
     def list_data(f):
         from ROOT import TFile
@@ -168,12 +202,42 @@ class LArCVDataset(Dataset):
         lns         = 0 if not 'limit_num_samples' in cfg else int(cfg['limit_num_samples'])
         event_list  = LArCVDataset.get_event_list(cfg, 'event_list')
         skip_event_list = LArCVDataset.get_event_list(cfg, 'skip_event_list')
+        cache       = cfg.get('cache', None)
+        catalog     = cfg.get('catalog', None)
+        prs         = cfg.get('parser_report_step', 0)
 
-        return LArCVDataset(data_schema=data_schema, data_keys=data_keys, limit_num_files=lnf, event_list=event_list, skip_event_list=skip_event_list)
+        return LArCVDataset(data_schema=data_schema, data_keys=data_keys, limit_num_files=lnf, event_list=event_list, skip_event_list=skip_event_list, cache=cache, catalog=catalog, parser_report_step=prs)
 
     def data_keys(self):
         return self._data_keys
 
+    def event_ids(self):
+        """
+        Returns the index of each sample in the TChain.
+
+        Returns
+        -------
+        np.ndarray
+            (N) Array of TChain entries, one per sample
+        """
+        return self._event_list[:len(self)]
+
+    def file_ids(self):
+        """
+        Returns the index of the file in which each sample is stored.
+
+        Returns
+        -------
+        np.ndarray
+            (N) Array of file indices, one per sample
+        """
+        if self._file_entries is None:
+            from mlreco.iotools.catalog import DatasetCatalog
+            tree = next(iter(self._trees.keys())) + '_tree'
+            self._file_entries = DatasetCatalog().entries(self._files, tree)
+        offsets = np.cumsum(self._file_entries)
+        return np.searchsorted(offsets, self.event_ids(), side='right')
+
     def __len__(self):
         return self._entries
 
@@ -182,32 +246,120 @@ class LArCVDataset(Dataset):
         # convert to actual index: by default, it is idx, but not if event_list provided
         event_idx = self._event_list[idx]
 
-        # If this is the first data loading, instantiate chains
-        if not self._trees_ready:
-            from ROOT import TChain
-            for key in self._trees.keys():
-                chain = TChain(key + '_tree')
-                for f in self._files: chain.AddFile(f)
-                self._trees[key] = chain
-            self._trees_ready=True
+        # If a cache is used, fetch the data chunks which are already stored
+        result = {}
+        if self._cache is not None:
+            result = self._cache.load(event_idx)
 
-        # Move the event pointer
-        for tree in self._trees.values():
-            tree.GetEntry(event_idx)
+        # Only parse the data chunks which are not cached
+        missing = [i for i, name in enumerate(self._data_keys[:-1]) if name not in result]
+        if len(missing):
+            # If this is the first data loading, instantiate chains
+            if not self._trees_ready:
+                from ROOT import TChain
+                for key in self._trees.keys():
+                    chain = TChain(key + '_tree')
+                    for f in self._files: chain.AddFile(f)
+                    self._trees[key] = chain
+                self._trees_ready=True
 
-        # Create data chunks
-        result = {}
-        for index, (parser, args) in enumerate(self._data_parsers):
-            kwargs = {}
-            for k, v in args.items():
-                if   'event_list' in k:
-                    kwargs[k] = [getattr(self._trees[vi], vi+'_branch') for vi in v]
-                elif 'event' in k:
-                    kwargs[k] = getattr(self._trees[v], v+'_branch')
-                else:
-                    kwargs[k] = v
-            name = self._data_keys[index]
-            result[name] = parser(**kwargs)
+            # Move the event pointer of the trees which are needed
+            trees = set(sum([self._data_trees[i] for i in missing], []))
+            for key in trees:
+                self._trees[key].GetEntry(event_idx)
+
+            # Create data chunks. Parsers share identical sub-products through the event memo
+            with self._memo.event():
+                for index in missing:
+                    parser, args = self._data_parsers[index]
+                    kwargs = {}
+                    for k, v in args.items():
+                        if   'event_list' in k:
+                            kwargs[k] = [getattr(self._trees[vi], vi+'_branch') for vi in v]
+                        elif 'event' in k:
+                            kwargs[k] = getattr(self._trees[v], v+'_branch')
+                        else:
+                            kwargs[k] = v
+                    name = self._data_keys[index]
+                    with self._memo.entry(name):
+                        result[name] = parser(**kwargs)
+
+            if self._parser_report_step > 0 and self._memo.num_events % self._parser_report_step == 0:
+                print(self._memo.report())
+
+            # Store the newly parsed data chunks
+            if self._cache is not None:
+                self._cache.store(event_idx, result)
 
+        # Preserve the order of the schema
+        result = {name: result[name] for name in self._data_keys[:-1]}
         result['index'] = event_idx
         return result
+
+
+class HDF5Dataset(Dataset):
+    """
+    Dataset which reads back the entries of HDF5 files produced by the
+    `HDF5Writer`, through an `HDF5Reader`. It can be wrapped in a
+    `DataLoader` (with `CollateHDF5`) to read and build the stored
+    objects in worker processes. Each worker opens its own file handles.
+
+    .. code-block:: yaml
+
+        iotool:
+          dataset:
+            name: HDF5Dataset
+            file_keys: /path/to/reco_*.h5
+            to_larcv: true
+    """
+    def __init__(self, file_keys, **reader_args):
+        """
+        Initialize the underlying reader.
+
+        Parameters
+        ----------
+        file_keys : Union[str, list]
+            Path or list of paths to the HDF5 files to be read
+        **reader_args : dict, optional
+            Other arguments passed to the `HDF5Reader`
+        """
+        from mlreco.iotools.readers import HDF5Reader
+        self.reader = HDF5Reader(file_keys, **reader_args)
+
+    def __len__(self):
+        return len(self.reader.entry_index)
+
+    def __getitem__(self, idx):
+        return self.reader.get(idx)
+
+    def __getitems__(self, indices):
+        # Used by the DataLoader to fetch a whole batch at once, which
+        # merges the reads of consecutive entries into larger slabs
+        return self.reader.get_many(indices)
+
+    def event_ids(self):
+        """
+        Returns the index of each sample in its file.
+
+        Returns
+        -------
+        np.ndarray
+            (N) Array of file entries, one per sample
+        """
+        return self.reader.entry_index
+
+    def file_ids(self):
+        """
+        Returns the index of the file in which each sample is stored.
+
+        Returns
+        -------
+        np.ndarray
+            (N) Array of file indices, one per sample
+        """
+        return self.reader.file_index
+
+    @staticmethod
+    def create(cfg):
+        reader_args = {k: v for k, v in cfg.items() if k != 'name'}
+        return HDF5Dataset(**reader_args)
@@ -72,9 +72,20 @@ def loader_factory(cfg, event_list=None):
     if 'sampler' in cfg['iotool']:
         sam_cfg = cfg['iotool']['sampler']
         sam_cfg['minibatch_size']=cfg['iotool']['minibatch_size']
+        sam_cfg['num_workers']=num_workers
         sampler = getattr(mlreco.iotools.samplers,sam_cfg['name']).create(ds,sam_cfg)
     if collate_fn is not None:
         collate_fn = partial(getattr(mlreco.iotools.collates,collate_fn), **collate_kwargs)
+        if 'transport' in params:
+            from mlreco.iotools.transport import SharedMemoryTransport
+            collate_fn = SharedMemoryTransport(collate_fn, num_workers, **params['transport'])
+    if getattr(sampler, 'BATCHED', False):
+        # Samplers which build the minibatches themselves (variable size)
+        loader = DataLoader(ds,
+                            batch_sampler = sampler,
+                            num_workers   = num_workers,
+                            collate_fn    = collate_fn)
+    elif collate_fn is not None:
         loader = DataLoader(ds,
                             batch_size  = minibatch_size,
                             shuffle     = shuffle,
@@ -107,13 +118,21 @@ def writer_factory(cfg):
 
     Note
     ----
-    Currently the choice is limited to `HDF5Writer` only.
+    Currently the choice is limited to `HDF5Writer` only. If `background`
+    is set, the batches are written by a separate process (see
+    `BackgroundWriter`), which buffers up to `queue_size` batches.
     """
     if 'writer' not in cfg['iotool']:
         return None
 
     import mlreco.iotools.writers
-    params = deepcopy(cfg['iotool']['writer'])
-    name   = params.pop('name')
-    writer = getattr(mlreco.iotools.writers, name)(**params)
+    params     = deepcopy(cfg['iotool']['writer'])
+    name       = params.pop('name')
+    background = params.pop('background', False)
+    queue_size = params.pop('queue_size', 8)
+    if background:
+        from mlreco.iotools.background import BackgroundWriter
+        writer = BackgroundWriter(getattr(mlreco.iotools.writers, name), params, queue_size)
+    else:
+        writer = getattr(mlreco.iotools.writers, name)(**params)
     return writer
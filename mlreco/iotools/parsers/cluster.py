@@ -1,16 +1,18 @@
 from collections import OrderedDict
 import numpy as np
 from larcv import larcv
-from sklearn.cluster import DBSCAN
 
 from .sparse import parse_sparse3d
 from .particles import parse_particles
 from .clean_data import clean_sparse_data
+from .memo import memoize
 
 from mlreco.utils.globals import UNKWN_SHP
+from mlreco.utils.dbscan import lattice_components
 from mlreco.utils.particles import get_interaction_ids, get_nu_ids, get_particle_ids, get_shower_primary_ids, get_group_primary_ids
 
 
+@memoize
 def parse_cluster2d(cluster_event):
     """
     A function to retrieve a 2D clusters tensor
@@ -57,6 +59,7 @@ def parse_cluster2d(cluster_event):
     return np_voxels, np_features
 
 
+@memoize
 def parse_cluster3d(cluster_event,
                     particle_event = None,
                     particle_mpv_event = None,
@@ -166,43 +169,42 @@ def parse_cluster3d(cluster_event,
         labels['particle'] = np.array([p.id() for p in particles]) # TODO: change order
         labels['shape']    = np.array([p.shape() for p in particles])
 
-    # Loop over clusters, store info
-    clusters_voxels, clusters_features = [], []
-    id_offset = 0
-    for i in range(num_clusters):
-        cluster = cluster_event.as_vector()[i]
-        num_points = cluster.as_vector().size()
-        if num_points >= max(min_size, 1):
-            # Get the position and pixel value from EventSparseTensor3D, append positions
-            x = np.empty(shape=(num_points,), dtype=np.int32)
-            y = np.empty(shape=(num_points,), dtype=np.int32)
-            z = np.empty(shape=(num_points,), dtype=np.int32)
-            value = np.empty(shape=(num_points,), dtype=np.float32)
-            larcv.as_flat_arrays(cluster, meta, x, y, z, value)
-            voxels = np.stack([x, y, z], axis=1)
-            clusters_voxels.append(voxels)
-
-            # Append the cluster-wise information
-            features = [value]
-            for k, l in labels.items():
-                size = cluster.as_vector().size()
-                value = l[i] if i < len(l) else (-1 if k != 'shape' else UNKWN_SHP)
-                features.append(np.full(shape=(size), fill_value=value, dtype=np.float32))
-
-            # If requested, break cluster into pieces that do not touch each other
-            if break_clusters:
-                dbscan = DBSCAN(eps=1.1, min_samples=1, metric='chebyshev')
-                frag_labels = np.unique(dbscan.fit(voxels).labels_, return_inverse=True)[-1]
-                features[1] = id_offset + frag_labels
-                id_offset += max(frag_labels) + 1
-
-            clusters_features.append(np.column_stack(features))
-
-    # If there are no non-empty clusters, return. Concatenate otherwise
-    if not len(clusters_voxels):
+    # Find the clusters to keep, preallocate the output arrays
+    clusters = cluster_event.as_vector()
+    sizes    = np.array([c.as_vector().size() for c in clusters], dtype=np.int64)
+    keep     = np.where(sizes >= max(min_size, 1))[0]
+    if not len(keep):
         return np.empty(shape=(0, 3), dtype=np.float32), np.empty(shape=(0, len(labels)+1), dtype=np.float32)
-    np_voxels   = np.concatenate(clusters_voxels, axis=0)
-    np_features = np.concatenate(clusters_features, axis=0)
+    offsets  = np.concatenate([[0], np.cumsum(sizes[keep])])
+    num_voxels = offsets[-1]
+    x = np.empty(shape=(num_voxels,), dtype=np.int32)
+    y = np.empty(shape=(num_voxels,), dtype=np.int32)
+    z = np.empty(shape=(num_voxels,), dtype=np.int32)
+    value = np.empty(shape=(num_voxels,), dtype=np.float32)
+
+    # Fill the position and pixel value of each cluster in place
+    for j, i in enumerate(keep):
+        s, e = offsets[j], offsets[j+1]
+        larcv.as_flat_arrays(clusters[int(i)], meta, x[s:e], y[s:e], z[s:e], value[s:e])
+    np_voxels = np.stack([x, y, z], axis=1)
+
+    # Broadcast the cluster-wise information to the voxels
+    cluster_labels = np.empty((num_clusters, len(labels)), dtype=np.float32)
+    for j, (k, l) in enumerate(labels.items()):
+        n = min(len(l), num_clusters)
+        cluster_labels[:n, j] = l[:n]
+        cluster_labels[n:, j] = -1 if k != 'shape' else UNKWN_SHP
+    np_features = np.empty((num_voxels, len(labels)+1), dtype=np.float32)
+    np_features[:, 0]  = value
+    np_features[:, 1:] = np.repeat(cluster_labels[keep], sizes[keep], axis=0)
+
+    # If requested, break clusters into pieces that do not touch each other,
+    # in a single pass over all the clusters (equivalent to a per-cluster
+    # DBSCAN with eps=1.1, min_samples=1 and a chebyshev metric)
+    if break_clusters:
+        cluster_ids = np.repeat(np.arange(len(keep)), sizes[keep])
+        np_features = np_features.astype(np.float64) # Fragment IDs are stored as double
+        np_features[:, 1] = lattice_components(np_voxels, cluster_ids)
 
     # If requested, remove duplicate voxels (cluster overlaps) and account for semantics
     if (sparse_semantics_event is not None or sparse_value_event is not None) and not clean_data:
@@ -226,6 +228,7 @@ def parse_cluster3d(cluster_event,
     return np_voxels, np_features
 
 
+@memoize
 def parse_cluster3d_charge_rescaled(cluster_event,
                                     particle_event = None,
                                     particle_mpv_event = None,
@@ -263,6 +266,7 @@ def parse_cluster3d_charge_rescaled(cluster_event,
 
     return np_voxels, np_features
 
+@memoize
 def parse_cluster3d_2cryos(cluster_event,
                                     particle_event = None,
                                     particle_mpv_event = None,
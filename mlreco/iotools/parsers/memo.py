@@ -0,0 +1,207 @@
+import inspect
+import numpy as np
+from time import time
+from functools import wraps
+from contextlib import contextmanager
+from collections import defaultdict
+
+try:
+    from ROOT import addressof
+except ImportError:
+    addressof = None
+
+# Memo of the event currently being loaded, if any
+_ACTIVE_MEMO = None
+
+
+def _identify(value):
+    '''
+    Builds a hashable identifier for a parser argument. LArCV event
+    objects are identified by the address of the underlying C++ object,
+    which is shared by all the branch proxies of a given tree.
+
+    Parameters
+    ----------
+    value : object
+        Parser argument
+
+    Returns
+    -------
+    object
+        Hashable identifier
+    '''
+    if value is None or isinstance(value, (str, int, float, bool, np.generic)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_identify(v) for v in value)
+    if addressof is not None:
+        try:
+            return (type(value).__name__, addressof(value))
+        except TypeError:
+            pass
+
+    raise TypeError(f'Cannot memoize parser argument of type {type(value)}')
+
+
+def _copy(value):
+    '''
+    Copies the containers (and arrays) of a parser output so that
+    in-place modifications by one consumer do not affect the others.
+    Objects (e.g. `larcv.Particle`) are shared.
+
+    Parameters
+    ----------
+    value : object
+        Parser output
+
+    Returns
+    -------
+    object
+        Copied parser output
+    '''
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+class EventMemo:
+    '''
+    Per-event memo of parser outputs.
+
+    Within the scope of an event (see `EventMemo.event`), a memoized parser
+    called several times with the same trees and arguments (e.g. the
+    `parse_sparse3d` call in `parse_cluster3d` and a `parse_sparse3d`
+    schema entry which reads the same tree) only decodes them once.
+
+    The memo also records, for each parser, the number of calls, the
+    number of memo hits and the total time spent (inclusive of the
+    nested parser calls), as well as the time spent on each schema entry.
+    '''
+
+    def __init__(self):
+        '''
+        Initialize the memo and its statistics.
+        '''
+        self._store = None
+        self.parser_stats = defaultdict(lambda: {'calls': 0, 'hits': 0, 'time': 0.})
+        self.entry_stats  = defaultdict(lambda: {'calls': 0, 'time': 0.})
+        self.num_events   = 0
+
+    @contextmanager
+    def event(self):
+        '''
+        Context in which the memoized parsers share their outputs.
+        '''
+        global _ACTIVE_MEMO
+        self._store = {}
+        _ACTIVE_MEMO = self
+        try:
+            yield self
+        finally:
+            self._store = None
+            _ACTIVE_MEMO = None
+            self.num_events += 1
+
+    @contextmanager
+    def entry(self, name):
+        '''
+        Context which times the parsing of one schema entry.
+
+        Parameters
+        ----------
+        name : str
+            Name of the schema entry
+        '''
+        start = time()
+        try:
+            yield
+        finally:
+            self.entry_stats[name]['calls'] += 1
+            self.entry_stats[name]['time']  += time() - start
+
+    def call(self, fn, signature, args, kwargs):
+        '''
+        Calls a parser, or fetches its output if it was already called
+        with the same arguments in the current event.
+
+        Parameters
+        ----------
+        fn : callable
+            Parser function
+        signature : inspect.Signature
+            Signature of the parser
+        args : tuple
+            Positional arguments
+        kwargs : dict
+            Keyword arguments
+
+        Returns
+        -------
+        object
+            Output of the parser
+        '''
+        # Build a key from the bound arguments, if possible
+        stats = self.parser_stats[fn.__name__]
+        stats['calls'] += 1
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (fn.__name__, _identify(tuple(bound.arguments.items())))
+        except TypeError:
+            key = None
+
+        if key is not None and key in self._store:
+            stats['hits'] += 1
+            return _copy(self._store[key])
+
+        start = time()
+        result = fn(*args, **kwargs)
+        stats['time'] += time() - start
+        if key is not None:
+            self._store[key] = result
+
+        return _copy(result)
+
+    def report(self):
+        '''
+        Builds a human-readable summary of the parser statistics.
+
+        Returns
+        -------
+        str
+            Summary of the time spent per schema entry and per parser
+        '''
+        n = max(1, self.num_events)
+        msg = f'Parser statistics over {self.num_events} event(s):\n'
+        for name, s in sorted(self.entry_stats.items(), key=lambda x: -x[1]['time']):
+            msg += f'  entry  {name:<30} {1e3*s["time"]/n:8.3f} ms/event\n'
+        for name, s in sorted(self.parser_stats.items(), key=lambda x: -x[1]['time']):
+            msg += f'  parser {name:<30} {1e3*s["time"]/n:8.3f} ms/event, '
+            msg += f'{s["calls"]} calls, {s["hits"]} memo hits\n'
+
+        return msg
+
+
+def memoize(fn):
+    '''
+    Decorator which makes a parser share its output with identical
+    calls within the event memo context, if one is active.
+
+    Returns
+    -------
+    callable
+        Memoized parser
+    '''
+    signature = inspect.signature(fn)
+
+    @wraps(fn)
+    def wrap(*args, **kwargs):
+        if _ACTIVE_MEMO is None:
+            return fn(*args, **kwargs)
+        return _ACTIVE_MEMO.call(fn, signature, args, kwargs)
+
+    return wrap
@@ -2,7 +2,10 @@ import numpy as np
 from larcv import larcv
 from mlreco.utils.dbscan import dbscan_types
 
+from .memo import memoize
 
+
+@memoize
 def parse_meta2d(sparse_event, projection_id = 0):
     """
     Get the meta information to translate into real world coordinates (2D).
@@ -53,6 +56,7 @@ def parse_meta2d(sparse_event, projection_id = 0):
     ]
 
 
+@memoize
 def parse_meta3d(sparse_event):
     """
     Get the meta information to translate into real world coordinates (3D).
@@ -98,6 +102,7 @@ def parse_meta3d(sparse_event):
     ]
 
 
+@memoize
 def parse_run_info(sparse_event):
     """
     Parse run info (run, subrun, event number)
@@ -125,6 +130,7 @@ def parse_run_info(sparse_event):
             sparse_event.event()]
 
 
+@memoize
 def parse_opflash(opflash_event):
     """
     Copy construct OpFlash and return an array of larcv::Flash.
@@ -154,6 +160,7 @@ def parse_opflash(opflash_event):
     return opflashes
 
 
+@memoize
 def parse_crthits(crthit_event):
     """
     Copy construct CRTHit and return an array of larcv::CRTHit.
@@ -4,6 +4,9 @@ from larcv import larcv
 from mlreco.utils.globals import PDG_TO_PID
 from mlreco.utils.ppn import get_ppn_info
 
+from .memo import memoize
+
+@memoize
 def parse_particles(particle_event, sparse_event=None, cluster_event=None, voxel_coordinates=True):
     """
     A function to copy construct & return an array of larcv::Particle.
@@ -56,6 +59,7 @@ def parse_particles(particle_event, sparse_event=None, cluster_event=None, voxel
     return particles
 
 
+@memoize
 def parse_neutrinos(neutrino_event, sparse_event=None, cluster_event=None, voxel_coordinates=True):
     """
     A function to copy construct & return an array of larcv::Neutrino.
@@ -108,6 +112,7 @@ def parse_neutrinos(neutrino_event, sparse_event=None, cluster_event=None, voxel
     return neutrinos
 
 
+@memoize
 def parse_particle_points(sparse_event, particle_event, include_point_tagging=True):
     """
     A function to retrieve particles ground truth points tensor, returns
@@ -156,6 +161,7 @@ def parse_particle_points(sparse_event, particle_event, include_point_tagging=Tr
         return np.empty(shape=(0, 3), dtype=np.int32), np_values
 
 
+@memoize
 def parse_particle_coords(particle_event, cluster_event):
     '''
     Function that returns particle coordinates (start and end) and start time.
@@ -198,6 +204,7 @@ def parse_particle_coords(particle_event, cluster_event):
     return particle_feats[:,:3], particle_feats[:,3:]
 
 
+@memoize
 def parse_particle_graph(particle_event, cluster_event=None):
     """
     A function to parse larcv::EventParticle to construct edges between particles (i.e. clusters)
@@ -279,6 +286,7 @@ def parse_particle_graph(particle_event, cluster_event=None):
     return edges
 
 
+@memoize
 def parse_particle_singlep_pdg(particle_event):
     """
     Get each true particle's PDG code.
@@ -312,6 +320,7 @@ def parse_particle_singlep_pdg(particle_event):
     return np.asarray([pdg])
 
 
+@memoize
 def parse_particle_singlep_einit(particle_event):
     """
     Get each true particle's true initial energy.
@@ -1,7 +1,10 @@
 import numpy as np
 from larcv import larcv
 
+from .memo import memoize
 
+
+@memoize
 def parse_sparse2d(sparse_event_list):
     """
     A function to retrieve sparse tensor input from larcv::EventSparseTensor2D object
@@ -57,6 +60,7 @@ def parse_sparse2d(sparse_event_list):
     return np_voxels, np.concatenate(output, axis=-1)
 
 
+@memoize
 def parse_sparse3d(sparse_event_list, features=None, hit_keys=[], nhits_idx=None):
     """
     A function to retrieve sparse tensor input from larcv::EventSparseTensor3D object
@@ -155,6 +159,7 @@ def parse_sparse3d(sparse_event_list, features=None, hit_keys=[], nhits_idx=None
     return np.concatenate(voxels, axis=0), np.concatenate(features, axis=0)
 
 
+@memoize
 def parse_sparse3d_ghost(sparse_event_semantics):
     """
     A function to retrieve sparse tensor input from larcv::EventSparseTensor3D object
@@ -183,6 +188,7 @@ def parse_sparse3d_ghost(sparse_event_semantics):
     return np_voxels, (np_data==5).astype(np.float32)
 
 
+@memoize
 def parse_sparse3d_charge_rescaled(sparse_event_list):
     # Produces sparse3d_reco_rescaled on the fly on datasets that do not have it
     np_voxels, output = parse_sparse3d(sparse_event_list)
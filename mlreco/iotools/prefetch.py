@@ -0,0 +1,122 @@
+import time
+import queue
+import threading
+
+
+class BatchPrefetcher:
+    '''
+    Prepares the next batches of a data iterator in a background thread,
+    while the current batch is being processed.
+
+    The thread calls `prepare(data_iter)` ahead of time and keeps up to
+    `depth` prepared batches in a queue (`depth=1` is double buffering).
+    Exceptions raised while preparing a batch (including `StopIteration`)
+    are raised by `get` in the calling thread, in order.
+    '''
+
+    def __init__(self, prepare, depth=1):
+        '''
+        Initialize the prefetcher. The thread is started on the first call to `get`.
+
+        Parameters
+        ----------
+        prepare : callable
+            Function which takes the data iterator and returns a prepared batch
+        depth : int, default 1
+            Maximum number of batches prepared ahead of time
+        '''
+        self.prepare = prepare
+        self.depth   = depth
+        self._iter   = None
+        self._thread = None
+
+    def __del__(self):
+        self.stop()
+
+    def start(self, data_iter):
+        '''
+        Starts prefetching from a data iterator.
+
+        Parameters
+        ----------
+        data_iter : iterable
+            Data iterator
+        '''
+        self.stop()
+        self._iter   = data_iter
+        self._queue  = queue.Queue(maxsize=self.depth)
+        self._event  = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                args=(data_iter, self._queue, self._event), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the prefetching thread, drops the prepared batches.
+        '''
+        if self._thread is None:
+            return
+        self._event.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+        self._iter, self._thread = None, None
+
+    def _run(self, data_iter, batch_queue, event):
+        '''
+        Body of the prefetching thread.
+
+        Parameters
+        ----------
+        data_iter : iterable
+            Data iterator
+        batch_queue : queue.Queue
+            Queue of (batch, error, preparation time)
+        event : threading.Event
+            Event which is set to stop the thread
+        '''
+        error = None
+        while error is None and not event.is_set():
+            start = time.time()
+            batch = None
+            try:
+                batch = self.prepare(data_iter)
+            except BaseException as e:
+                error = e
+            item = (batch, error, time.time() - start)
+            while not event.is_set():
+                try:
+                    batch_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self, data_iter):
+        '''
+        Fetches the next prepared batch of a data iterator. If the iterator
+        is not the one currently prefetched from, prefetching restarts.
+
+        Parameters
+        ----------
+        data_iter : iterable
+            Data iterator
+
+        Returns
+        -------
+        object
+            Prepared batch
+        float
+            Time spent preparing the batch in the background
+        '''
+        if data_iter is not self._iter or self._thread is None:
+            self.start(data_iter)
+        batch, error, duration = self._queue.get()
+        if error is not None:
+            self._thread.join()
+            self._iter, self._thread = None, None
+            raise error
+
+        return batch, duration
@@ -1,16 +1,122 @@
+import os
 import yaml
 import h5py
 import glob
 import numpy as np
+from collections import OrderedDict, defaultdict
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+
+class LazyArray(NDArrayOperatorsMixin):
+    '''
+    Proxy to a range of rows of a dataset, which is only read from
+    the file the first time its values are accessed. Its length, shape
+    and dtype are available without reading it.
+
+    It behaves as a numpy array in indexing, numpy functions and
+    arithmetic, but it is not an instance of `np.ndarray`: use
+    `np.asarray` to fetch the underlying array where that matters.
+    '''
+
+    def __init__(self, load, shape, dtype):
+        '''
+        Initialize the proxy.
+
+        Parameters
+        ----------
+        load : callable
+            Function which reads the array from the file
+        shape : tuple
+            Shape of the array
+        dtype : np.dtype
+            Type of the array
+        '''
+        self._load  = load
+        self._array = None
+        self.shape  = shape
+        self.dtype  = dtype
+
+    @property
+    def loaded(self):
+        return self._array is not None
+
+    def materialize(self):
+        '''
+        Reads the array from the file, if it has not been read yet.
+
+        Returns
+        -------
+        np.ndarray
+            Underlying array
+        '''
+        if self._array is None:
+            self._array = self._load()
+            self._load  = None
+        return self._array
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        if self._array is None:
+            return f'LazyArray(shape={self.shape}, dtype={self.dtype})'
+        return repr(self._array)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.materialize()
+        return array.astype(dtype, copy=False) if dtype is not None else array
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [x.materialize() if isinstance(x, LazyArray) else x for x in inputs]
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(x.materialize() if isinstance(x, LazyArray) else x for x in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __setitem__(self, index, value):
+        self.materialize()[index] = value
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
 
 class HDF5Reader:
     '''
     Class which reads back information stored in HDF5 files.
 
+    Both the version 1 (region references) and version 2 (offsets) file
+    layouts of `HDF5Writer` are supported, the version of each file is
+    detected from its `version` attribute.
+
+    The files are kept open between reads, in a pool of at most
+    `max_open_files` handles. The handles are reopened in forked (e.g.
+    DataLoader worker) processes and are not pickled.
+
+    Only the keys in `keys` (if specified) and not in `skip_keys` are
+    loaded. If `lazy_rows` is specified, arrays with at least that many
+    rows are returned as `LazyArray` proxies, read on first access. The
+    number of events and bytes loaded for each key are accounted in
+    `key_stats` (see `read_summary`).
+
     More documentation to come.
     '''
 
-    def __init__(self, file_keys, n_entry=-1, n_skip=-1, entry_list=[], skip_entry_list=[], to_larcv=False):
+    def __init__(self, file_keys, n_entry=-1, n_skip=-1, entry_list=[], skip_entry_list=[], to_larcv=False, catalog=None, max_open_files=16, keys=None, skip_keys=[], lazy_rows=None):
         '''
         Load up the HDF5 file.
 
@@ -28,6 +134,16 @@ class HDF5Reader:
             Entry IDs to be skipped
         to_larcv : bool, default False
             Convert dictionary of LArCV object properties to LArCV objects
+        catalog : dict, optional
+            Configuration of the dataset catalog used to count entries (see `DatasetCatalog`)
+        max_open_files : int, default 16
+            Maximum number of file handles kept open at once
+        keys : list, optional
+            List of keys to load. If not specified, loads all the keys
+        skip_keys : list, optional
+            List of keys to skip
+        lazy_rows : int, optional
+            Minimum number of rows of an array for it to be loaded lazily
         '''
         # Convert the file keys to a list of file paths with glob
         self.file_paths = []
@@ -39,24 +155,32 @@ class HDF5Reader:
             self.file_paths.extend(file_paths)
         self.file_paths = sorted(self.file_paths)
 
+        # If provided, use a catalog to list the file content instead of opening every file
+        if catalog is not None:
+            from .catalog import DatasetCatalog
+            records = DatasetCatalog(**catalog).update(self.file_paths)
+            file_content = [r['entries'] for r in records]
+        else:
+            from .catalog import scan_hdf5_file
+            file_content = [scan_hdf5_file(path) for path in self.file_paths]
+
         # Loop over the input files, build a map from index to file ID
         self.num_entries  = 0
         self.file_index   = []
         self.split_groups = None
-        for i, path in enumerate(self.file_paths):
-            with h5py.File(path, 'r') as file:
-                # Check that there are events in the file and the storage mode
-                assert 'events' in file, 'File does not contain an event tree'
+        for i, (path, content) in enumerate(zip(self.file_paths, file_content)):
+            # Check that there are events in the file and the storage mode
+            assert 'events' in content, 'File does not contain an event tree'
 
-                split_groups = 'data' in file and 'result' in file
-                assert self.split_groups is None or self.split_groups == split_groups,\
-                        'Cannot load files with different storing schemes'
-                self.split_groups = split_groups
+            split_groups = 'data' in content and 'result' in content
+            assert self.split_groups is None or self.split_groups == split_groups,\
+                    'Cannot load files with different storing schemes'
+            self.split_groups = split_groups
 
-                self.num_entries += len(file['events'])
-                self.file_index.append(i*np.ones(len(file['events']), dtype=np.int32))
+            self.num_entries += content['events']
+            self.file_index.append(i*np.ones(content['events'], dtype=np.int32))
 
-                print('Registered', path)
+            print('Registered', path)
 
         self.file_index = np.concatenate(self.file_index)
 
@@ -66,6 +190,73 @@ class HDF5Reader:
         # Set whether or not to initialize LArCV objects as such
         self.to_larcv = to_larcv
 
+        # Set which keys to load and how, initialize the read accounting
+        self.keys      = set(keys) if keys is not None else None
+        self.skip_keys = set(skip_keys)
+        self.lazy_rows = lazy_rows
+        self.key_stats = defaultdict(lambda: {'requested': 0, 'loaded': 0, 'bytes': 0})
+        self._event_ids = None
+
+        # Initialize the pool of open file handles
+        self.max_open_files = max_open_files
+        self._files = OrderedDict()
+        self._pid   = os.getpid()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_files'] = OrderedDict()
+        state['key_stats'] = dict(self.key_stats)
+        return state
+
+    def __setstate__(self, state):
+        key_stats = state.pop('key_stats')
+        self.__dict__.update(state)
+        self.key_stats = defaultdict(lambda: {'requested': 0, 'loaded': 0, 'bytes': 0}, key_stats)
+
+    def close(self):
+        '''
+        Closes all the open file handles.
+        '''
+        if self._pid == os.getpid():
+            for file in self._files.values():
+                file.close()
+        self._files = OrderedDict()
+
+    def get_file(self, file_idx):
+        '''
+        Fetches the open handle of a file, opens it if needed.
+
+        Parameters
+        ----------
+        file_idx : int
+            Index of the file in the list of file paths
+
+        Returns
+        -------
+        h5py.File
+            Open file handle
+        '''
+        # Handles inherited from a parent process cannot be used safely, drop them
+        if self._pid != os.getpid():
+            self._files = OrderedDict()
+            self._pid   = os.getpid()
+
+        if file_idx in self._files:
+            self._files.move_to_end(file_idx)
+            return self._files[file_idx]
+
+        if len(self._files) >= self.max_open_files:
+            self._files.popitem(last=False)[1].close()
+        self._files[file_idx] = h5py.File(self.file_paths[file_idx], 'r')
+
+        return self._files[file_idx]
+
     def __len__(self):
         '''
         Returns the number of entries in the file
@@ -113,22 +304,64 @@ class HDF5Reader:
         result_blob : dict
             Ditionary of result data products corresponding to one event
         '''
-        # Get the appropriate entry index
-        assert idx < len(self.entry_index)
-        entry_idx = self.entry_index[idx]
-        file_idx  = self.file_index[idx]
+        return self.get_many([idx], nested)[0]
+
+    def get_many(self, indices, nested=False):
+        '''
+        Returns a list of entries. The regions of each dataset which
+        belong to consecutive entries of a file are read at once.
+
+        Parameters
+        ----------
+        indices : list(int)
+            Integer entry IDs to access
+        nested : bool
+            If true, nest the output in an array of length 1 (for analysis tools)
+
+        Returns
+        -------
+        list
+            List of (data_blob, result_blob) pairs (or merged blobs if the
+            file does not split input data and results), one per entry
+        '''
+        # Get the appropriate entry indexes, group them by file
+        indices = np.asarray(indices, dtype=np.int64)
+        assert np.all(indices < len(self.entry_index))
+        entry_idx = self.entry_index[indices]
+        file_idx  = self.file_index[indices]
 
         # Use the events tree to find out what needs to be loaded
-        data_blob, result_blob = {}, {}
-        with h5py.File(self.file_paths[file_idx], 'r') as file:
-            event = file['events'][entry_idx]
-            for key in event.dtype.names:
-                self.load_key(file, event, data_blob, result_blob, key, nested)
+        ret = [None] * len(indices)
+        for f in np.unique(file_idx):
+            file = self.get_file(f)
+            version = file.attrs.get('version', 1)
+            positions = np.where(file_idx == f)[0]
+            entries, inverse = np.unique(entry_idx[positions], return_inverse=True)
+            if version < 2:
+                # Each event stores one region reference per key
+                events  = self.read_rows(file['events'], entries)
+                regions = {key: events[key] for key in events.dtype.names}
+            else:
+                # Each event spans the rows between its offset and the next
+                rows    = np.union1d(entries, entries + 1)
+                events  = self.read_rows(file['events'], rows)
+                starts  = events[np.searchsorted(rows, entries)]
+                ends    = events[np.searchsorted(rows, entries + 1)]
+                regions = {key: np.stack([starts[key], ends[key]], axis=1) for key in events.dtype.names}
+
+            data_blobs   = [{} for _ in range(len(entries))]
+            result_blobs = [{} for _ in range(len(entries))]
+            for key, key_regions in regions.items():
+                if (self.keys is None or key in self.keys) and key not in self.skip_keys:
+                    self.load_key(f, key_regions, data_blobs, result_blobs, key, nested, version)
+
+            for p, i in zip(positions, inverse):
+                if self.split_groups:
+                    ret[p] = data_blobs[i], result_blobs[i]
+                else:
+                    ret[p] = dict(data_blobs[i], **result_blobs[i])
 
-        if self.split_groups:
-            return data_blob, result_blob
-        else:
-            return dict(data_blob, **result_blob)
+        return ret
 
     def get_entry_list(self, n_entry, n_skip, entry_list, skip_entry_list):
         '''
@@ -188,61 +421,309 @@ class HDF5Reader:
 
         return entry_index
 
-    def load_key(self, file, event, data_blob, result_blob, key, nested):
+    def load_key(self, file_idx, regions, data_blobs, result_blobs, key, nested, version=1):
         '''
-        Fetch a specific key for a specific event.
+        Fetch a specific key for a set of events.
 
         Parameters
         ----------
-        file : h5py.File
-            HDF5 file instance
-        event : dict
-            Dictionary of objects that make up one event
-        data_blob : dict
-            Dictionary used to store the loaded input data
-        result_blob : dict
-            Dictionary used to store the loaded result data
+        file_idx : int
+            Index of the file in the list of file paths
+        regions : np.ndarray
+            Region references (version 1) or (first, last) rows (version 2)
+            of the key, one per event
+        data_blobs : list(dict)
+            Dictionaries used to store the loaded input data, one per event
+        result_blobs : list(dict)
+            Dictionaries used to store the loaded result data, one per event
         key: str
             Name of the dataset in the event
         nested : bool
             If true, nest the output in an array of length 1 (for analysis tools)
+        version : int, default 1
+            File layout version
         '''
-        # The event-level information is a region reference: fetch it
-        region_ref = event[key]
+        # Find the group the key belongs to
+        file  = self.get_file(file_idx)
         group = file
-        blob  = result_blob
+        blobs = result_blobs
         if self.split_groups:
             cat   = 'data' if key in file['data'] else 'result'
-            blob  = data_blob if cat == 'data' else result_blob
+            blobs = data_blobs if cat == 'data' else result_blobs
             group = file[cat]
+        stats = self.key_stats[key]
+        stats['requested'] += len(regions)
         if isinstance(group[key], h5py.Dataset):
-            if not group[key].dtype.names:
-                # If the reference points at a simple dataset, return
-                blob[key] = group[key][region_ref]
-                if 'scalar' in group[key].attrs and group[key].attrs['scalar']:
-                    blob[key] = blob[key][0]
+            dataset = group[key]
+            bounds  = self.get_bounds(dataset, regions, version)
+            scalar  = 'scalar' in dataset.attrs and dataset.attrs['scalar']
+            if self.lazy_rows is not None and not scalar and not dataset.dtype.names:
+                # Defer the read of large arrays
+                lazy   = (bounds[:, 1] - bounds[:, 0]) >= self.lazy_rows
+                arrays = [None] * len(bounds)
+                for i, array in zip(np.where(~lazy)[0], self.read_slabs(dataset, bounds[~lazy])):
+                    arrays[i] = array
+                for i in np.where(lazy)[0]:
+                    arrays[i] = self.lazy_array(file_idx, dataset, key, *bounds[i])
+                self.account(key, [arrays[i] for i in np.where(~lazy)[0]])
+            else:
+                arrays = self.read_slabs(dataset, bounds)
+                self.account(key, arrays)
+
+            if not dataset.dtype.names:
+                # If the regions point at a simple dataset, return
+                values = arrays
+                if scalar:
+                    values = [array[0] for array in arrays]
             else:
                 # If the dataset has multiple attributes, it contains an object
-                array = group[key][region_ref]
-                names = array.dtype.names
-                if self.to_larcv and ('larcv' not in group[key].attrs or group[key].attrs['larcv']):
-                    blob[key] = self.make_larcv_objects(array, names)
-                else:
-                    blob[key] = []
-                    for i in range(len(array)):
-                        blob[key].append(dict(zip(names, array[i])))
+                names  = dataset.dtype.names
+                values = []
+                for array in arrays:
+                    if self.to_larcv and ('larcv' not in dataset.attrs or dataset.attrs['larcv']):
+                        values.append(self.make_larcv_objects(array, names))
+                    else:
+                        values.append([dict(zip(names, array[i])) for i in range(len(array))])
         else:
-            # If the reference points at a group, unpack
-            el_refs = group[key]['index'][region_ref].flatten()
-            if len(group[key]['index'].shape) == 1:
-                ret = np.empty(len(el_refs), dtype=np.object)
-                ret[:] = [group[key]['elements'][r] for r in el_refs]
+            # If the regions point at a group, fetch the index rows of each
+            # event: references to the elements (version 1) or the offsets
+            # of the elements, including the end of the last one (version 2)
+            index = group[key]['index']
+            if version < 2:
+                rows = self.read_slabs(index, self.region_bounds(index, regions))
             else:
-                ret = [group[key][f'element_{i}'][r] for i, r in enumerate(el_refs)]
-            blob[key] = ret
+                rows = self.read_slabs(index, regions + np.array([0, 1]))
+
+            if len(index.shape) == 1:
+                # Elements stored in a single dataset
+                dataset = group[key]['elements']
+                if version < 2:
+                    counts = [len(row) for row in rows]
+                    el_regions = np.concatenate(rows)
+                else:
+                    counts = [len(row) - 1 for row in rows]
+                    el_regions = np.concatenate([np.stack([row[:-1], row[1:]], axis=1) for row in rows])
+                elements = self.read_slabs(dataset, self.get_bounds(dataset, el_regions, version))
+                self.account(key, elements, len(rows))
+                bounds   = np.cumsum([0] + counts)
+                values   = []
+                for i in range(len(rows)):
+                    ret = np.empty(counts[i], dtype=object)
+                    for j, element in enumerate(elements[bounds[i]:bounds[i+1]]):
+                        ret[j] = element
+                    values.append(ret)
+            else:
+                # One dataset per element
+                columns = []
+                for i in range(index.shape[1]):
+                    dataset = group[key][f'element_{i}']
+                    if version < 2:
+                        el_regions = [row[0, i] for row in rows]
+                    else:
+                        el_regions = np.array([[row[0, i], row[1, i]] for row in rows], dtype=np.int64)
+                    columns.append(self.read_slabs(dataset, self.get_bounds(dataset, el_regions, version)))
+                    self.account(key, columns[-1], 0)
+                stats['loaded'] += len(rows)
+                values = [list(elements) for elements in zip(*columns)]
+
+        for blob, value in zip(blobs, values):
+            blob[key] = value if not nested else [value]
+
+    def lazy_array(self, file_idx, dataset, key, first, last):
+        '''
+        Builds a proxy to a range of rows of a dataset.
+
+        Parameters
+        ----------
+        file_idx : int
+            Index of the file in the list of file paths
+        dataset : h5py.Dataset
+            Dataset to read from
+        key : str
+            Name of the key (for the read accounting)
+        first : int
+            First row
+        last : int
+            Last row (excluded)
+
+        Returns
+        -------
+        LazyArray
+            Array proxy
+        '''
+        path = dataset.name
+        def load():
+            array = self.get_file(file_idx)[path][first:last]
+            self.account(key, [array])
+            return array
+
+        return LazyArray(load, (int(last - first), *dataset.shape[1:]), dataset.dtype)
+
+    def account(self, key, arrays, num_events=None):
+        '''
+        Records the reads of a key.
+
+        Parameters
+        ----------
+        key : str
+            Name of the key
+        arrays : list(np.ndarray)
+            Arrays read from the file
+        num_events : int, optional
+            Number of events the arrays belong to (one per array by default)
+        '''
+        stats = self.key_stats[key]
+        stats['loaded'] += num_events if num_events is not None else len(arrays)
+        stats['bytes']  += sum(array.nbytes for array in arrays)
+
+    def read_summary(self):
+        '''
+        Summarizes which keys have been read so far.
 
-        if nested:
-            blob[key] = [blob[key]]
+        Returns
+        -------
+        dict
+            Dictionary which maps each key to the number of events it was
+            requested for, the number of events it was actually read for
+            and the number of bytes read
+        '''
+        return {key: dict(stats) for key, stats in sorted(self.key_stats.items())}
+
+    def find_entries(self, event_ids):
+        '''
+        Finds the entries which store a list of events, based on the
+        `index` stored for each event (e.g. its entry in the LArCV files).
+
+        Parameters
+        ----------
+        event_ids : list(int)
+            Stored `index` of each event to find
+
+        Returns
+        -------
+        np.ndarray
+            Integer entry ID of each event, to be used with `get_many`
+        '''
+        # Read the index of all the events once, sort it for lookups
+        if self._event_ids is None:
+            stored_ids = np.empty(len(self.entry_index), dtype=np.int64)
+            for f in np.unique(self.file_index):
+                file = self.get_file(f)
+                group = file['data'] if self.split_groups else file
+                positions = np.where(self.file_index == f)[0]
+                stored_ids[positions] = group['index'][:].reshape(-1)[self.entry_index[positions]]
+            self._event_order = np.argsort(stored_ids, kind='stable')
+            self._event_ids = stored_ids[self._event_order]
+
+        event_ids = np.asarray(event_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._event_ids, event_ids), len(self._event_ids)-1)
+        assert np.all(self._event_ids[positions] == event_ids),\
+                'Some of the requested events are not stored in the files'
+
+        return self._event_order[positions]
+
+    @classmethod
+    def get_bounds(cls, dataset, regions, version):
+        '''
+        Converts the regions of a dataset to (first, last) row bounds.
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+            Dataset the regions point at
+        regions : np.ndarray
+            Region references (version 1) or (first, last) rows (version 2)
+        version : int
+            File layout version
+
+        Returns
+        -------
+        np.ndarray
+            (N, 2) array of (first, last) rows
+        '''
+        if version < 2:
+            return cls.region_bounds(dataset, regions)
+        return regions
+
+    @staticmethod
+    def region_bounds(dataset, region_refs):
+        '''
+        Fetches the bounds of region references along the first axis.
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+            Dataset the references point at
+        region_refs : list(h5py.RegionReference)
+            Region references (selections along the first axis)
+
+        Returns
+        -------
+        np.ndarray
+            (N, 2) array of (first, last) rows, (0, 0) for empty regions
+        '''
+        bounds = np.zeros((len(region_refs), 2), dtype=np.int64)
+        for i, ref in enumerate(region_refs):
+            limits = h5py.h5r.get_region(ref, dataset.id).get_select_bounds()
+            if limits is not None:
+                bounds[i] = limits[0][0], limits[1][0] + 1
+
+        return bounds
+
+    @staticmethod
+    def read_slabs(dataset, bounds):
+        '''
+        Reads the row ranges of a dataset. Adjacent ranges are merged
+        and read as a single slab.
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+            Dataset to read from
+        bounds : np.ndarray
+            (N, 2) array of (first, last) rows
+
+        Returns
+        -------
+        list(np.ndarray)
+            One array per row range
+        '''
+        ret = [None] * len(bounds)
+        empty = np.empty((0, *dataset.shape[1:]), dtype=dataset.dtype)
+        order = np.argsort(bounds[:, 0], kind='stable')
+        start = 0
+        while start < len(order):
+            end, first, last = start, *bounds[order[start]]
+            while end + 1 < len(order) and bounds[order[end+1], 0] == last:
+                end += 1
+                last = max(last, bounds[order[end], 1])
+            slab = dataset[first:last] if last > first else empty
+            for i in order[start:end+1]:
+                ret[i] = slab[bounds[i, 0] - first:bounds[i, 1] - first]
+            start = end + 1
+
+        return ret
+
+    @staticmethod
+    def read_rows(dataset, rows):
+        '''
+        Reads a sorted list of rows of a dataset, in one slab if they are dense.
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+            Dataset to read from
+        rows : np.ndarray
+            Sorted list of unique row indexes
+
+        Returns
+        -------
+        np.ndarray
+            Requested rows
+        '''
+        if rows[-1] - rows[0] < 2 * len(rows):
+            return dataset[rows[0]:rows[-1]+1][rows - rows[0]]
+        return dataset[rows]
 
     @staticmethod
     def make_larcv_objects(array, names):
@@ -63,3 +63,298 @@ class BootstrapBatchSampler(AbstractBatchSampler):
     @staticmethod
     def create(ds, cfg):
         return BootstrapBatchSampler(len(ds), cfg['minibatch_size'])
+
+
+class LocalityBatchSampler(AbstractBatchSampler):
+    '''
+    Sampler which preserves the locality of the reads in the ROOT files.
+
+    The dataset is divided in blocks of consecutive entries which never
+    straddle two files (whole files by default). At each epoch, the order of
+    the files and of the blocks within each file is shuffled, and entries
+    are only shuffled within windows of a few consecutive blocks. This
+    bounds the number of times a TChain has to switch file or reload baskets.
+
+    The files are also split into disjoint shards, one per DataLoader
+    worker. Minibatches are interleaved such that the DataLoader, which
+    dispatches minibatches to its workers in a round-robin fashion,
+    always sends the entries of a given shard to the same worker.
+    Shards which hold fewer minibatches than the largest shard
+    are padded by cycling through their own minibatches.
+
+    .. code-block:: yaml
+
+        iotool:
+          sampler:
+            name: LocalityBatchSampler
+            block_size: 100
+            window: 4
+    '''
+    def __init__(self, file_ids, minibatch_size, num_workers=1, block_size=-1, window=1, shuffle=True, seed=0):
+        '''
+        Builds the blocks and the worker shards.
+
+        Parameters
+        ----------
+        file_ids : np.ndarray
+            (N) Index of the file in which each sample is stored
+        minibatch_size : int
+            Number of samples in each minibatch
+        num_workers : int, default 1
+            Number of DataLoader workers (one shard per worker)
+        block_size : int, default -1
+            Number of consecutive entries in a block. If not positive, a block is a file
+        window : int, default 1
+            Number of consecutive blocks within which entries are shuffled
+        shuffle : bool, default True
+            If `False`, read each shard sequentially
+        seed : int, default 0
+            Seed of the random number generator
+        '''
+        super().__init__(len(file_ids), minibatch_size, seed)
+        self._file_ids = np.asarray(file_ids)
+        self._num_workers = max(1, int(num_workers))
+        self._block_size = int(block_size)
+        self._window = max(1, int(window))
+        self._shuffle = shuffle
+
+        # Split the dataset into units of contiguous entries, one per file. If there
+        # are fewer files than workers, split the dataset into one unit per worker.
+        units = np.split(np.arange(self._data_size), np.where(np.diff(self._file_ids))[0]+1)
+        if len(units) < self._num_workers:
+            units = np.array_split(np.arange(self._data_size), self._num_workers)
+
+        # Assign units to shards, balancing the number of entries (largest first)
+        self._shards = [[] for _ in range(self._num_workers)]
+        sizes = np.zeros(self._num_workers, dtype=np.int64)
+        for u in np.argsort([-len(u) for u in units], kind='stable'):
+            s = np.argmin(sizes)
+            self._shards[s].append(units[u])
+            sizes[s] += len(units[u])
+
+        # The number of minibatches per shard is set by the largest shard
+        self._num_batches = int(np.ceil(np.max(sizes) / self._minibatch_size))
+        self.switch_counts = None
+
+    def __len__(self):
+        return self._num_batches * self._num_workers * self._minibatch_size
+
+    def _shard_order(self, shard):
+        '''
+        Produces the ordered list of minibatches of one shard.
+
+        Parameters
+        ----------
+        shard : list
+            List of units (arrays of contiguous entries) in the shard
+
+        Returns
+        -------
+        np.ndarray
+            (B, minibatch_size) Array of minibatch entries
+        '''
+        # Order the units, break them into blocks, order the blocks
+        blocks = []
+        unit_order = self._random.permutation(len(shard)) if self._shuffle else np.arange(len(shard))
+        for u in unit_order:
+            unit = shard[u]
+            if self._block_size > 0:
+                unit_blocks = np.split(unit, np.arange(self._block_size, len(unit), self._block_size))
+            else:
+                unit_blocks = [unit]
+            if self._shuffle:
+                unit_blocks = [unit_blocks[i] for i in self._random.permutation(len(unit_blocks))]
+            blocks.extend(unit_blocks)
+
+        # Shuffle entries within windows of consecutive blocks
+        entries = []
+        for start in range(0, len(blocks), self._window):
+            window = np.concatenate(blocks[start:start+self._window])
+            entries.append(self._random.permutation(window) if self._shuffle else window)
+        entries = np.concatenate(entries)
+
+        # Break into minibatches, pad by cycling through the shard
+        num_entries = self._num_batches * self._minibatch_size
+        if len(entries) < num_entries:
+            entries = np.resize(entries, num_entries)
+
+        return entries[:num_entries].reshape(-1, self._minibatch_size)
+
+    def __iter__(self):
+        # Interleave the minibatches of each shard (worker)
+        batches = np.stack([self._shard_order(shard) for shard in self._shards], axis=1)
+        indices = batches.flatten()
+
+        # Record the number of file switches and non-sequential reads
+        self.switch_counts = count_switches(indices, self._file_ids, self._minibatch_size, self._num_workers)
+        print('%s: %d file switches and %d non-sequential reads expected this epoch' %\
+                (self.__class__.__name__, self.switch_counts['file_switches'], self.switch_counts['jumps']))
+
+        return iter(indices)
+
+    @staticmethod
+    def create(ds, cfg):
+        file_ids = ds.file_ids() if hasattr(ds, 'file_ids') else np.zeros(len(ds), dtype=np.int64)
+        return LocalityBatchSampler(file_ids, cfg['minibatch_size'],
+                num_workers=cfg.get('num_workers', 1),
+                block_size=cfg.get('block_size', -1),
+                window=cfg.get('window', 1),
+                shuffle=cfg.get('shuffle', True),
+                seed=cfg.get('seed', -1))
+
+
+class VoxelBudgetBatchSampler(AbstractBatchSampler):
+    '''
+    Batch sampler which packs events into minibatches under a budget of
+    voxels rather than a fixed number of events, using the per-event voxel
+    counts stored in a precomputed index (see `bin/index_voxel_counts.py`).
+
+    For training, events are shuffled, sorted by size within buckets of
+    `bucket_size` events (so that events of similar sizes are packed
+    together) and the resulting minibatches are shuffled. For inference,
+    with `sort` set to `True`, events are packed by decreasing size. An
+    event which exceeds the budget on its own makes up a minibatch.
+
+    Each minibatch counts as one minibatch in the `batch_size` /
+    `minibatch_size` bookkeeping of `Trainval`, whatever its number
+    of events.
+
+    .. code-block:: yaml
+
+        iotool:
+          sampler:
+            name: VoxelBudgetBatchSampler
+            index: /path/to/voxel_counts.npy
+            voxel_budget: 1000000
+            max_events: 64
+            bucket_size: 256
+            sort: false
+    '''
+    BATCHED = True
+
+    def __init__(self, sizes, voxel_budget, max_events=-1, bucket_size=100, sort=False, shuffle=True, seed=0):
+        '''
+        Checks the sampler parameters.
+
+        Parameters
+        ----------
+        sizes : np.ndarray
+            (N) Number of voxels in each sample
+        voxel_budget : int
+            Maximum number of voxels in a minibatch
+        max_events : int, default -1
+            Maximum number of events in a minibatch. If not positive, it is not limited
+        bucket_size : int, default 100
+            Number of shuffled events which are sorted by size together
+        sort : bool, default False
+            If `True`, pack the events by decreasing size, without shuffling
+        shuffle : bool, default True
+            If `False` (and `sort` is `False`), pack the events in order
+        seed : int, default 0
+            Seed of the random number generator
+        '''
+        max_events = int(max_events) if max_events > 0 else len(sizes)
+        super().__init__(len(sizes), min(max_events, len(sizes)), seed)
+        self._sizes = np.asarray(sizes, dtype=np.int64)
+        self._voxel_budget = int(voxel_budget)
+        self._max_events = max_events
+        self._bucket_size = max(1, int(bucket_size))
+        self._sort = sort
+        self._shuffle = shuffle
+        if self._voxel_budget < 1:
+            raise ValueError('%s received invalid voxel budget %d' % (self.__class__.__name__, voxel_budget))
+
+        self._batches = self._pack()
+
+    def __len__(self):
+        return len(self._batches)
+
+    def _pack(self):
+        '''
+        Orders the events and packs them into minibatches.
+
+        Returns
+        -------
+        list
+            List of minibatches (arrays of sample indices)
+        '''
+        # Order the events
+        if self._sort:
+            order = np.argsort(-self._sizes, kind='stable')
+        elif self._shuffle:
+            order = self._random.permutation(self._data_size)
+            for start in range(0, self._data_size, self._bucket_size):
+                bucket = order[start:start+self._bucket_size]
+                order[start:start+self._bucket_size] = bucket[np.argsort(self._sizes[bucket], kind='stable')]
+        else:
+            order = np.arange(self._data_size)
+
+        # Greedily pack the ordered events under the budget
+        batches, start, total = [], 0, 0
+        for i, size in enumerate(self._sizes[order]):
+            if i > start and (total + size > self._voxel_budget or i - start == self._max_events):
+                batches.append(order[start:i])
+                start, total = i, 0
+            total += size
+        if start < self._data_size:
+            batches.append(order[start:])
+
+        # Shuffle the minibatches, if needed
+        if self._shuffle and not self._sort:
+            batches = [batches[i] for i in self._random.permutation(len(batches))]
+
+        return batches
+
+    def __iter__(self):
+        batches, self._batches = self._batches, self._pack()
+        return iter([b.tolist() for b in batches])
+
+    @staticmethod
+    def create(ds, cfg):
+        counts = np.load(cfg['index'])
+        event_ids = ds.event_ids() if hasattr(ds, 'event_ids') else np.arange(len(ds))
+        if np.max(event_ids) >= len(counts) or np.any(counts[event_ids] < 0):
+            raise ValueError('The voxel index %s does not cover all the dataset entries' % cfg['index'])
+        return VoxelBudgetBatchSampler(counts[event_ids], cfg['voxel_budget'],
+                max_events=cfg.get('max_events', -1),
+                bucket_size=cfg.get('bucket_size', 100),
+                sort=cfg.get('sort', False),
+                shuffle=cfg.get('shuffle', True),
+                seed=cfg.get('seed', -1))
+
+
+def count_switches(indices, file_ids, minibatch_size, num_workers=1):
+    '''
+    Counts, for a given sampling order, the number of times the DataLoader
+    workers have to switch file and the number of non-sequential reads
+    (which may force ROOT to load a new basket). This can be used to compare
+    the I/O pattern of different samplers.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        (N) Ordered list of sample indices produced by a sampler
+    file_ids : np.ndarray
+        Index of the file in which each sample is stored
+    minibatch_size : int
+        Number of samples in each minibatch
+    num_workers : int, default 1
+        Number of DataLoader workers (minibatches are dispatched round-robin)
+
+    Returns
+    -------
+    dict
+        Number of file switches and non-sequential reads
+    '''
+    indices = np.asarray(indices)
+    file_ids = np.asarray(file_ids)
+    batch_ids = np.arange(len(indices)) // minibatch_size
+    counts = {'file_switches': 0, 'jumps': 0}
+    for w in range(max(1, num_workers)):
+        sequence = indices[(batch_ids % max(1, num_workers)) == w]
+        if len(sequence) < 2:
+            continue
+        counts['file_switches'] += int(np.sum(file_ids[sequence[1:]] != file_ids[sequence[:-1]]))
+        counts['jumps'] += int(np.sum(np.diff(sequence) != 1))
+
+    return counts
@@ -0,0 +1,177 @@
+import os
+import h5py
+import numpy as np
+
+
+def shard_file_name(file_name, shard_id):
+    '''
+    Name of the file written by one shard.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the merged output file
+    shard_id : int
+        Index of the shard
+
+    Returns
+    -------
+    str
+        Name of the shard file (e.g. `output_shard0003.h5`)
+    '''
+    root, ext = os.path.splitext(file_name)
+    return f'{root}_shard{shard_id:04d}{ext}'
+
+
+def merge_shards(file_name, shard_paths):
+    '''
+    Builds an index file which stitches the shards written by several
+    `HDF5Writer` instances (version 2 layout) into a single file.
+
+    The data arrays are HDF5 virtual datasets which map the arrays of the
+    shards one after the other, without copying them. The offset tables
+    (`events` and the `index` of list keys) are small: they are stored
+    in the index file, shifted by the number of rows of the previous shards.
+    The shard paths are stored relative to the index file, so the index
+    file and the shards can be moved together, along with their IDs
+    (`shard_ids` attribute, -1 if unknown). Each event ID (`index` key)
+    must be stored in a single shard.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the index file to create
+    shard_paths : list(str)
+        Paths to the shard files, in the order the events are to be exposed
+
+    Returns
+    -------
+    int
+        Total number of events
+    '''
+    assert len(shard_paths), 'Must provide at least one shard to merge'
+    shards = [h5py.File(path, 'r') for path in shard_paths]
+    try:
+        # Check that the shards can be stitched together
+        for path, shard in zip(shard_paths, shards):
+            assert shard.attrs.get('version', 1) > 1,\
+                    f'Shard {path} does not use the version 2 (offsets) layout'
+            assert shard['events'].dtype == shards[0]['events'].dtype,\
+                    f'Shard {path} does not store the same keys as {shard_paths[0]}'
+
+        # Check that the event IDs of the shards do not overlap
+        index_path = 'data/index' if 'data' in shards[0] else 'index'
+        if index_path in shards[0]:
+            event_ids = np.concatenate([shard[index_path][:] for shard in shards])
+            assert len(np.unique(event_ids)) == len(event_ids),\
+                    'The same event ID is stored in more than one shard'
+
+        # List the datasets of the first shard
+        datasets = []
+        shards[0].visititems(lambda name, obj: datasets.append(name) if isinstance(obj, h5py.Dataset) else None)
+
+        base_dir = os.path.dirname(os.path.abspath(file_name))
+        with h5py.File(file_name, 'w') as out:
+            for key, value in shards[0].attrs.items():
+                if key != 'shard_id':
+                    out.attrs[key] = value
+            out.attrs['shards'] = [os.path.relpath(os.path.abspath(p), base_dir) for p in shard_paths]
+            out.attrs['shard_ids'] = [shard.attrs.get('shard_id', -1) for shard in shards]
+            for name in datasets:
+                if name == 'info':
+                    shards[0].copy('info', out)
+                elif is_offsets(shards[0], name):
+                    stack_offsets(out, name, [shard[name] for shard in shards])
+                else:
+                    stack_virtual(out, name, [shard[name] for shard in shards], out.attrs['shards'])
+                for key, value in shards[0][name].attrs.items():
+                    out[name].attrs[key] = value
+
+            return len(out['events']) - 1
+
+    finally:
+        for shard in shards:
+            shard.close()
+
+
+def is_offsets(file, name):
+    '''
+    Checks whether a dataset is an offsets table: the `events` table or the
+    `index` of a list key (as opposed to the `index` key itself).
+
+    Parameters
+    ----------
+    file : h5py.File
+        HDF5 file instance
+    name : str
+        Path of the dataset
+
+    Returns
+    -------
+    bool
+        `True` if the dataset is an offsets table
+    '''
+    if name == 'events':
+        return True
+    parent = file[os.path.dirname(name) or '/']
+    return os.path.basename(name) == 'index' and ('elements' in parent or 'element_0' in parent)
+
+
+def stack_offsets(out, name, datasets):
+    '''
+    Stacks the offset tables of the shards, shifting each of them by the
+    number of rows referred to by the tables of the previous shards.
+
+    Parameters
+    ----------
+    out : h5py.File
+        Index file
+    name : str
+        Path of the offsets dataset
+    datasets : list(h5py.Dataset)
+        Offset tables of the shards (one more row than entries, starting at 0)
+    '''
+    shape   = datasets[0].shape[1:]
+    dataset = out.create_dataset(name, (1, *shape), maxshape=(None, *shape), dtype=datasets[0].dtype)
+    fields = datasets[0].dtype.names
+    for shard in datasets:
+        offsets = shard[1:]
+        last = dataset[-1]
+        if fields is None:
+            offsets = offsets + last
+        else:
+            for field in fields:
+                offsets[field] += last[field]
+        first = len(dataset)
+        dataset.resize(first + len(offsets), axis=0)
+        dataset[first:] = offsets
+
+
+def stack_virtual(out, name, datasets, paths):
+    '''
+    Creates a virtual dataset which concatenates the datasets of the shards.
+
+    Parameters
+    ----------
+    out : h5py.File
+        Index file
+    name : str
+        Path of the dataset
+    datasets : list(h5py.Dataset)
+        Datasets of the shards
+    paths : list(str)
+        Paths to the shard files, relative to the index file
+    '''
+    total = sum(len(d) for d in datasets)
+    shape, dtype = datasets[0].shape[1:], datasets[0].dtype
+    if not total:
+        out.create_dataset(name, (0, *shape), maxshape=(None, *shape), dtype=dtype)
+        return
+
+    layout = h5py.VirtualLayout(shape=(total, *shape), dtype=dtype)
+    first = 0
+    for path, dataset in zip(paths, datasets):
+        if len(dataset):
+            layout[first:first + len(dataset)] = h5py.VirtualSource(path, name, shape=dataset.shape)
+            first += len(dataset)
+    out.create_virtual_dataset(name, layout)
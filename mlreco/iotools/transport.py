@@ -0,0 +1,270 @@
+import uuid
+import time
+import weakref
+import numpy as np
+from multiprocessing import RawArray, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# Transports instantiated in the current (main) process, by segment prefix
+_TRANSPORTS = {}
+
+
+def _open_batch(prefix, slot, name, size, keys, layout, extras):
+    '''
+    Rebuilds a batch from its shared-memory handle. This is called when
+    a `SharedBatch` is unpickled in the main process.
+
+    Parameters
+    ----------
+    prefix : str
+        Prefix of the transport which owns the segment
+    slot : int
+        Index of the segment slot in the pool
+    name : str
+        Name of the shared-memory segment
+    size : int
+        Number of bytes used in the segment
+    keys : list
+        Ordered list of batch keys
+    layout : dict
+        Dictionary of (offset, dtype, shape) for each array key
+    extras : dict
+        Dictionary of the other (pickled) batch values
+
+    Returns
+    -------
+    dict
+        Batch dictionary, with array values backed by shared memory
+    '''
+    transport = _TRANSPORTS[prefix]
+    base = transport.attach(slot, name, size)
+    result = {}
+    for key in keys:
+        if key in layout:
+            offset, dtype, shape = layout[key]
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            result[key] = base[offset:offset+nbytes].view(dtype).reshape(shape)
+        else:
+            result[key] = extras[key]
+
+    return result
+
+
+class SharedBatch:
+    '''
+    Handle to a batch placed in a shared-memory segment by a
+    DataLoader worker. It is pickled as a few integers and strings
+    and rebuilt as a plain batch dictionary in the main process.
+    '''
+
+    def __init__(self, prefix, slot, name, size, keys, layout, extras):
+        self.args = (prefix, slot, name, size, keys, layout, extras)
+
+    def __reduce__(self):
+        return _open_batch, self.args
+
+
+class SharedMemoryTransport:
+    '''
+    Collate wrapper which moves the collated arrays of a batch from the
+    DataLoader workers to the main process through shared memory.
+
+    Each worker owns a pool of `pool_size` recycled segments. A worker
+    copies the arrays of a collated batch into one of its free segments
+    (growing it if needed) and only sends a handle to the main process,
+    which wraps the segment into numpy arrays without copying. A segment
+    is handed back to its worker once all the arrays which view it
+    (including the tensors built from them) have been garbage collected.
+    If none of its segments is free, a worker falls back to the default
+    (pickled) transport for that batch.
+
+    .. code-block:: yaml
+
+        iotool:
+          transport:
+            pool_size: 4
+            dtype: float32
+    '''
+    ALIGN = 64
+
+    def __init__(self, collate_fn, num_workers, pool_size=4, dtype=None):
+        '''
+        Initialize the segment pool.
+
+        Parameters
+        ----------
+        collate_fn : callable
+            Collate function to wrap
+        num_workers : int
+            Number of DataLoader workers
+        pool_size : int, default 4
+            Number of segments owned by each worker
+        dtype : str, optional
+            If specified, all numerical arrays are cast to this type while
+            they are copied to shared memory. With `float32`, tensors are
+            then built without any copy in `Trainval.make_input_forward`.
+            Only use this if all the values are exactly representable.
+        '''
+        self.collate_fn  = collate_fn
+        self.num_workers = num_workers
+        self.pool_size   = pool_size
+        self.dtype       = np.dtype(dtype) if dtype is not None else None
+        self.prefix      = f'mlr{uuid.uuid4().hex[:12]}'
+        self.busy        = RawArray('b', max(1, num_workers) * pool_size)
+
+        # Main process segment attachments, worker process segments
+        self._attached = {}
+        self._segments = {}
+        _TRANSPORTS[self.prefix] = self
+
+        # Start the resource tracker before the workers are forked, so that
+        # the segments are tracked (and unlinked) by a single process
+        resource_tracker.ensure_running()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_attached'], state['_segments'] = {}, {}
+        return state
+
+    def __call__(self, batch):
+        '''
+        Collates a batch and, in a worker process, moves it to shared memory.
+
+        Parameters
+        ----------
+        batch : list
+            List of samples
+
+        Returns
+        -------
+        Union[dict, SharedBatch]
+            Collated batch or handle to it
+        '''
+        from torch.utils.data import get_worker_info
+        result = self.collate_fn(batch) if self.collate_fn is not None else batch
+        info = get_worker_info()
+        if info is None or not isinstance(result, dict):
+            return result
+
+        # Find a free segment slot among the ones of this worker. If there
+        # is none, send the batch as is (with the same array types)
+        slots = range(info.id * self.pool_size, (info.id + 1) * self.pool_size)
+        slot = next((s for s in slots if not self.busy[s]), None)
+        if slot is None:
+            for key, value in result.items():
+                if isinstance(value, np.ndarray):
+                    result[key] = value.astype(self._get_dtype(value), copy=False)
+            return result
+
+        # Lay out the arrays in the segment
+        layout, extras, size = {}, {}, 0
+        for key, value in result.items():
+            if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+                dtype = self._get_dtype(value)
+                layout[key] = (size, dtype.str, value.shape)
+                size += value.size * dtype.itemsize
+                size += (-size) % self.ALIGN
+            else:
+                extras[key] = value
+
+        # Copy the arrays, hand the segment over to the main process
+        shm = self._get_segment(slot, size)
+        self.busy[slot] = 1
+        base = np.ndarray((shm.size,), dtype=np.uint8, buffer=shm.buf)
+        for key, (offset, dtype, shape) in layout.items():
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            np.copyto(base[offset:offset+nbytes].view(dtype).reshape(shape), result[key], casting='unsafe')
+        del base
+
+        return SharedBatch(self.prefix, slot, shm.name, size, list(result.keys()), layout, extras)
+
+    def _get_dtype(self, array):
+        '''
+        Type of an array once it is transported.
+
+        Parameters
+        ----------
+        array : np.ndarray
+            Collated array
+
+        Returns
+        -------
+        np.dtype
+            Transported array type
+        '''
+        if self.dtype is not None and array.dtype.kind in 'biuf':
+            return self.dtype
+        return array.dtype
+
+    def _get_segment(self, slot, size):
+        '''
+        Fetches the segment of a slot in a worker process, (re)creating
+        it if it does not exist yet or if it is too small.
+
+        Parameters
+        ----------
+        slot : int
+            Index of the segment slot
+        size : int
+            Minimum size of the segment in bytes
+
+        Returns
+        -------
+        SharedMemory
+            Shared-memory segment
+        '''
+        shm = self._segments.get(slot, None)
+        if shm is not None and shm.size >= size:
+            return shm
+        if shm is not None:
+            shm.close()
+
+        # Over-allocate to amortize the growth of the batches
+        name = f'{self.prefix}_{slot}_{time.time_ns() % 10**12}'
+        shm = SharedMemory(name=name, create=True, size=max(int(1.25*size), self.ALIGN))
+        self._segments[slot] = shm
+
+        return shm
+
+    def attach(self, slot, name, size):
+        '''
+        Maps a segment in the main process. A new segment is unlinked as
+        soon as it is mapped by both processes, so that it cannot leak.
+
+        Parameters
+        ----------
+        slot : int
+            Index of the segment slot
+        name : str
+            Name of the shared-memory segment
+        size : int
+            Number of bytes used in the segment
+
+        Returns
+        -------
+        np.ndarray
+            Byte array which views the segment. The slot is released when
+            this array (and all the arrays which view it) is deleted.
+        '''
+        if slot not in self._attached or self._attached[slot].name != name:
+            if slot in self._attached:
+                self._attached[slot].close()
+            shm = SharedMemory(name=name, create=False)
+            shm.unlink()
+            self._attached[slot] = shm
+
+        base = np.ndarray((size,), dtype=np.uint8, buffer=self._attached[slot].buf)
+        weakref.finalize(base, self.release, slot)
+
+        return base
+
+    def release(self, slot):
+        '''
+        Hands a segment slot back to its worker.
+
+        Parameters
+        ----------
+        slot : int
+            Index of the segment slot
+        '''
+        self.busy[slot] = 0
@@ -1,13 +1,16 @@
 import os
+import time
 import yaml
 import h5py
 import inspect
 import numpy as np
+from operator import attrgetter, methodcaller
 from collections import defaultdict
 from larcv import larcv
 from analysis import classes as analysis
 
 from mlreco.utils.globals import SHAPE_LABELS, PID_LABELS
+from mlreco.iotools.shards import shard_file_name
 
 
 class HDF5Writer:
@@ -17,6 +20,21 @@ class HDF5Writer:
     can also be used to append an existing HDF5 file with
     information coming out of the analysis tools.
 
+    The content of each event is accumulated in memory and written to
+    the file in one contiguous block per dataset when the buffer is
+    flushed. By default, the buffer is flushed (and the file closed)
+    after each batch. With `buffer_size > 0`, the file is kept open and
+    the buffer is flushed every `buffer_size` events and/or every
+    `flush_interval` seconds, and when the writer is closed.
+
+    Two file layouts are supported:
+    - version 1: each event stores a region reference to the rows of each
+      key, and list keys have an `index` of references to their elements;
+    - version 2: each key is a flat array, list keys have an `index` of
+      int64 offsets (one more row than elements, starting at 0) and the
+      `events` table stores the cumulative row offsets of each key (one more
+      row than events). Event `i` spans `[events[key][i], events[key][i+1])`.
+
     More documentation to come.
     '''
     # Analysis object attributes to be stored as enumerated types and their associated rules
@@ -70,7 +88,14 @@ class HDF5Writer:
                  result_keys: list = None,
                  skip_result_keys: list = [],
                  append_file: bool = False,
-                 merge_groups: bool = False):
+                 merge_groups: bool = False,
+                 buffer_size: int = 0,
+                 flush_interval: float = None,
+                 chunk_size: int = None,
+                 compression: str = None,
+                 compression_opts = None,
+                 version: int = 2,
+                 shard_id: int = None):
         '''
         Initializes the basics of the output file
 
@@ -90,17 +115,60 @@ class HDF5Writer:
             Add new values to the end of an existing file
         merge_groups: bool, default False
             Merge `data` and `result` blobs in the root directory of the HDF5 file
+        buffer_size: int, default 0
+            Number of events to accumulate before writing them to the file. If
+            0, the events are written (and the file closed) after each batch
+        flush_interval: float, optional
+            Maximum time in seconds between two flushes of the buffer. Bounds
+            the number of events lost if the process is interrupted
+        chunk_size: int, optional
+            Number of rows in each chunk of the datasets. If not specified,
+            the chunk shapes are picked by h5py
+        compression: str, optional
+            Compression filter applied to the datasets (`gzip`, `lzf`, etc.)
+        compression_opts: optional
+            Options of the compression filter (e.g. `gzip` level)
+        version: int, default 2
+            File layout version (1: region references, 2: offsets)
+        shard_id: int, optional
+            If specified, this writer produces one shard of a sharded output
+            and writes to `<file_name>_shard<shard_id>.h5`. The shards can then
+            be stitched together with `mlreco.iotools.shards.merge_shards`
         '''
         # Store attributes
-        self.file_name        = file_name
+        self.file_name        = file_name if shard_id is None else shard_file_name(file_name, shard_id)
         self.input_keys       = input_keys
         self.skip_input_keys  = skip_input_keys
         self.result_keys      = result_keys
         self.skip_result_keys = skip_result_keys
         self.append_file      = append_file
         self.merge_groups     = merge_groups
+        self.buffer_size      = buffer_size
+        self.flush_interval   = flush_interval
+        self.chunk_size       = chunk_size
+        self.compression      = compression
+        self.compression_opts = compression_opts
+        self.version          = version
+        self.shard_id         = shard_id
         self.ready            = False
         self.object_dtypes    = {}
+        self.object_plans     = {}
+
+        # Open file handle (buffered mode only) and write buffers
+        self._file = None
+        self._reset_buffers()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def create(self, data_blob, result_blob=None, cfg=None):
         '''
@@ -122,7 +190,7 @@ class HDF5Writer:
         self.batch_size = len(data_blob['index'])
 
         # Initialize a dictionary to store keys and their properties (dtype and shape)
-        self.key_dict = defaultdict(lambda: {'category': None, 'dtype':None, 'width':0, 'merge':False, 'scalar':False, 'larcv':False})
+        self.key_dict = defaultdict(lambda: {'category': None, 'dtype':None, 'width':0, 'merge':False, 'scalar':False, 'larcv':False, 'object':None})
 
         # If requested, loop over input_keys and add them to what needs to be tracked
         if self.input_keys is None: self.input_keys = data_blob.keys()
@@ -145,17 +213,29 @@ class HDF5Writer:
             self.register_key(result_blob, key, 'result')
 
         # Initialize the output HDF5 file
-        with h5py.File(self.file_name, 'w') as file:
-            # Initialize the info dataset that stores top-level description of what is stored
-            if cfg is not None:
-                file.create_dataset('info', (0,), maxshape=(None,), dtype=None)
-                file['info'].attrs['cfg'] = yaml.dump(cfg)
-
-            # Initialize the event dataset and the corresponding reference array datasets
-            self.initialize_datasets(file)
+        assert self.version in [1, 2], f'File layout version {self.version} not recognized'
+        assert self.shard_id is None or self.version > 1, 'Sharded outputs require the version 2 layout'
+        file = h5py.File(self.file_name, 'w')
+        file.attrs['version'] = self.version
+        if self.shard_id is not None:
+            file.attrs['shard_id'] = self.shard_id
+
+        # Initialize the info dataset that stores top-level description of what is stored
+        if cfg is not None:
+            file.create_dataset('info', (0,), maxshape=(None,), dtype=None)
+            file['info'].attrs['cfg'] = yaml.dump(cfg)
+
+        # Initialize the event dataset and the corresponding reference array datasets
+        self.initialize_datasets(file)
+
+        # Keep the file open in buffered mode
+        if self.buffer_size > 0:
+            self._file = file
+        else:
+            file.close()
 
-            # Mark file as ready for use
-            self.ready = True
+        # Mark file as ready for use
+        self.ready = True
 
     def register_key(self, blob, key, category):
         '''
@@ -200,8 +280,9 @@ class HDF5Writer:
                     object_type = type(blob[key][0][0])
                     if not object_type in self.object_dtypes:
                         self.object_dtypes[object_type] = self.get_object_dtype(blob[key][0][0])
-                    self.key_dict[key]['dtype'] = self.object_dtypes[object_type]
-                    self.key_dict[key]['larcv'] = object_type in self.LARCV_SKIP
+                    self.key_dict[key]['dtype']  = self.object_dtypes[object_type]
+                    self.key_dict[key]['larcv']  = object_type in self.LARCV_SKIP
+                    self.key_dict[key]['object'] = object_type
 
                 elif not hasattr(blob[key][0][0], '__len__'):
                     # List containing a single list of scalars per batch ID
@@ -233,6 +314,10 @@ class HDF5Writer:
         function assumes that the the class only posses getters that return
         either a scalar, a string, a larcv.Vertex, a list, np.ndarrary or a set.
 
+        It also builds the accessor plan of the class, stored in `object_plans`,
+        which lists the (key, getter, kind, dtype) used to extract each
+        attribute of a list of objects at once (see `store_objects`).
+
         Parameters
         ----------
         object : class instance
@@ -243,7 +328,7 @@ class HDF5Writer:
         list
             List of (key, dtype) pairs
         '''
-        object_dtype = []
+        object_dtype, plan = [], []
         members = inspect.getmembers(obj)
         is_larcv = type(obj) in self.LARCV_SKIP
         skip_keys = self.LARCV_SKIP[type(obj)] if is_larcv else self.ANA_SKIP[type(obj)]
@@ -257,20 +342,25 @@ class HDF5Writer:
                 if callable(val):
                     continue
 
-            # Append the relevant data type
+            # Append the relevant data type and the way to fetch it
+            getter = methodcaller(key) if is_larcv else attrgetter(key)
             if isinstance(val, str):
                 # String
                 object_dtype.append((key, h5py.string_dtype()))
+                plan.append((key, getter, 'scalar', None))
             elif not is_larcv and key in self.ANA_ENUM:
                 # Known enumerator
                 object_dtype.append((key, h5py.enum_dtype(self.ANA_ENUM[key], basetype=type(val))))
+                plan.append((key, getter, 'scalar', None))
             elif np.isscalar(val):
                 # Scalar
                 dtype = type(val) if not isinstance(val, bool) else np.uint8
                 object_dtype.append((key, dtype))
+                plan.append((key, getter, 'scalar', None))
             elif isinstance(val, larcv.Vertex):
                 # Three-vector
                 object_dtype.append((key, np.float32, 4)) # x, y, z, t
+                plan.append((key, getter, 'vertex', None))
             elif hasattr(val, '__len__'):
                 # List/array of values
                 dtype, shape = None, None
@@ -286,11 +376,15 @@ class HDF5Writer:
 
                 if key in self.ANA_FIXED_LENGTH:
                     object_dtype.append((key, dtype, shape))
+                    plan.append((key, getter, 'fixed', None))
                 else:
                     object_dtype.append((key, h5py.vlen_dtype(dtype)))
+                    plan.append((key, getter, 'array' if hasattr(val, 'dtype') else 'list', dtype))
             else:
                 raise ValueError(f'Attribute {key} of {obj} has unrecognized type {type(val)}')
 
+        self.object_plans[type(obj)] = plan
+
         return object_dtype
 
     def initialize_datasets(self, file):
@@ -302,8 +396,9 @@ class HDF5Writer:
         file : h5py.File
             HDF5 file instance
         '''
+        self._dtypes, self._lengths, self._index_paths = {}, {}, set()
         self.event_dtype = []
-        ref_dtype = h5py.special_dtype(ref=h5py.RegionReference)
+        ref_dtype = h5py.special_dtype(ref=h5py.RegionReference) if self.version < 2 else np.int64
         for key, val in self.key_dict.items():
             group = file
             if not self.merge_groups:
@@ -313,11 +408,9 @@ class HDF5Writer:
 
             if not val['merge'] and not isinstance(val['width'], list):
                 # If the key contains a list of objects of identical shape
-                w = val['width']
-                shape, maxshape = [(0, w), (None, w)] if w else [(0,), (None,)]
-                group.create_dataset(key, shape, maxshape=maxshape, dtype=val['dtype'])
-                group[key].attrs['scalar'] = val['scalar']
-                group[key].attrs['larcv']  = val['larcv']
+                dataset = self.create_dataset(group, key, val['dtype'], val['width'])
+                dataset.attrs['scalar'] = val['scalar']
+                dataset.attrs['larcv']  = val['larcv']
 
             elif not val['merge']:
                 # If the elements of the list are of variable widths, refer to one
@@ -325,22 +418,60 @@ class HDF5Writer:
                 # each element downstream.
                 n_arrays = len(val['width'])
                 subgroup = group.create_group(key)
-                subgroup.create_dataset(f'index', (0, n_arrays), maxshape=(None, n_arrays), dtype=ref_dtype)
+                self.create_dataset(subgroup, 'index', ref_dtype, n_arrays, index=True)
                 for i, w in enumerate(val['width']):
-                    shape, maxshape = [(0, w), (None, w)] if w else [(0,), (None,)]
-                    subgroup.create_dataset(f'element_{i}', shape, maxshape=maxshape, dtype=val['dtype'])
+                    self.create_dataset(subgroup, f'element_{i}', val['dtype'], w)
 
             else:
                 # If the  elements of the list are of equal width, store them all
                 # to one dataset. An index is stored alongside the dataset to break
                 # it into individual elements downstream.
                 subgroup = group.create_group(key)
-                w = val['width'][0]
-                shape, maxshape = [(0, w), (None, w)] if w else [(0,), (None,)]
-                subgroup.create_dataset('elements', shape, maxshape=maxshape, dtype=val['dtype'])
-                subgroup.create_dataset('index', (0,), maxshape=(None,), dtype=ref_dtype)
+                self.create_dataset(subgroup, 'elements', val['dtype'], val['width'][0])
+                self.create_dataset(subgroup, 'index', ref_dtype, index=True)
 
-        file.create_dataset('events', (0,), maxshape=(None,), dtype=self.event_dtype)
+        self.create_dataset(file, 'events', self.event_dtype, index=True)
+
+    def create_dataset(self, group, key, dtype, width=0, index=False):
+        '''
+        Create an extendable dataset with the requested chunking and
+        compression, register it in the write buffers.
+
+        Parameters
+        ----------
+        group : h5py.Group
+            Group under which to create the dataset
+        key : str
+            Name of the dataset
+        dtype : Union[type, np.dtype, list]
+            Type of the dataset elements
+        width : int, default 0
+            Number of columns of the dataset (0 for a 1D dataset)
+        index : bool, default False
+            Whether the dataset stores references or offsets (never compressed).
+            In the version 2 layout, offsets start with a row of zeros
+
+        Returns
+        -------
+        h5py.Dataset
+            Dataset instance
+        '''
+        offset = int(index and self.version > 1)
+        shape, maxshape = [(offset, width), (None, width)] if width else [(offset,), (None,)]
+        options = {}
+        if self.chunk_size is not None:
+            options['chunks'] = (self.chunk_size, *maxshape[1:])
+        if self.compression is not None and not index:
+            options['compression'] = self.compression
+            options['compression_opts'] = self.compression_opts
+
+        dataset = group.create_dataset(key, shape, maxshape=maxshape, dtype=dtype, **options)
+        self._dtypes[dataset.name]  = dataset.dtype
+        self._lengths[dataset.name] = len(dataset) - offset
+        if index:
+            self._index_paths.add(dataset.name)
+
+        return dataset
 
     def append(self, data_blob=None, result_blob=None, cfg=None):
         '''
@@ -360,37 +491,31 @@ class HDF5Writer:
             self.create(data_blob, result_blob, cfg)
             self.ready = True
 
-        # Append file
-        with h5py.File(self.file_name, 'a') as file:
-            # Loop over batch IDs
-            for batch_id in range(self.batch_size):
-                # Initialize a new event
-                event = np.empty(1, self.event_dtype)
-
-                # Initialize a dictionary of references to be passed to the event
-                # dataset and store the relevant array input and result keys
-                ref_dict = {}
-                for key in self.input_keys:
-                    self.append_key(file, event, data_blob, key, batch_id)
-                for key in self.result_keys:
-                    self.append_key(file, event, result_blob, key, batch_id)
-
-                # Append event
-                event_id  = len(file['events'])
-                events_ds = file['events']
-                events_ds.resize(event_id + 1, axis=0)
-                events_ds[event_id] = event
-
-    def append_key(self, file, event, blob, key, batch_id):
-        '''
-        Stores array in a specific dataset of an HDF5 file
+        # Loop over batch IDs (the batch size may vary from one batch to the next)
+        self.batch_size = len(data_blob['index'])
+        for batch_id in range(self.batch_size):
+            # Buffer the relevant array input and result keys, keep
+            # track of where they will be stored in the event
+            event = {}
+            for key in self.input_keys:
+                self.append_key(event, data_blob, key, batch_id)
+            for key in self.result_keys:
+                self.append_key(event, result_blob, key, batch_id)
+            self._events.append(event)
+
+        # Flush the buffer, if needed
+        if self.buffer_size < 1 or len(self._events) >= self.buffer_size or\
+                (self.flush_interval is not None and time.time() - self._last_flush > self.flush_interval):
+            self.flush()
+
+    def append_key(self, event, blob, key, batch_id):
+        '''
+        Buffers the content of a key for one event
 
         Parameters
         ----------
-        file : h5py.File
-            HDF5 file instance
         event : dict
-            Dictionary of objects that make up one event
+            Dictionary of (dataset, first, last) regions that make up one event
         blob : dict
             Dictionary containing the information to be stored
         key : string
@@ -399,10 +524,9 @@ class HDF5Writer:
             Batch ID to be stored
         '''
         val   = self.key_dict[key]
-        group = file
+        group = ''
         if not self.merge_groups:
-            cat   = val['category']
-            group = file[cat]
+            group = '/' + val['category']
 
         if not val['merge'] and not isinstance(val['width'], list):
             # Store single object
@@ -410,11 +534,11 @@ class HDF5Writer:
                 obj = blob[key]
             else:
                 obj = blob[key][batch_id] if len(blob[key]) == self.batch_size else blob[key][0]
-            if not hasattr(obj, '__len__'):
+            if not hasattr(obj, '__len__') or isinstance(obj, str):
                 obj = [obj]
 
-            if val['dtype'] in self.object_dtypes.values():
-                self.store_objects(group, event, key, obj, val['dtype'])
+            if val['object'] is not None:
+                self.store_objects(group, event, key, obj, val['dtype'], self.object_plans[val['object']])
             else:
                 self.store(group, event, key, obj)
 
@@ -426,157 +550,242 @@ class HDF5Writer:
             # Store one array of for all in the list and a index to break them
             self.store_flat(group, event, key, blob[key][batch_id])
 
-    @staticmethod
-    def store(group, event, key, array):
+    def store(self, group, event, key, array):
         '''
-        Stores an `ndarray` in the file and stores its mapping
-        in the event dataset.
+        Buffers an `ndarray` and stores its mapping in the event.
 
         Parameters
         ----------
-        group : h5py.Group
-            Dataset group under which to store this array
+        group : str
+            Path of the group under which to store this array
         event : dict
-            Dictionary of objects that make up one event
+            Dictionary of (dataset, first, last) regions that make up one event
         key: str
             Name of the dataset in the file
         array : np.ndarray
             Array to be stored
         '''
-        # Extend the dataset, store array
-        dataset = group[key]
-        current_id = len(dataset)
-        dataset.resize(current_id + len(array), axis=0)
-        dataset[current_id:current_id + len(array)] = array
+        event[key] = self.extend(f'{group}/{key}', array)
 
-        # Define region reference, store it at the event level
-        region_ref = dataset.regionref[current_id:current_id + len(array)]
-        event[key] = region_ref
-
-    @staticmethod
-    def store_jagged(group, event, key, array_list):
+    def store_jagged(self, group, event, key, array_list):
         '''
-        Stores a jagged list of arrays in the file and stores
-        an index mapping for each array element in the event dataset.
+        Buffers a jagged list of arrays and stores an index
+        mapping for each array element in the event.
 
         Parameters
         ----------
-        group : h5py.Group
-            Dataset group under which to store this array
+        group : str
+            Path of the group under which to store this array
         event : dict
-            Dictionary of objects that make up one event
+            Dictionary of (dataset, first, last) regions that make up one event
         key: str
             Name of the dataset in the file
         array_list : list(np.ndarray)
             List of arrays to be stored
         '''
-        # Extend the dataset, store combined array
-        region_refs = []
+        # Buffer each array in its own dataset
+        regions = []
         for i, array in enumerate(array_list):
-            dataset = group[key][f'element_{i}']
-            current_id = len(dataset)
-            dataset.resize(current_id + len(array), axis=0)
-            dataset[current_id:current_id + len(array)] = array
-
-            region_ref = dataset.regionref[current_id:current_id + len(array)]
-            region_refs.append(region_ref)
-
-        # Define the index which stores a list of region_refs
-        index = group[key]['index']
-        current_id = len(dataset)
-        index.resize(current_id+1, axis=0)
-        index[current_id] = region_refs
+            regions.append(self.extend(f'{group}/{key}/element_{i}', array))
 
-        # Define a region reference to all the references, store it at the event level
-        region_ref = index.regionref[current_id:current_id+1]
-        event[key] = region_ref
+        # Define an index row which refers to all the arrays, map it in the event
+        event[key] = self.extend(f'{group}/{key}/index', [regions])
 
-    @staticmethod
-    def store_flat(group, event, key, array_list):
+    def store_flat(self, group, event, key, array_list):
         '''
-        Stores a concatenated list of arrays in the file and stores
-        its index mapping in the event dataset to break them.
+        Buffers a concatenated list of arrays and stores
+        its index mapping in the event to break them.
 
         Parameters
         ----------
-        group : h5py.Group
-            Dataset group under which to store this array
+        group : str
+            Path of the group under which to store this array
         event : dict
-            Dictionary of objects that make up one event
+            Dictionary of (dataset, first, last) regions that make up one event
         key: str
             Name of the dataset in the file
         array_list : list(np.ndarray)
             List of arrays to be stored
         '''
-        # Extend the dataset, store combined array
-        array = np.concatenate(array_list) if len(array_list) else []
-        dataset = group[key]['elements']
-        first_id = len(dataset)
-        dataset.resize(first_id + len(array), axis=0)
-        dataset[first_id:first_id + len(array)] = array
-
-        # Loop over arrays in the list, create a reference for each
-        index = group[key]['index']
-        current_id = len(index)
-        index.resize(current_id + len(array_list), axis=0)
-        last_id = first_id
-        for i, el in enumerate(array_list):
-            first_id = last_id
-            last_id += len(el)
-            el_ref = dataset.regionref[first_id:last_id]
-            index[current_id + i] = el_ref
-
-        # Define a region reference to all the references, store it at the event level
-        region_ref = index.regionref[current_id:current_id + len(array_list)]
-        event[key] = region_ref
+        # Buffer the arrays one after the other in the same dataset
+        regions = []
+        for array in array_list:
+            regions.append(self.extend(f'{group}/{key}/elements', array))
 
-    @staticmethod
-    def store_objects(group, event, key, array, obj_dtype):
+        # Define one index row per array, map all of them in the event
+        event[key] = self.extend(f'{group}/{key}/index', regions)
+
+    def store_objects(self, group, event, key, array, obj_dtype, plan):
         '''
-        Stores a list of objects with understandable attributes in
-        the file and stores its mapping in the event dataset.
+        Buffers a list of objects with understandable attributes
+        and stores its mapping in the event.
 
         Parameters
         ----------
-        group : h5py.Group
-            Dataset group under which to store this array
+        group : str
+            Path of the group under which to store this array
         event : dict
-            Dictionary of objects that make up one event
+            Dictionary of (dataset, first, last) regions that make up one event
         key: str
             Name of the dataset in the file
         array : np.ndarray
             Array to be stored
         obj_dtype : list
             List of (key, dtype) pairs which specify what's to store
+        plan : list
+            List of (key, getter, kind, dtype) which specify how to fetch it
         '''
-        # Convert list of objects to list of storable objects
+        # Convert list of objects to list of storable objects, one attribute at a time
         objects = np.empty(len(array), obj_dtype)
-        for i, o in enumerate(array):
-            for row in obj_dtype:
-                k, dtype, _ = row if len(row) == 3 else [*row, None]
-                attr = getattr(o, k)() if callable(getattr(o, k)) else getattr(o, k)
-                if np.isscalar(attr):
-                    objects[i][k] = attr
-                elif isinstance(attr, larcv.Vertex):
-                    vertex = np.array([getattr(attr, a)() for a in ['x', 'y', 'z', 't']], dtype=np.float32)
-                    objects[i][k] = vertex
-                elif hasattr(attr, '__len__'):
-                    vals = attr
-                    if not isinstance(attr, np.ndarray):
-                        vals = np.array([attr[i] for i in range(len(attr))])
-                    objects[i][k] = vals
+        if len(array):
+            for k, getter, kind, dtype in plan:
+                values = list(map(getter, array))
+                if kind == 'scalar':
+                    objects[k] = values
+                elif kind == 'vertex':
+                    objects[k] = [(v.x(), v.y(), v.z(), v.t()) for v in values]
+                elif kind == 'fixed':
+                    objects[k] = np.asarray(values)
+                elif kind == 'array':
+                    objects[k] = self.object_column(values)
                 else:
-                    raise ValueError(f'Type {type(attr)} of attribute {k} of object {o} does not match an expected dtype')
+                    objects[k] = self.object_column([np.fromiter(v, dtype, len(v)) for v in values])
 
-        # Extend the dataset, store array
-        dataset = group[key]
-        current_id = len(dataset)
-        dataset.resize(current_id + len(array), axis=0)
-        dataset[current_id:current_id + len(array)] = objects
+        # Buffer the objects, map them in the event
+        event[key] = self.extend(f'{group}/{key}', objects)
 
-        # Define region reference, store it at the event level
-        region_ref = dataset.regionref[current_id:current_id + len(array)]
-        event[key] = region_ref
+    @staticmethod
+    def object_column(arrays):
+        '''
+        Packs a list of arrays into a 1D object array (without letting
+        numpy stack arrays of identical shapes into a 2D array).
+
+        Parameters
+        ----------
+        arrays : list(np.ndarray)
+            List of arrays
+
+        Returns
+        -------
+        np.ndarray
+            Object array of arrays
+        '''
+        column = np.empty(len(arrays), dtype=object)
+        for i, array in enumerate(arrays):
+            column[i] = array
+        return column
+
+    def extend(self, path, rows):
+        '''
+        Buffers rows to be appended to a dataset and returns the
+        region of the dataset where they will be stored.
+
+        Parameters
+        ----------
+        path : str
+            Path of the dataset in the file
+        rows : Union[np.ndarray, list]
+            Rows to append to the dataset (regions for index datasets)
+
+        Returns
+        -------
+        tuple
+            (path, first, last) region of the dataset
+        '''
+        first = self._lengths[path]
+        if len(rows):
+            if path not in self._index_paths:
+                rows = np.asarray(rows, dtype=self._dtypes[path])
+            self._buffers[path].append(rows)
+            self._lengths[path] += len(rows)
+
+        return path, first, self._lengths[path]
+
+    def flush(self):
+        '''
+        Writes the buffered events to the file. Each dataset is resized and
+        written once, the datasets of arrays before the index datasets.
+        '''
+        if not len(self._events):
+            return
+
+        file = self._file
+        if file is None:
+            file = h5py.File(self.file_name, 'a')
+        try:
+            # Write the arrays
+            for path, rows in self._buffers.items():
+                if path not in self._index_paths:
+                    self._write(file[path], np.concatenate(rows) if len(rows) > 1 else rows[0])
+
+            # Convert regions to references (version 1) or to the offset of
+            # their end (version 2), write the indexes and then the events
+            datasets = {}
+            def to_ref(region):
+                path, first, last = region
+                if self.version > 1:
+                    return last
+                if path not in datasets:
+                    datasets[path] = file[path]
+                return datasets[path].regionref[first:last]
+
+            for path, rows in self._buffers.items():
+                if path in self._index_paths:
+                    dataset = file[path]
+                    rows = [r for block in rows for r in block]
+                    refs = np.empty((len(rows), *dataset.shape[1:]), dtype=dataset.dtype)
+                    for i, row in enumerate(rows):
+                        refs[i] = [to_ref(r) for r in row] if dataset.ndim > 1 else to_ref(row)
+                    self._write(dataset, refs)
+
+            events = np.empty(len(self._events), self.event_dtype)
+            for i, event in enumerate(self._events):
+                for key, region in event.items():
+                    events[key][i] = to_ref(region)
+            self._write(file['events'], events)
+
+            file.flush()
+
+        finally:
+            if self.buffer_size > 0:
+                self._file = file
+            else:
+                file.close()
+
+        self._reset_buffers()
+
+    def close(self):
+        '''
+        Flushes the buffered events and closes the file.
+        '''
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _reset_buffers(self):
+        '''
+        Empties the write buffers.
+        '''
+        self._events     = []
+        self._buffers    = defaultdict(list)
+        self._last_flush = time.time()
+
+    @staticmethod
+    def _write(dataset, array):
+        '''
+        Appends an array to the end of a dataset with a single resize.
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+            Dataset to extend
+        array : np.ndarray
+            Array to append
+        '''
+        first = len(dataset)
+        dataset.resize(first + len(array), axis=0)
+        dataset[first:first + len(array)] = array
 
 
 class CSVWriter:
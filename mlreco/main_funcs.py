@@ -228,6 +228,7 @@ def log(handlers, tstamp_iteration, #tspent_io, tspent_iteration,
     # Organize time info
     t_iter  = handlers.watch.time('iteration')
     t_io    = handlers.watch.time('io')
+    t_io_hidden = handlers.watch.time('io_hidden')
     t_save  = handlers.watch.time('save')
     t_net   = handlers.watch.time('train' if cfg['trainval']['train'] else 'forward')
     t_forward_cpu = handlers.watch.time_cpu('forward_cpu')
@@ -246,6 +247,8 @@ def log(handlers, tstamp_iteration, #tspent_io, tspent_iteration,
             'tsum': tsum,
             'tio': t_io,
             'tsumio': tsum_map['io'],
+            'tiohidden': t_io_hidden,
+            'tsumiohidden': tsum_map['io_hidden'],
             'mem': mem,
             'tforwardcpu': t_forward_cpu,
             'tbackwardcpu': t_backward_cpu
@@ -390,3 +393,7 @@ def inference_loop(handlers):
                 handlers.writer.append(data_blob, result_blob, handlers.cfg)
 
             handlers.iteration += 1
+
+    # Write the events left in the writer buffer
+    if handlers.writer:
+        handlers.writer.close()
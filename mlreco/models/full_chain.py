@@ -59,6 +59,26 @@ class FullChain(FullChainGNN):
     The configuration blocks for each enabled module should
     also live under the `modules` section of the configuration.
 
+    In inference, ``requested_outputs`` (list of output names) can
+    be set in the ``chain`` section to only return these outputs (and
+    the outputs needed to unwrap them). The label-dependent branches
+    (e.g. label adaptation) are then skipped unless a requested output
+    depends on them, and intermediate outputs are freed as soon as the
+    stages which use them have run.
+
+    Set ``start_stage: gnn`` in the ``chain`` section to skip the
+    CNN stages and start from their products (``UPSTREAM_KEYS``),
+    as stored by a previous run of the chain in an HDF5 file. The CNN
+    feature maps are not stored, so the cosmic discriminator (if enabled)
+    must use the input data. The file is specified in the ``trainval``
+    section:
+
+    ..  code-block:: yaml
+
+          trainval:
+            upstream:
+              file_keys: /path/to/reco.h5
+
     To see an example of full chain configuration, head over to
     https://github.com/DeepLearnPhysics/lartpc_mlreco3d_tutorials/blob/master/book/data/inference.cfg
 
@@ -81,6 +101,9 @@ class FullChain(FullChainGNN):
         'cluster_label_adapted': ['tensor', 'cluster_label_adapted', False, True]
     }
 
+    UPSTREAM_KEYS = ['ghost', 'segmentation', 'ppn_points',
+                     'fragment_clusts', 'fragment_seg']
+
     def __init__(self, cfg):
         super(FullChain, self).__init__(cfg)
 
@@ -188,6 +211,50 @@ class FullChain(FullChainGNN):
                                        use_supp=use_supp)
 
 
+    @property
+    def use_labels(self):
+        '''
+        Whether the labels are needed to produce the requested outputs
+        (adapted cluster labels or truth-based options of the chain).
+        '''
+        return 'cluster_label_adapted' in self.kept_outputs \
+                or self.use_true_fragments \
+                or self._gspice_use_true_labels \
+                or getattr(self, '_inter_use_true_particles', False) \
+                or getattr(self, '_cosmic_use_true_interactions', False)
+
+
+    def rescale_charge(self, input, deghost):
+        '''
+        Rescale the charge of the non-ghost points of the input, in place.
+
+        Parameters
+        ==========
+        input: list
+            List containing the input tensor
+        deghost: torch.Tensor
+            Boolean mask of the points predicted as non-ghosts
+
+        Returns
+        =======
+        result: dict
+            Dictionary of the rescaled non-ghost points (all planes and
+            collection plane only)
+        '''
+        last_index = 4 + self.deghost_input_features
+        charges = compute_rescaled_charge(input[0], deghost, last_index=last_index)
+        charges_coll = compute_rescaled_charge(input[0], deghost, last_index=last_index, collection_only=True)
+        input[0][deghost, VALUE_COL] = charges if not self.collection_charge_only else charges_coll
+
+        input_rescaled = input[0][deghost,:5].clone()
+        input_rescaled[:, VALUE_COL] = charges
+        input_rescaled_coll = input[0][deghost,:5].clone()
+        input_rescaled_coll[:, VALUE_COL] = charges_coll
+
+        return {'input_rescaled': [input_rescaled],
+                'input_rescaled_coll': [input_rescaled_coll]}
+
+
     def full_chain_cnn(self, input):
         '''
         Run the CNN portion of the full chain.
@@ -216,6 +283,10 @@ class FullChain(FullChainGNN):
             input = [input]
             label_clustering = [label_clustering]
 
+        # In inference, only use the labels if an output depends on them
+        if self.pruning and not self.use_labels:
+            label_seg, label_clustering = None, None
+
         # Store batch size for GNN formatting
         batches = torch.unique(input[0][:, self.batch_col])
         assert len(batches) == batches.max().int().item() + 1
@@ -233,17 +304,7 @@ class FullChain(FullChainGNN):
             del result['segmentation']
 
             # Rescale the charge column, store it
-            charges = compute_rescaled_charge(input[0], deghost, last_index=last_index)
-            charges_coll = compute_rescaled_charge(input[0], deghost, last_index=last_index, collection_only=True)
-            input[0][deghost, VALUE_COL] = charges if not self.collection_charge_only else charges_coll
-
-            input_rescaled = input[0][deghost,:5].clone()
-            input_rescaled[:, VALUE_COL] = charges
-            input_rescaled_coll = input[0][deghost,:5].clone()
-            input_rescaled_coll[:, VALUE_COL] = charges_coll
-
-            result.update({'input_rescaled':[input_rescaled]})
-            result.update({'input_rescaled_coll':[input_rescaled_coll]})
+            result.update(self.rescale_charge(input, deghost))
 
         if self.enable_uresnet:
             if not self.enable_charge_rescaling:
@@ -270,6 +331,12 @@ class FullChain(FullChainGNN):
                                       ppn_input['decoderTensors'][0])
             result.update(ppn_output)
 
+        # The UResNet feature maps are only used by PPN, free them
+        if self.pruning:
+            for key in ['finalTensor', 'encoderTensors', 'decoderTensors', 'ghost_sptensor']:
+                if key not in self.kept_outputs:
+                    result.pop(key, None)
+
         # The rest of the chain only needs 1 input feature
         if self.input_features > 1:
             input[0] = input[0][:, :-self.input_features+1]
@@ -413,6 +480,130 @@ class FullChain(FullChainGNN):
         return cnn_result, input
 
 
+    def load_upstream(self, input, upstream):
+        '''
+        Load the products of the CNN portion of the full chain stored by
+        a previous run, instead of running it. The output is formatted
+        as that of `full_chain_cnn`, so that the GNN portion of the chain
+        can start from it.
+
+        The stored products must have been produced from the same input
+        data (e.g. written by the `HDF5Writer` with the same `iotool`
+        configuration), so that they match the input voxel-wise.
+
+        Parameters
+        ==========
+        input: list
+            Input tensors, as for `full_chain_cnn`
+        upstream: dict
+            Dictionary of stored products, each a list with one element
+            per batch entry (`ghost`, `segmentation`, `ppn_points`,
+            `fragment_clusts` and `fragment_seg`)
+
+        Returns
+        =======
+        result: dict
+            dictionary of all loaded CNN outputs.
+        '''
+        device = input[0].device
+
+        label_seg, label_clustering = None, None
+        if len(input) == 3:
+            input, label_seg, label_clustering = input
+            input = [input]
+            label_seg = [label_seg]
+            label_clustering = [label_clustering]
+        elif len(input) == 2:
+            input, label_clustering = input
+            input = [input]
+            label_clustering = [label_clustering]
+
+        # In inference, only use the labels if an output depends on them
+        if self.pruning and not self.use_labels:
+            label_seg, label_clustering = None, None
+
+        # Store batch size for GNN formatting
+        batches = torch.unique(input[0][:, self.batch_col])
+        assert len(batches) == batches.max().int().item() + 1
+        self.batch_size = len(batches)
+        assert len(upstream['fragment_clusts']) == self.batch_size,\
+                'The stored products do not match the batch size'
+
+        def stack(key):
+            return torch.as_tensor(np.concatenate(upstream[key]),
+                                   dtype=input[0].dtype, device=device)
+
+        # Load the deghosting and semantic segmentation predictions
+        result = {'segmentation': [stack('segmentation')]}
+        if self.enable_ghost:
+            result['ghost'] = [stack('ghost')]
+            deghost = result['ghost'][0].argmax(dim=1) == 0
+            assert len(deghost) == len(input[0]),\
+                    'The stored ghost predictions do not match the input'
+            if self.enable_charge_rescaling:
+                result.update(self.rescale_charge(input, deghost))
+
+        if self.enable_ppn and 'ppn_points' in upstream:
+            result['ppn_points'] = [stack('ppn_points')]
+        assert 'ppn_points' in result or not self.use_ppn_in_gnn,\
+                'The GNNs use PPN predictions, which were not stored'
+
+        # The rest of the chain only needs 1 input feature
+        if self.input_features > 1:
+            input[0] = input[0][:, :-self.input_features+1]
+
+        if self.enable_ghost:
+            input = [input[0][deghost]]
+            if label_seg is not None and label_clustering is not None:
+                # ME uses 0 for batch column, so need to compensate
+                label_clustering = adapt_labels(result,
+                                                label_seg,
+                                                label_clustering,
+                                                batch_column=0,
+                                                coords_column_range=(1,4))
+
+        if self._gspice_use_true_labels:
+            semantic_labels = label_seg[0][:, -1]
+        else:
+            semantic_labels = torch.argmax(result['segmentation'][0], dim=1).flatten()
+            if not self.enable_charge_rescaling and self.enable_ghost:
+                semantic_labels = semantic_labels[deghost]
+
+        # Shift the stored fragments (which index each entry) to the batch
+        counts = torch.bincount(input[0][:, self.batch_col].long(),
+                                minlength=self.batch_size).cpu().numpy()
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        fragments, frag_batch_ids, frag_seg = [], [], []
+        for b in range(self.batch_size):
+            for f in upstream['fragment_clusts'][b]:
+                fragments.append(np.asarray(f, dtype=np.int64) + offsets[b])
+                frag_batch_ids.append(b)
+            frag_seg.extend(upstream['fragment_seg'][b])
+
+        # Format Fragments
+        fragments_result = format_fragments(fragments,
+                                            frag_batch_ids,
+                                            frag_seg,
+                                            input[0][:, self.batch_col],
+                                            batch_size=self.batch_size)
+
+        result.update({'frag_dict':fragments_result})
+
+        result.update({
+            'fragment_clusts': fragments_result['fragment_clusts'],
+            'fragment_seg': fragments_result['fragment_seg'],
+            'fragment_batch_ids': fragments_result['fragment_batch_ids']
+        })
+
+        result.update({'segment_label_tmp': [semantic_labels] })
+        if label_clustering is not None:
+            if 'input_rescaled' in result:
+                label_clustering[0][:, VALUE_COL] = input[0][:, VALUE_COL]
+            result.update({'cluster_label_adapted': label_clustering })
+
+        return result, input
+
+
 class FullChainLoss(FullChainLoss):
     """
     Loss function for the full chain.
@@ -8,9 +8,10 @@ from mlreco.models.experimental.transformers.transformer import TransformerEncod
 from mlreco.models.layers.gnn import gnn_model_construct, node_encoder_construct, edge_encoder_construct, node_loss_construct, edge_loss_construct
 
 from mlreco.utils.globals import *
+from mlreco.utils.dbscan import lattice_dbscan
 from mlreco.utils.gnn.data import merge_batch, split_clusts, split_edge_index
 from mlreco.utils.gnn.cluster import form_clusters, get_cluster_batch, get_cluster_label, get_cluster_primary_label, get_cluster_points_label, get_cluster_directions, get_cluster_dedxs
-from mlreco.utils.gnn.network import complete_graph, delaunay_graph, mst_graph, bipartite_graph, inter_cluster_distance, knn_graph, restrict_graph
+from mlreco.utils.gnn.network import complete_graph, delaunay_graph, mst_graph, bipartite_graph, skeleton_graph, inter_cluster_distance, knn_graph, restrict_graph, restrict_edges
 
 class GNN(torch.nn.Module):
     """
@@ -46,9 +47,11 @@ class GNN(torch.nn.Module):
             dir_max_dist    : <maximium distance between start point and cluster voxels to be used to estimate direction: support value or 'optimize' (default 5 voxels)>
             add_local_dedxs : <add reconstructed local dedx(s) to the node features: False (none), True (both) or 'start' (default False)>
             dedx_max_dist   : <maximium distance between start point and cluster voxels to be used to estimate dedx (default 5 voxels)>
-            network         : <type of network: 'complete', 'delaunay', 'mst', 'knn' or 'bipartite' (default 'complete')>
+            network         : <type of network: 'complete', 'delaunay', 'mst', 'knn', 'skeleton' or 'bipartite' (default 'complete')>
+            skeleton_beta   : <lune parameter of the 'skeleton' network, 1 for the Gabriel graph (default 1.)>
             edge_max_dist   : <maximal edge Euclidean length (default -1)>
             edge_dist_method: <edge length evaluation method: 'centroid' or 'voxel' (default 'voxel')>
+            edge_dist_algorithm: <voxel edge length algorithm: 'brute', 'recursive' (approximate) or 'kdtree' (default 'brute')>
             merge_batch     : <flag for whether to merge batches (default False)>
             merge_batch_mode: <mode of batch merging, 'const' or 'fluc'; 'const' use a fixed size of batch for merging, 'fluc' takes the input size a mean and sample based on it (default 'const')>
             merge_batch_size: <size of batch merging (default 2)>
@@ -178,6 +181,7 @@ class GNN(torch.nn.Module):
         self.edge_dist_metric = base_config.get('edge_dist_metric', 'voxel')
         self.edge_dist_algorithm = base_config.get('edge_dist_algorithm', 'brute')
         self.edge_knn_k = base_config.get('edge_knn_k', 5)
+        self.skeleton_beta = base_config.get('skeleton_beta', 1.)
         self.edge_max_count = base_config.get('edge_max_count', 2e6)
 
         # Turn the edge_max_dist value into a matrix
@@ -311,14 +315,17 @@ class GNN(torch.nn.Module):
                                        self.node_min_size,
                                        self.source_col,
                                        cluster_classes=self.node_type)
-                if self.break_clusters:
-                    from sklearn.cluster import DBSCAN
-                    dbscan = DBSCAN(eps=1.1, min_samples=1, metric='chebyshev')
+                if self.break_clusters and len(clusts):
+                    # Break all the clusters in one pass (same as a per-cluster
+                    # DBSCAN with eps=1.1, min_samples=1 and a chebyshev metric)
+                    sizes = [len(c) for c in clusts]
+                    cluster_ids = np.repeat(np.arange(len(clusts)), sizes)
+                    voxels = cluster_data[np.concatenate(clusts), self.coords_index[0]:self.coords_index[1]].detach().cpu().numpy()
+                    labels = lattice_dbscan(voxels, cluster_ids, eps=1.1, min_samples=1, metric='chebyshev')
                     broken_clusts = []
-                    for c in clusts:
-                        labels = dbscan.fit(cluster_data[c, self.coords_index[0]:self.coords_index[1]].detach().cpu().numpy()).labels_
-                        for l in np.unique(labels):
-                            broken_clusts.append(c[labels==l])
+                    for c, l in zip(clusts, np.split(labels, np.cumsum(sizes)[:-1])):
+                        for u in np.unique(l):
+                            broken_clusts.append(c[l==u])
                     clusts = broken_clusts
 
         # If requested, shuffle the order in which the clusters are listed (used for debugging)
@@ -357,16 +364,22 @@ class GNN(torch.nn.Module):
             if np.sum([c*(c-1) for c in cnts]) > 2*self.edge_max_count:
                 return result
 
-        # If necessary, compute the cluster distance matrix
-        dist_mat, closest_index = None, None
-        if np.any(self.edge_max_dist > -1) or self.network == 'mst' or self.network == 'knn':
-            dist_mat, closest_index = inter_cluster_distance(cluster_data[:,self.coords_index[0]:self.coords_index[1]].float(), clusts, batch_ids, self.edge_dist_metric, self.edge_dist_algorithm, return_index=True)
+        # If necessary, compute the cluster distance matrix. If a complete graph is
+        # restricted by edge length, only compute the distances of the edges to keep
+        dist_mat, closest_index, edge_dists = None, None, None
+        restrict = np.any(self.edge_max_dist > -1)
+        voxels = cluster_data[:,self.coords_index[0]:self.coords_index[1]].float()
+        if restrict and self.network == 'complete' and self.edge_dist_algorithm == 'kdtree' and self.edge_dist_metric == 'voxel':
+            complete_index, edge_dists, closest_index = inter_cluster_distance(voxels, clusts, batch_ids, self.edge_dist_metric, self.edge_dist_algorithm, return_index=True, max_dist=np.max(self.edge_max_dist), sparse=True)
+        elif restrict or self.network == 'mst' or self.network == 'knn':
+            max_dist = np.max(self.edge_max_dist) if restrict and self.network not in ['mst', 'knn'] else None
+            dist_mat, closest_index = inter_cluster_distance(voxels, clusts, batch_ids, self.edge_dist_metric, self.edge_dist_algorithm, return_index=True, max_dist=max_dist)
 
         # Form the requested network
         if len(clusts) == 1:
             edge_index = np.empty((2,0), dtype=np.int64)
         elif self.network == 'complete':
-            edge_index = complete_graph(batch_ids)
+            edge_index = complete_graph(batch_ids) if edge_dists is None else complete_index
         elif self.network == 'delaunay':
             import numba as nb
             edge_index = delaunay_graph(cluster_data.cpu().numpy(), nb.typed.List(clusts), batch_ids, self.batch_index, self.coords_index)
@@ -374,6 +387,9 @@ class GNN(torch.nn.Module):
             edge_index = mst_graph(batch_ids, dist_mat)
         elif self.network == 'knn':
             edge_index = knn_graph(batch_ids, self.edge_knn_k, dist_mat)
+        elif self.network == 'skeleton':
+            max_dist = np.max(self.edge_max_dist) if restrict else None
+            edge_index = skeleton_graph(voxels, clusts, batch_ids, self.skeleton_beta, max_dist)
         elif self.network == 'bipartite':
             clust_ids = get_cluster_label(cluster_data, clusts, self.source_col)
             group_ids = get_cluster_label(cluster_data, clusts, self.target_col)
@@ -385,19 +401,25 @@ class GNN(torch.nn.Module):
         if groups is not None:
             mask = groups[edge_index[0]] == groups[edge_index[1]]
             edge_index = edge_index[:,mask]
+            if edge_dists is not None:
+                edge_dists, closest_index = edge_dists[mask], closest_index[mask]
 
         # Restrict the input graph based on edge distance, if requested
-        if np.any(self.edge_max_dist > -1):
-            if self.edge_max_dist.shape[0] == 1:
-                edge_index = restrict_graph(edge_index, dist_mat, self.edge_max_dist)
-            else:
+        if restrict:
+            classes = None
+            if self.edge_max_dist.shape[0] > 1:
                 # Here get_cluster_primary_label is used to ensure that Michel/Delta showers are given the appropriate semantic label
                 if self.source_col == 5: classes = extra_feats[:,-1].cpu().numpy().astype(int) if extra_feats is not None else get_cluster_label(cluster_data, clusts, -1).astype(int)
                 if self.source_col == 6: classes = extra_feats[:,-1].cpu().numpy().astype(int) if extra_feats is not None else get_cluster_primary_label(cluster_data, clusts, -1).astype(int)
+
+            if edge_dists is None:
                 edge_index = restrict_graph(edge_index, dist_mat, self.edge_max_dist, classes)
 
-            # Get index of closest pair of voxels for each pair of clusters
-            closest_index = closest_index[edge_index[0], edge_index[1]]
+                # Get index of closest pair of voxels for each pair of clusters
+                closest_index = closest_index[edge_index[0], edge_index[1]]
+            else:
+                mask = restrict_edges(edge_index, edge_dists.astype(np.float64), self.edge_max_dist, classes)
+                edge_index, closest_index = edge_index[:,mask], closest_index[mask]
 
         # Update result with a list of edges for each batch id
         edge_index_split, ebids = split_edge_index(edge_index, batch_ids, batches)
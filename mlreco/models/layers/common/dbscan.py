@@ -1,14 +1,14 @@
 import torch
 import numpy as np
-import sklearn
 from larcv import larcv
+from mlreco.utils.dbscan import lattice_dbscan
 from mlreco.utils.track_clustering import track_clustering
 
 
 class DBSCANFragmenter(torch.nn.Module):
     """
-    DBSCAN Layer that uses sklearn's DBSCAN implementation
-    to fragment each of the particle classes into dense instances.
+    DBSCAN Layer that uses a lattice DBSCAN implementation (identical
+    to sklearn's) to fragment each of the particle classes into dense instances.
     Runs DBSCAN on each requested class separately, in one of three ways:
     - Run pure DBSCAN on all the voxels in that class
     - Runs DBSCAN on PPN point-masked voxels, associates leftovers based on proximity
@@ -66,11 +66,27 @@ class DBSCANFragmenter(torch.nn.Module):
 
 
     def get_clusts(self, data, bids, segmentation, break_points=None):
+        # Run DBSCAN on all the (batch, class) partitions which are not broken
+        # up at once, one call per set of DBSCAN parameters
+        dbscan_labels = np.full(len(data), -1, dtype=np.int64)
+        batch_ids = data[:, self.batch_col]
+        classes = [k for k, s in enumerate(self.cluster_classes) if s not in self.break_classes]
+        for params in set([(self.eps[k], self.min_samples[k]) for k in classes]):
+            mask = np.isin(segmentation, [self.cluster_classes[k] for k in classes \
+                    if (self.eps[k], self.min_samples[k]) == params])
+            mask &= np.isin(batch_ids, bids)
+            index = np.where(mask)[0]
+            if len(index):
+                groups = np.stack([batch_ids[index], segmentation[index]], axis=1)
+                groups = np.unique(groups, axis=0, return_inverse=True)[-1]
+                dbscan_labels[index] = lattice_dbscan(data[index, self.coords_col[0]:self.coords_col[1]],
+                                                      groups, eps=params[0], min_samples=params[1], metric=self.metric)
+
         # Loop over batch and semantic classes
         clusts = []
         for bid in bids:
             # Batch mask
-            batch_mask = data[:, self.batch_col] == bid
+            batch_mask = batch_ids == bid
             for k, s in enumerate(self.cluster_classes):
                 # Batch and segmentation mask
                 mask = batch_mask & (segmentation == s)
@@ -81,8 +97,8 @@ class DBSCANFragmenter(torch.nn.Module):
                     continue
 
                 # Restrict voxel set, run clustering
-                voxels = data[selection, self.coords_col[0]:self.coords_col[1]]
                 if s in self.break_classes:
+                    voxels = data[selection, self.coords_col[0]:self.coords_col[1]]
                     assert break_points is not None
                     points_mask = break_points[:, self.batch_col] == bid
                     breaking_method = self.track_clustering_method if s==larcv.kShapeTrack else 'masked_dbscan'
@@ -94,9 +110,7 @@ class DBSCANFragmenter(torch.nn.Module):
                                               metric      = self.metric,
                                               mask_radius = self.ppn_mask_radius)
                 else:
-                    labels = sklearn.cluster.DBSCAN(eps=self.eps[k],
-                                                    min_samples=self.min_samples[k],
-                                                    metric=self.metric).fit(voxels).labels_
+                    labels = dbscan_labels[selection]
 
                 # Build clusters for this class
                 if self.track_include_delta and s == larcv.kShapeTrack and s in self.break_classes:
@@ -2,7 +2,7 @@ import torch
 import numpy as np
 
 from mlreco.models.grappa import GNN, GNNLoss
-from mlreco.utils.unwrap import prefix_unwrapper_rules
+from mlreco.utils.unwrap import prefix_unwrapper_rules, select_unwrapper_rules
 from mlreco.utils.deghosting import adapt_labels_knn as adapt_labels
 from mlreco.utils.gnn.evaluation import (node_assignment_score,
                                          primary_assignment)
@@ -24,6 +24,10 @@ class FullChainGNN(torch.nn.Module):
                'fragment_clustering',  'chain', 'dbscan',
                ('uresnet_ppn', ['uresnet_lonely', 'ppn'])]
 
+    # Outputs of the CNN stages consumed by the GNN stages
+    GNN_INPUTS = ['frag_dict', 'segment_label_tmp', 'cluster_label_adapted',
+                  'ppn_points', 'ppn_feature_dec', 'ppn_layers']
+
     def __init__(self, cfg):
         super(FullChainGNN, self).__init__()
 
@@ -76,6 +80,43 @@ class FullChainGNN(torch.nn.Module):
             self.RETURNS.update(prefix_unwrapper_rules(self.grappa_kinematics.RETURNS, 'kinematics'))
             self.RETURNS['kinematics_clusts'][1][0] = 'input_data' if not self.enable_ghost else 'input_rescaled'
 
+    @property
+    def kept_outputs(self):
+        """
+        Set of outputs kept when `requested_outputs` is specified: the
+        requested outputs and the outputs needed to unwrap them.
+        """
+        if self._kept_outputs is None:
+            rules = select_unwrapper_rules(self.RETURNS, self.requested_outputs)
+            self._kept_outputs = set(self.requested_outputs) | set(rules.keys())
+        return self._kept_outputs
+
+    @property
+    def pruning(self):
+        """
+        Whether the outputs which are not requested are dropped (in
+        inference only, as the loss needs all of them in training).
+        """
+        return self.requested_outputs is not None and not self.training
+
+    def prune(self, result, keep=[]):
+        """
+        Frees the outputs which are neither requested nor used by
+        the stages of the chain which are left to run.
+
+        Parameters
+        ==========
+        result: dict
+            Dictionary of outputs (modified in place)
+        keep: list, optional
+            Outputs used by the stages left to run
+        """
+        if not self.pruning:
+            return
+        for key in list(result.keys()):
+            if key not in self.kept_outputs and key not in keep:
+                del result[key]
+
     def run_gnn(self, grappa, input, result, clusts, prefix, kwargs={}):
         """
         Generic function to group in one place the common code to run a GNN model.
@@ -490,15 +531,16 @@ class FullChainGNN(torch.nn.Module):
 
             # Replace batch id column with a global "interaction id"
             # because ResidualEncoder uses the batch id column to shape its output
-            if 'ppn_feature_dec' in result:
-                feature_map = result['ppn_feature_dec'][0][-1]
+            if self._cosmic_use_input_data:
+                inter_input_data = input[0].float()
             else:
-                feature_map = result['ppn_layers'][0][-1]
-            if not torch.is_tensor(feature_map):
-                feature_map = feature_map.features
-
-            inter_input_data = input[0].float() if self._cosmic_use_input_data \
-                                                else torch.cat([input[0][:, :4].float(), feature_map], dim=1)
+                if 'ppn_feature_dec' in result:
+                    feature_map = result['ppn_feature_dec'][0][-1]
+                else:
+                    feature_map = result['ppn_layers'][0][-1]
+                if not torch.is_tensor(feature_map):
+                    feature_map = feature_map.features
+                inter_input_data = torch.cat([input[0][:, :4].float(), feature_map], dim=1)
 
             inter_data = torch.empty((0, inter_input_data.size(1)), dtype=torch.float, device=device)
             for i, interaction in enumerate(interactions):
@@ -542,7 +584,7 @@ class FullChainGNN(torch.nn.Module):
         return result
 
 
-    def forward(self, input):
+    def forward(self, input, upstream=None):
         """
         Input can be either of the following:
         - input data only
@@ -554,13 +596,22 @@ class FullChainGNN(torch.nn.Module):
         Parameters
         ==========
         input: list of np.ndarray
+        upstream: dict, optional
+            Products of the CNN stages stored by a previous run, one list
+            element per batch entry. Required if `start_stage` is `gnn`.
         """
 
-        result, input = self.full_chain_cnn(input)
+        if self.start_stage == 'gnn':
+            assert upstream is not None, 'Must provide the stored upstream products to start at the GNN stage'
+            result, input = self.load_upstream(input, upstream)
+        else:
+            result, input = self.full_chain_cnn(input)
+        self.prune(result, self.GNN_INPUTS)
         if len(input[0]) and 'frag_dict' in result and self.process_fragments and (self.enable_gnn_track or self.enable_gnn_shower or self.enable_gnn_inter or self.enable_gnn_particle):
             result = self.full_chain_gnn(result, input)
         if 'frag_dict' in result:
             del result['frag_dict']
+        self.prune(result)
 
         return result
 
@@ -910,6 +961,11 @@ def setup_chain_cfg(self, cfg, print_info=True):
     self.coords_col            = (1, 4) if self.use_me else (0, 3)
     self.batch_size            = None # To be set at forward time
 
+    self.requested_outputs     = chain_cfg.get('requested_outputs', None)
+    self._kept_outputs         = None
+    self.start_stage           = chain_cfg.get('start_stage', 'cnn')
+    assert self.start_stage in ['cnn', 'gnn'], f'Stage {self.start_stage} not recognized (must be cnn or gnn)'
+
     self.process_fragments     = chain_cfg.get('process_fragments', False)
     self.use_true_fragments    = chain_cfg.get('use_true_fragments', False)
     self.use_true_particles    = chain_cfg.get('use_true_particles', False)
@@ -932,6 +988,11 @@ def setup_chain_cfg(self, cfg, print_info=True):
     self.enable_gnn_kinematics = chain_cfg.get('enable_gnn_kinematics', False)
     self.enable_cosmic         = chain_cfg.get('enable_cosmic', False)
 
+    # The CNN feature maps are not stored, the cosmic discriminator must use the input data
+    if self.start_stage == 'gnn' and self.enable_cosmic:
+        assert cfg.get('cosmic_discriminator', {}).get('use_input_data', True),\
+                'Cannot start at the gnn stage if the cosmic discriminator uses the CNN feature maps'
+
     if self.verbose and print_info:
         print("Shower GNN: {}".format(self.enable_gnn_shower))
         print("Track GNN: {}".format(self.enable_gnn_track))
@@ -1,7 +1,7 @@
 # Geometric feature extractor for Cluster GNN
 import torch
 import numpy as np
-from torch_scatter import scatter_min
+from torch_scatter import scatter, scatter_min
 
 from mlreco.utils import local_cdist
 from mlreco.utils.gnn.data import cluster_features, cluster_edge_features
@@ -48,63 +48,71 @@ class ClustGeoNodeEncoder(torch.nn.Module):
         values    = data[:, 4].float()
         sem_types = data[:, -1].float()
 
-        # Below is a torch-based implementation of cluster_features
-        feats = []
-        for c in clusts:
-
-            # Get list of voxels in the cluster
-            x = voxels[c]
-            size = torch.tensor([len(c)], dtype=voxels.dtype, device=voxels.device)
-
-            # Do not waste time with computations with size 1 clusters, default to zeros
-            if len(c) < 2:
-                if not self.more_feats:
-                    feats.append(torch.cat((x.flatten(), torch.zeros(12, dtype=voxels.dtype, device=voxels.device), size)))
-                else:
-                    extra_feats = torch.tensor([values[c[0]], 0., sem_types[c[0]]], dtype=voxels.dtype, device=voxels.device)
-                    feats.append(torch.cat((x.flatten(), torch.zeros(12, dtype=voxels.dtype, device=voxels.device), size, extra_feats)))
-                continue
-
-            # Center data
-            center = x.mean(dim=0)
-            x = x - center
-
-            # Get orientation matrix
-            A = x.t().mm(x)
-
-            # Get eigenvectors, normalize orientation matrix and eigenvalues to largest
-            # This step assumes points are not superimposed, i.e. that largest eigenvalue != 0
-            #w, v = torch.symeig(A, eigenvectors=True)
-            w, v = torch.linalg.eigh(A, UPLO='U')
-            dirwt = 1.0 - w[1] / w[2]
-            B = A / w[2]
-
-            # Get the principal direction, identify the direction of the spread
-            v0 = v[:,2]
-
-            # Projection all points, x, along the principal axis
-            x0 = x.mv(v0)
-
-            # Evaluate the distance from the points to the principal axis
-            xp0 = x - torch.ger(x0, v0)
-            np0 = torch.norm(xp0, dim=1)
-
-            # Flip the principal direction if it is not pointing towards the maximum spread
-            sc = torch.dot(x0, np0)
-            if sc < 0:
-                v0 = -v0
-
-            # Weight direction
-            v0 = dirwt * v0
-
-            # Append (center, B.flatten(), v0, size)
-            if not self.more_feats:
-                feats.append(torch.cat((center, B.flatten(), v0, size)))
-            else:
-                extra_feats = torch.tensor([values[c].mean(), values[c].std(), sem_types[c].mode()[0]], dtype=voxels.dtype, device=voxels.device)
-                feats.append(torch.cat((center, B.flatten(), v0, size, extra_feats)))
-
-        return torch.stack(feats, dim=0)
+        # Below is a batched torch-based implementation of cluster_features:
+        # every voxel of every cluster is processed at once, indexed by the
+        # segment (cluster) it belongs to
+        num_feats = 19 if self.more_feats else 16
+        if not len(clusts):
+            return torch.empty((0, num_feats), dtype=voxels.dtype, device=voxels.device)
+        device = voxels.device
+        index = torch.cat([torch.as_tensor(c, dtype=torch.long, device=device) for c in clusts])
+        counts = torch.tensor([len(c) for c in clusts], dtype=torch.long, device=device)
+        segment = torch.repeat_interleave(torch.arange(len(clusts), device=device), counts)
+        sizes = counts.to(voxels.dtype)
+        single = counts < 2
+
+        # Center data
+        x = voxels[index]
+        center = scatter(x, segment, dim=0, dim_size=len(clusts), reduce='sum') / sizes[:,None]
+        x = x - center[segment]
+
+        # Get orientation matrices. Size 1 clusters default to zeros: give them
+        # an identity orientation matrix to keep the eigendecomposition finite
+        A = scatter(x[:,:,None] * x[:,None,:], segment, dim=0, dim_size=len(clusts), reduce='sum')
+        A[single] = torch.eye(3, dtype=A.dtype, device=device)
+
+        # Get eigenvectors, normalize orientation matrices and eigenvalues to largest
+        # This step assumes points are not superimposed, i.e. that largest eigenvalue != 0
+        w, v = torch.linalg.eigh(A, UPLO='U')
+        dirwt = 1.0 - w[:,1] / w[:,2]
+        B = A / w[:,2,None,None]
+
+        # Get the principal directions, identify the direction of the spread
+        v0 = v[:,:,2]
+
+        # Projection all points, x, along the principal axis of their cluster
+        x0 = torch.sum(x * v0[segment], dim=1)
+
+        # Evaluate the distance from the points to the principal axis
+        xp0 = x - x0[:,None] * v0[segment]
+        np0 = torch.norm(xp0, dim=1)
+
+        # Flip the principal direction if it is not pointing towards the maximum spread
+        sc = scatter(x0 * np0, segment, dim=0, dim_size=len(clusts), reduce='sum')
+        v0 = torch.where((sc < 0)[:,None], -v0, v0)
+
+        # Weight direction
+        v0 = dirwt[:,None] * v0
+
+        # Size 1 clusters only have a center and a size
+        B = torch.where(single[:,None], torch.zeros_like(B.flatten(1)), B.flatten(1))
+        v0 = torch.where(single[:,None], torch.zeros_like(v0), v0)
+        feats = torch.cat((center, B, v0, sizes[:,None]), dim=1)
+        if not self.more_feats:
+            return feats
+
+        # Add the mean energy, the RMS energy (0 for size 1 clusters) and the most represented type
+        vals = values[index]
+        mean = scatter(vals, segment, dim=0, dim_size=len(clusts), reduce='sum') / sizes
+        var = scatter((vals - mean[segment])**2, segment, dim=0, dim_size=len(clusts), reduce='sum')
+        std = torch.where(single, torch.zeros_like(var), torch.sqrt(var / (sizes - 1).clamp(min=1)))
+        types = sem_types[index].long()
+        num_types = int(types.max()) + 1
+        type_counts = torch.zeros((len(clusts), num_types), dtype=torch.long, device=device)
+        type_counts.index_put_((segment, types), torch.ones_like(types), accumulate=True)
+        mode = torch.argmax(type_counts, dim=1).to(voxels.dtype)
+
+        return torch.cat((feats, mean[:,None], std[:,None], mode[:,None]), dim=1)
 
 
 class ClustGeoEdgeEncoder(torch.nn.Module):
@@ -1,4 +1,5 @@
-import os, re, glob, warnings
+import os, re, glob, time, warnings
+import numpy as np
 import torch
 from collections import defaultdict
 
@@ -11,7 +12,7 @@ from .models.experimental.bayes.calibration import calibrator_construct, calibra
 from .utils import to_numpy
 from .utils.stopwatch import Stopwatch
 from .utils.adabound import AdaBound, AdaBoundW
-from .utils.unwrap import Unwrapper
+from .utils.unwrap import Unwrapper, select_unwrapper_rules
 
 
 class trainval(object):
@@ -73,6 +74,15 @@ class trainval(object):
         else:
             self._lr_scheduler = None
 
+        # Asynchronous batch prefetching
+        self._prefetch_depth = self._trainval_config.get('prefetch', 0)
+        self._prefetcher = None
+        self._io_hidden = 0.
+
+        # Products of the upstream stages stored by a previous run
+        self._upstream_config = self._trainval_config.get('upstream', None)
+        self._upstream = None
+
         self._loss = []
 
     def backward(self):
@@ -161,9 +171,9 @@ class trainval(object):
                     target = data_blob[key][gpu]
                     if isinstance(target,list):
                         #data = [[torch.as_tensor(d).cuda() if len(self._gpus) else torch.as_tensor(d) for d in scale] for scale in data_blob[key][gpu]]
-                        data = [torch.as_tensor(scale, dtype=torch.float).cuda() if len(self._gpus) else torch.as_tensor(scale, torch.float) for scale in target]
+                        data = [self._to_tensor(scale) for scale in target]
                     else:
-                        data = torch.as_tensor(target, dtype=torch.float).cuda() if len(self._gpus) else torch.as_tensor(target, dtype=torch.float)
+                        data = self._to_tensor(target)
                     if key in self._input_keys:
                         train_data.append(data)
                     if key in self._loss_keys:
@@ -173,6 +183,20 @@ class trainval(object):
         return train_blob, loss_blob
 
 
+    def _to_tensor(self, data):
+        """
+        Wraps an array as a float tensor on the training device. On CPU,
+        float32 arrays (e.g. batches placed in shared memory by the
+        `SharedMemoryTransport`) are wrapped without any copy.
+        """
+        if isinstance(data, np.ndarray) and data.dtype == np.float32:
+            tensor = torch.from_numpy(data)
+        else:
+            tensor = torch.as_tensor(data, dtype=torch.float)
+
+        return tensor.cuda() if len(self._gpus) else tensor
+
+
     def train_step(self, data_iter, iteration=None, log_time=True):
         """
         data_blob is the output of the function get_data_minibatched.
@@ -193,6 +217,82 @@ class trainval(object):
         return data_blob,res_combined
 
 
+    def make_unwrapper(self):
+        """
+        Builds the unwrapper of the input data and the network outputs.
+        """
+        rules = input_unwrap_rules(self._iotool_config['dataset']['schema'])
+        if getattr(self._net.module, 'pruning', False):
+            rules.update(select_unwrapper_rules(self._net.module.RETURNS, self._net.module.requested_outputs))
+        elif hasattr(self._net.module, 'RETURNS'): rules.update(self._net.module.RETURNS)
+        if hasattr(self._criterion, 'RETURNS'): rules.update(self._criterion.RETURNS)
+        return Unwrapper(max(1, len(self._gpus)), self._batch_size, rules, self._boundaries, remove_batch_col=False) # TODO: make True
+
+
+    def prepare_batch(self, data_iter, unwrapper=None):
+        """
+        Fetches the next compute cycle worth of data and converts it to
+        network inputs. If an unwrapper is provided, also builds the batch
+        masks of the input data ahead of time.
+        """
+        input_data = self.get_data_minibatched(data_iter)
+        input_train, input_loss = self.make_input_forward(input_data)
+        metadata = unwrapper.prepare(input_data) if unwrapper is not None else None
+        return input_data, input_train, input_loss, metadata
+
+
+    def _prefetch_batch(self, data_iter):
+        """
+        Prepares a batch in the prefetching thread. On GPU, the host to
+        device copies run on a side stream, which is synchronized before
+        the batch is handed over to the main thread.
+        """
+        if self._prefetch_stream is None:
+            return self.prepare_batch(data_iter, self._prefetch_unwrapper)
+
+        with torch.cuda.stream(self._prefetch_stream):
+            batch = self.prepare_batch(data_iter, self._prefetch_unwrapper)
+        self._prefetch_stream.synchronize()
+        return batch
+
+
+    def _record_stream(self, blob):
+        """
+        Marks the tensors prepared on the prefetching stream as used by
+        the current stream, so that their memory is not reused too early.
+        """
+        if isinstance(blob, (list, tuple)):
+            for b in blob:
+                self._record_stream(b)
+        elif isinstance(blob, torch.Tensor) and blob.is_cuda:
+            blob.record_stream(torch.cuda.current_stream())
+
+
+    def next_batch(self, data_iter, unwrapper=None):
+        """
+        Returns the next prepared batch. If `trainval.prefetch` is set to
+        a positive depth, the batches are prepared in a background thread
+        while the previous ones are processed and the I/O time which was
+        hidden behind the processing is recorded as `io_hidden`.
+        """
+        if self._prefetch_depth < 1:
+            return self.prepare_batch(data_iter, unwrapper)
+
+        if self._prefetcher is None:
+            from .iotools.prefetch import BatchPrefetcher
+            self._prefetch_unwrapper = self.make_unwrapper() if unwrapper is not None else None
+            self._prefetch_stream = torch.cuda.Stream() if len(self._gpus) else None
+            self._prefetcher = BatchPrefetcher(self._prefetch_batch, self._prefetch_depth)
+
+        start = time.time()
+        batch, duration = self._prefetcher.get(data_iter)
+        self._io_hidden += max(0., duration - (time.time() - start))
+        if self._prefetch_stream is not None:
+            self._record_stream(batch[1:3])
+
+        return batch
+
+
     def forward(self, data_iter, iteration=None):
         """
         Run forward flags.BATCH_SIZE / (flags.MINIBATCH_SIZE * len(flags.GPUS)) times
@@ -203,44 +303,77 @@ class trainval(object):
 
         # Initialize unwrapper (TODO: Move to __init__)
         unwrap = self._trainval_config.get('unwrap', False) or bool(self._trainval_config.get('unwrapper', None))
-        if unwrap:
-            rules = input_unwrap_rules(self._iotool_config['dataset']['schema'])
-            if hasattr(self._net.module, 'RETURNS'): rules.update(self._net.module.RETURNS)
-            if hasattr(self._criterion, 'RETURNS'): rules.update(self._criterion.RETURNS)
-            unwrapper = Unwrapper(max(1, len(self._gpus)), self._batch_size, rules, self._boundaries, remove_batch_col=False) # TODO: make True
+        unwrapper = self.make_unwrapper() if unwrap else None
 
         # If batch_size > mini_batch_size * n_gpus, run forward more than once per iteration
         data_combined, res_combined  = defaultdict(list), defaultdict(list)
         num_forward = int(self._batch_size / (self._minibatch_size * max(1,len(self._gpus))))
+        self._io_hidden = 0.
         for idx in range(num_forward):
             # Get the batched data
             self._watch.start('io')
-            input_data = self.get_data_minibatched(data_iter)
-            input_train, input_loss = self.make_input_forward(input_data)
+            input_data, input_train, input_loss, metadata = self.next_batch(data_iter, unwrapper)
             self._watch.stop('io')
             self.tspent_sum['io'] += self._watch.time('io')
 
+            # Load the stored upstream products of the batch, if requested
+            upstream = self.get_upstream(input_data) if self._upstream is not None else None
+
             # Run forward
-            res = self._forward(input_train, input_loss, iteration=iteration)
+            res = self._forward(input_train, input_loss, iteration=iteration, upstream=upstream)
 
             # Unwrap output, if requested
             if unwrap:
-                input_data, res = unwrapper(input_data, res)
+                input_data, res = unwrapper(input_data, res, metadata)
             else:
                 if 'index' in input_data:
                     input_data['index'] = input_data['index'][0]
 
+            # With a single forward, keep the lazily unwrapped dictionaries as is
+            if unwrap and num_forward == 1:
+                data_combined, res_combined = input_data, res
+                break
+
             # Append results to the existing list
             for key in input_data.keys():
                 data_combined[key].extend(input_data[key])
             for key in res.keys():
                 res_combined[key].extend(res[key])
 
+        # Record the I/O time hidden behind the processing of the previous batches
+        self._watch.record('io_hidden', self._io_hidden)
+        self.tspent_sum['io_hidden'] += self._io_hidden
+
         self._watch.stop('forward')
+        if unwrap and num_forward == 1:
+            return data_combined, res_combined
         return dict(data_combined), dict(res_combined)
 
 
-    def _forward(self, train_blob, loss_blob, iteration=None):
+    def get_upstream(self, data_blob):
+        """
+        Reads the upstream products stored for the events of a batch.
+
+        Parameters
+        ----------
+        data_blob : dict
+            Batch data, which must contain the `index` of each event
+
+        Returns
+        -------
+        dict
+            Dictionary of stored products, each a list with one element per event
+        """
+        from .iotools.collates import CollateHDF5
+        assert 'index' in data_blob, 'Need the event index to load the stored upstream products'
+        entries = self._upstream.find_entries(data_blob['index'][0])
+        blobs = self._upstream.get_many(entries)
+        if self._upstream.split_groups:
+            return CollateHDF5([result for _, result in blobs])
+        return CollateHDF5(blobs)
+
+
+    def _forward(self, train_blob, loss_blob, iteration=None, upstream=None):
         """
         data/label/weight are lists of size minibatch size.
         For sparse uresnet:
@@ -270,14 +403,18 @@ class trainval(object):
             if not len(self._gpus):
                 train_blob = train_blob[0]
             #print(not self._net.device_ids)
-            result = self._net(train_blob)
+            if upstream is None:
+                result = self._net(train_blob)
+            else:
+                # The stored products are not scattered, run on a single device
+                result = self._model(train_blob if not len(self._gpus) else train_blob[0], upstream=upstream)
 
             if not len(self._gpus):
                 train_blob = [train_blob]
 
-            # Compute the loss
+            # Compute the loss (not if the model only returned the requested outputs)
             loss_acc = {}
-            if len(self._loss_keys):
+            if len(self._loss_keys) and not getattr(self._model, 'pruning', False):
                 if self._time_dependent:
                     loss_acc = self._criterion(result, *tuple(loss_blob), iteration=iteration)
                 else:
@@ -481,11 +618,18 @@ class trainval(object):
         self._criterion = criterion(module_config).cuda() if len(self._gpus) else criterion(module_config)
 
         self.tspent_sum['forward'] = self.tspent_sum['train'] = self.tspent_sum['io'] = self.tspent_sum['save'] = 0.
+        self.tspent_sum['io_hidden'] = 0.
 
         self._model = model(module_config)
 
         self._net = DataParallel(self._model, device_ids=self._gpus)
 
+        if self._upstream_config is not None:
+            from .iotools.readers import HDF5Reader
+            assert len(self._gpus) < 2, 'Cannot load stored upstream products with several GPUs'
+            keys = getattr(self._model, 'UPSTREAM_KEYS', None)
+            self._upstream = HDF5Reader(keys=keys, **self._upstream_config)
+
         if self._train:
             self._net.train().cuda() if len(self._gpus) else self._net.train().cpu()
         else:
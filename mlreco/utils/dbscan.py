@@ -1,4 +1,5 @@
 import numpy as np
+import numba as nb
 from sklearn.cluster import DBSCAN
 
 def dbscan_points(voxels, epsilon = 1.01, minpts = 3):
@@ -9,11 +10,8 @@ def dbscan_points(voxels, epsilon = 1.01, minpts = 3):
         minpts  : (optional) DBSACN min pts (default = 1)
     """
     index = np.arange(len(voxels))
-    res=DBSCAN(eps=epsilon,
-               min_samples=minpts,
-               metric='euclidean'
-              ).fit(voxels)
-    clusters = [ index[np.where(res.labels_ == i)[0]].astype(np.int64) for i in range(np.max(res.labels_)+1) ]
+    labels = lattice_dbscan(voxels, eps=epsilon, min_samples=minpts, metric='euclidean')
+    clusters = [ index[np.where(labels == i)[0]].astype(np.int64) for i in range(np.max(labels, initial=-1)+1) ]
     same_length = np.all([len(c) == len(clusters[0]) for c in clusters] )
     return np.array(clusters, dtype=object if not same_length else np.int64)
 
@@ -28,21 +26,15 @@ def dbscan_types(voxels, types, epsilon = 1.01, minpts = 3, typemin=2, typemax=5
         typemin : (optional) minimum type value (default = 2 for only EM)
         typemax : (optional) maximum type value (default = 5)
     """
-    clusts = []
+    # perform DBSCAN on all classes at once
+    selection = np.where((types >= typemin) & (types < typemax))[0]
+    labels = lattice_dbscan(voxels[selection], types[selection], eps=epsilon, min_samples=minpts, metric='euclidean')
+
     # loop over classes
+    clusts = []
     for c in range(typemin, typemax):
-        cinds = types == c
-        selection = np.where(cinds == 1)[0]
-        if len(selection) == 0:
-            continue
-        # perform DBSCAN
-        sel_vox = voxels[selection]
-
-        res=DBSCAN(eps=epsilon,
-                   min_samples=minpts,
-                   metric='euclidean'
-                  ).fit(sel_vox)
-        cls_idx = [ selection[np.where(res.labels_ == i)[0]] for i in range(np.max(res.labels_)+1) ]
+        cinds = types[selection] == c
+        cls_idx = [ selection[np.where(cinds & (labels == i))[0]] for i in range(np.max(labels[cinds], initial=-1)+1) ]
         clusts.extend(cls_idx)
     return np.array(clusts)
 
@@ -58,22 +50,271 @@ def dbscan_groups(voxels, groups, types, epsilon = 1.01, minpts = 3, typemin=2,
         typemin : (optional) minimum type value (default = 2 for only EM)
         typemax : (optional) maximum type value (default = 5)
     """
+    # perform DBSCAN on all groups at once
+    valid = np.where((np.asarray(types) >= typemin) & (np.asarray(types) <= typemax))[0]
+    selection = np.where(np.isin(groups, valid))[0]
+    labels = lattice_dbscan(voxels[selection], groups[selection], eps=epsilon, min_samples=minpts, metric='euclidean')
+
+    # loop over groups
     clusts = []
-    # loop over classes
-    for c in range(len(types)):
-        if types[c] < typemin or types[c] > typemax:
-            continue
-        cinds = groups == c
-        selection = np.where(cinds == 1)[0]
-        if len(selection) == 0:
-            continue
-        # perform DBSCAN
-        sel_vox = voxels[selection]
-
-        res=DBSCAN(eps=epsilon,
-                   min_samples=minpts,
-                   metric='euclidean'
-                  ).fit(sel_vox)
-        cls_idx = [ selection[np.where(res.labels_ == i)[0]] for i in range(np.max(res.labels_)+1) ]
+    for c in valid:
+        cinds = groups[selection] == c
+        cls_idx = [ selection[np.where(cinds & (labels == i))[0]] for i in range(np.max(labels[cinds], initial=-1)+1) ]
         clusts.extend(cls_idx)
     return np.array(clusts)
+
+
+LATTICE_METRICS = {'euclidean': 2, 'l2': 2, 'manhattan': 1, 'cityblock': 1, 'l1': 1, 'chebyshev': np.inf}
+
+
+def lattice_dbscan(voxels, groups=None, eps=1.999, min_samples=1, metric='euclidean'):
+    """
+    Runs DBSCAN separately on each group of voxels (e.g. each
+    (batch ID, semantic class) pair) in a single call.
+
+    If the voxels sit on an integer lattice and the metric is supported
+    (see `LATTICE_METRICS`), voxels are hashed into the lattice and their
+    neighborhoods are found by probing the fixed stencil of lattice
+    offsets within eps. Core points are merged with a union-find and
+    border points are attached to the first cluster that reaches them,
+    so that the labels are identical to those of sklearn's DBSCAN run
+    on each group. Otherwise, falls back to sklearn.
+
+    input:
+        voxels      : (N,D) array of voxel coordinates
+        groups      : (optional) (N,) vector of group ids (default = single group)
+        eps         : (optional) DBSCAN radius (default = 1.999)
+        min_samples : (optional) DBSCAN min pts (default = 1)
+        metric      : (optional) distance metric (default = 'euclidean')
+    output:
+        (N,) vector of cluster labels, numbered from 0 within each group (-1 for noise)
+    """
+    voxels = np.asarray(voxels)
+    if groups is None:
+        groups = np.zeros(len(voxels), dtype=np.int64)
+    if not len(voxels):
+        return np.empty(0, dtype=np.int64)
+
+    # If the voxels are not on a lattice, run sklearn on each group
+    groups = np.unique(np.asarray(groups), return_inverse=True)[-1].astype(np.int64).reshape(-1)
+    if metric not in LATTICE_METRICS or not np.all(voxels == np.round(voxels)):
+        labels = np.empty(len(voxels), dtype=np.int64)
+        for g in range(groups.max()+1):
+            index = np.where(groups == g)[0]
+            labels[index] = DBSCAN(eps=eps, min_samples=min_samples, metric=metric).fit(voxels[index]).labels_
+        return labels
+
+    coords, keys, strides = _lattice_keys(voxels, groups)
+    stencil = _lattice_stencil(voxels.shape[1], eps, LATTICE_METRICS[metric])
+
+    return _lattice_dbscan(coords, keys, strides, groups, stencil, int(min_samples))[0]
+
+
+def lattice_components(voxels, groups=None, radius=1):
+    """
+    Single-pass equivalent of running DBSCAN(eps, min_samples=1,
+    metric='chebyshev') separately on each group of voxels, for any
+    eps in [radius, radius+1) on an integer lattice.
+
+    Components are labeled globally, in order of first appearance of
+    their voxels. For each group, this is the order of the DBSCAN labels
+    offset by the number of components in the preceding groups (provided
+    the groups are contiguous and ordered).
+
+    input:
+        voxels : (N,D) array of integer voxel coordinates
+        groups : (optional) (N,) vector of group ids (default = single group)
+        radius : (optional) Chebyshev connection radius (default = 1)
+    output:
+        (N,) vector of component labels
+    """
+    voxels = np.asarray(voxels)
+    if groups is None:
+        groups = np.zeros(len(voxels), dtype=np.int64)
+    if not len(voxels):
+        return np.empty(0, dtype=np.int64)
+
+    groups = np.unique(np.asarray(groups), return_inverse=True)[-1].astype(np.int64).reshape(-1)
+    coords, keys, strides = _lattice_keys(voxels, groups)
+    stencil = _lattice_stencil(voxels.shape[1], radius, np.inf)
+
+    return _lattice_dbscan(coords, keys, strides, groups, stencil, 1)[1]
+
+
+def _lattice_keys(voxels, groups):
+    """
+    Linearizes (group, x, y, z) into a single key, after shifting
+    the coordinates to be >= 0.
+
+    input:
+        voxels  : (N,D) array of integer voxel coordinates
+        groups  : (N,) vector of contiguous group ids
+    output:
+        (N,D) array of shifted coordinates
+        (N,) vector of keys
+        (D+1,) vector of key strides (group first)
+    """
+    coords = np.asarray(voxels, dtype=np.int64)
+    coords = coords - coords.min(axis=0)
+    spans = coords.max(axis=0) + 1
+    strides = np.cumprod(np.concatenate([[1], spans[::-1]]))[::-1]
+    keys = groups*strides[0] + coords @ strides[1:]
+
+    return coords, keys, strides
+
+
+def _lattice_stencil(dim, eps, p):
+    """
+    Lists the lattice offsets within eps of the origin.
+
+    input:
+        dim : number of dimensions
+        eps : neighborhood radius
+        p   : order of the Minkowski metric (np.inf for chebyshev)
+    output:
+        (K,D) array of lattice offsets
+    """
+    radius = int(np.floor(eps))
+    steps = np.arange(-radius, radius+1)
+    offsets = np.array(np.meshgrid(*[steps]*dim, indexing='ij')).reshape(dim, -1).T
+    if p == np.inf:
+        dists = np.abs(offsets).max(axis=1).astype(np.float64)
+    elif p == 1:
+        dists = np.abs(offsets).sum(axis=1).astype(np.float64)
+    else:
+        dists = np.sqrt(np.sum(offsets.astype(np.float64)**2, axis=1))
+
+    return offsets[dists <= eps].astype(np.int64)
+
+
+@nb.njit(cache=True)
+def _find(parent: nb.int64[:],
+          i: nb.int64) -> nb.int64:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@nb.njit(cache=True)
+def _union(parent: nb.int64[:],
+           i: nb.int64,
+           j: nb.int64):
+    ri, rj = _find(parent, i), _find(parent, j)
+    if ri != rj:
+        parent[max(ri, rj)] = min(ri, rj)
+
+
+@nb.njit(cache=True, inline='always')
+def _merge_join(sorted_keys: nb.int64[:],
+                sorted_coords: nb.int64[:,:],
+                spans: nb.int64[:],
+                offset: nb.int64[:],
+                delta: nb.int64,
+                s: nb.int64,
+                j: nb.int64) -> nb.types.UniTuple(nb.int64, 2):
+    # Advances the pointer to the first sorted key >= key[s] + delta (the
+    # targets increase with s) and checks that the offset voxel is in bounds
+    target = sorted_keys[s] + delta
+    while j < len(sorted_keys) and sorted_keys[j] < target:
+        j += 1
+    for d in range(len(spans)):
+        c = sorted_coords[s,d] + offset[d]
+        if c < 0 or c >= spans[d]:
+            return j, -1
+    if j < len(sorted_keys) and sorted_keys[j] == target:
+        return j, j
+    return j, -1
+
+
+@nb.njit(parallel=True, cache=True)
+def _lattice_dbscan(coords: nb.int64[:,:],
+                    keys: nb.int64[:],
+                    strides: nb.int64[:],
+                    groups: nb.int64[:],
+                    stencil: nb.int64[:,:],
+                    min_samples: nb.int64) -> nb.types.UniTuple(nb.int64[:], 2):
+    # Sort the voxels by key once. Neighbors at a given stencil offset are
+    # found by walking a second pointer along the sorted keys (merge join)
+    num_voxels, num_dims = coords.shape
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    sorted_coords = coords[order]
+    spans = strides[:-1]//strides[1:]
+    deltas = np.zeros(len(stencil), dtype=np.int64)
+    for k in range(len(stencil)):
+        for d in range(num_dims):
+            deltas[k] += stencil[k,d]*strides[d+1]
+
+    # End of the run of duplicate keys starting at each sorted position
+    run_end = np.empty(num_voxels, dtype=np.int64)
+    run_end[-1] = num_voxels
+    for s in range(num_voxels-2, -1, -1):
+        run_end[s] = run_end[s+1] if sorted_keys[s+1] == sorted_keys[s] else s+1
+
+    # Count the neighbors of each voxel (itself included), in chunks
+    chunk_size = 4096
+    num_chunks = (num_voxels + chunk_size - 1)//chunk_size
+    counts = np.zeros(num_voxels, dtype=np.int64)
+    for c in nb.prange(num_chunks):
+        start, end = c*chunk_size, min((c+1)*chunk_size, num_voxels)
+        for k in range(len(stencil)):
+            j = np.searchsorted(sorted_keys, sorted_keys[start] + deltas[k])
+            for s in range(start, end):
+                j, match = _merge_join(sorted_keys, sorted_coords, spans, stencil[k], deltas[k], s, j)
+                if match > -1:
+                    counts[s] += run_end[match] - match
+    is_core = counts >= min_samples
+
+    # Connect each core voxel to the core voxels in its forward half-stencil
+    # (offsets which are lexicographically > 0, the stencil is symmetric)
+    parent = np.arange(num_voxels)
+    for s in range(1, num_voxels):
+        if is_core[s] and sorted_keys[s] == sorted_keys[s-1]:
+            _union(parent, s, s-1)
+    for k in range(len(stencil)):
+        if deltas[k] <= 0:
+            continue
+        j = 0
+        for s in range(num_voxels):
+            j, match = _merge_join(sorted_keys, sorted_coords, spans, stencil[k], deltas[k], s, j)
+            if is_core[s] and match > -1 and is_core[match]:
+                _union(parent, s, match)
+
+    # Label the core components in order of first appearance (within each group and globally)
+    labels = np.full(num_voxels, -1, dtype=np.int64)
+    global_labels = np.full(num_voxels, -1, dtype=np.int64)
+    comp_labels = np.full(num_voxels, -1, dtype=np.int64)
+    comp_global = np.full(num_voxels, -1, dtype=np.int64)
+    group_counts = np.zeros(groups.max()+1, dtype=np.int64)
+    rank = np.empty(num_voxels, dtype=np.int64)
+    rank[order] = np.arange(num_voxels)
+    num_comps = 0
+    for i in range(num_voxels):
+        s = rank[i]
+        if not is_core[s]:
+            continue
+        r = _find(parent, s)
+        if comp_labels[r] < 0:
+            comp_labels[r] = group_counts[groups[i]]
+            group_counts[groups[i]] += 1
+            comp_global[r] = num_comps
+            num_comps += 1
+        labels[i], global_labels[i] = comp_labels[r], comp_global[r]
+
+    # Attach border voxels to the first cluster (lowest label) that reaches them
+    for c in nb.prange(num_chunks):
+        start, end = c*chunk_size, min((c+1)*chunk_size, num_voxels)
+        for k in range(len(stencil)):
+            j = np.searchsorted(sorted_keys, sorted_keys[start] + deltas[k])
+            for s in range(start, end):
+                j, match = _merge_join(sorted_keys, sorted_coords, spans, stencil[k], deltas[k], s, j)
+                if is_core[s] or match < 0:
+                    continue
+                i = order[s]
+                for m in range(match, run_end[match]):
+                    n = order[m]
+                    if is_core[m] and (labels[i] < 0 or labels[n] < labels[i]):
+                        labels[i], global_labels[i] = labels[n], global_labels[n]
+
+    return labels, global_labels
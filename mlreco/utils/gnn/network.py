@@ -114,6 +114,80 @@ def delaunay_graph(data: nb.float64[:,:],
 
 
 @nb.njit(cache=True)
+def _kruskal(num_nodes: nb.int64,
+             edges: nb.int64[:,:],
+             weights: nb.float64[:]) -> nb.boolean[:]:
+    """
+    Kruskal's algorithm. Edges are considered in order of increasing
+    weight (stable, as in `scipy.sparse.csgraph.minimum_spanning_tree`).
+
+    Args:
+        num_nodes (int)      : Number of nodes
+        edges (np.ndarray)   : (E,2) Candidate edges (local node indices)
+        weights (np.ndarray) : (E) Edge weights
+    Returns:
+        np.ndarray: (E) Mask of the edges which belong to the minimum spanning forest
+    """
+    parent = np.arange(num_nodes)
+    mask = np.zeros(len(edges), dtype=np.bool_)
+    count = 0
+    for e in np.argsort(weights, kind='mergesort'):
+        if count == num_nodes - 1:
+            break
+        ri, rj = edges[e,0], edges[e,1]
+        while parent[ri] != ri:
+            parent[ri] = parent[parent[ri]]
+            ri = parent[ri]
+        while parent[rj] != rj:
+            parent[rj] = parent[parent[rj]]
+            rj = parent[rj]
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+            mask[e] = True
+            count += 1
+
+    return mask
+
+
+@nb.njit(cache=True)
+def _prim_bound(dist_mat: nb.float64[:,:],
+                clust_ids: nb.int64[:]) -> nb.float64:
+    """
+    Prim's algorithm on the (non-zero) upper triangular distances between a
+    subset of nodes. Only returns the length of the longest edge of the minimum
+    spanning forest, which is the same for all minimum spanning forests.
+
+    Args:
+        dist_mat (np.ndarray) : (C,C) Tensor of pair-wise cluster distances
+        clust_ids (np.ndarray): (n) Subset of nodes
+    Returns:
+        float: Length of the longest edge of the minimum spanning forest
+    """
+    n = len(clust_ids)
+    best = np.empty(n, dtype=np.float64)
+    reached, done = np.zeros(n, dtype=np.bool_), np.zeros(n, dtype=np.bool_)
+    bound = 0.
+    for _ in range(n):
+        # Add the closest node to the tree (or start a new tree if none is connected)
+        k = -1
+        for j in range(n):
+            if not done[j] and (k < 0 or (reached[j] and (not reached[k] or best[j] < best[k]))):
+                k = j
+        done[k] = True
+        if reached[k]:
+            bound = max(bound, best[k])
+
+        # Update the distance of the other nodes to the tree
+        for j in range(n):
+            if not done[j]:
+                w = dist_mat[clust_ids[min(j,k)], clust_ids[max(j,k)]]
+                if w > 0. and (not reached[j] or w < best[j]):
+                    best[j], reached[j] = w, True
+
+    return bound
+
+
+@nb.njit(parallel=True, cache=True)
 def mst_graph(batch_ids: nb.int64[:],
               dist_mat: nb.float64[:,:],
               directed: bool = False) -> nb.int64[:,:]:
@@ -128,17 +202,38 @@ def mst_graph(batch_ids: nb.int64[:],
     Returns:
         np.ndarray: (2,E) Tensor of edges
     """
-    # For each batch, find the list of edges, append it
-    ret = np.empty((0, 2), dtype=np.int64)
-    for b in np.unique(batch_ids):
-        clust_ids = np.where(batch_ids == b)[0]
-        if len(clust_ids) > 1:
-            submat = np.triu(nbl.submatrix(dist_mat, clust_ids, clust_ids))
-            with nb.objmode(mst_mat = 'float32[:,:]'): # Suboptimal. Ideally want to reimplement in Numba, but tall order...
-                mst_mat = minimum_spanning_tree(submat).toarray().astype(np.float32)
-            edges = np.where(mst_mat > 0.)
-            edges = np.vstack((clust_ids[edges[0]],clust_ids[edges[1]])).T
-            ret   = np.vstack((ret, edges))
+    # Each batch spans at most (n-1) edges, preallocate them
+    batches = np.unique(batch_ids)
+    counts = np.zeros(len(batches)+1, dtype=np.int64)
+    for b in range(len(batches)):
+        counts[b+1] = max(0, np.sum(batch_ids == batches[b]) - 1)
+    offsets = np.cumsum(counts)
+    ret = np.empty((offsets[-1], 2), dtype=np.int64)
+    valid = np.zeros(offsets[-1], dtype=np.bool_)
+
+    # Find the MST of each batch from the (non-zero) upper triangular distances.
+    # Only the edges up to the longest edge of the MST need to be sorted
+    for b in nb.prange(len(batches)):
+        clust_ids = np.where(batch_ids == batches[b])[0]
+        n = len(clust_ids)
+        bound = _prim_bound(dist_mat, clust_ids)
+        edges = np.empty((n*(n-1)//2, 2), dtype=np.int64)
+        weights = np.empty(n*(n-1)//2, dtype=np.float64)
+        k = 0
+        for i in range(n):
+            for j in range(i+1, n):
+                w = dist_mat[clust_ids[i], clust_ids[j]]
+                if w > 0. and w <= bound:
+                    edges[k] = [i, j]
+                    weights[k] = w
+                    k += 1
+        mask = _kruskal(n, edges[:k], weights[:k])
+        k = offsets[b]
+        for e in np.where(mask)[0]:
+            ret[k] = [clust_ids[edges[e,0]], clust_ids[edges[e,1]]]
+            valid[k] = True
+            k += 1
+    ret = ret[valid]
 
     # Add the reciprocal edges as to create an undirected graph, if requested
     if not directed:
@@ -148,6 +243,45 @@ def mst_graph(batch_ids: nb.int64[:],
 
 
 @nb.njit(cache=True)
+def mst_graph_sparse(batch_ids: nb.int64[:],
+                     edge_index: nb.int64[:,:],
+                     edge_dists: nb.float64[:],
+                     directed: bool = False) -> nb.int64[:,:]:
+    """
+    Function that returns an incidence matrix that connects nodes
+    that share an edge in the minimum spanning forest of a sparse set of
+    candidate edges (e.g. the edges shorter than some distance, as given
+    by `inter_cluster_distance(..., sparse=True)`). It is the MST of
+    `mst_graph` provided that the candidates include its edges.
+
+    Args:
+        batch_ids (np.ndarray) : (C) List of batch ids
+        edge_index (np.ndarray): (2,E) Candidate edges (only edges [i,j] with j>i are used)
+        edge_dists (np.ndarray): (E) Length of each candidate edge
+        directed (bool)        : If directed, only keep edges [i,j] for which j>=i
+    Returns:
+        np.ndarray: (2,E) Tensor of edges
+    """
+    # Order the candidates by batch, then row-major (as in the dense matrix)
+    keep = np.where((edge_index[0] < edge_index[1]) & (edge_dists > 0.))[0]
+    edges, weights = edge_index[:, keep].T.copy(), edge_dists[keep]
+    num_nodes = len(batch_ids)
+    batch_rank = np.searchsorted(np.unique(batch_ids), batch_ids)
+    order = np.argsort((batch_rank[edges[:,0]]*num_nodes + edges[:,0])*num_nodes + edges[:,1], kind='mergesort')
+    edges, weights = edges[order], weights[order]
+
+    # Edges only connect nodes of the same batch: a single forest covers all batches
+    mask = _kruskal(num_nodes, edges, weights)
+    ret = edges[mask]
+
+    # Add the reciprocal edges as to create an undirected graph, if requested
+    if not directed:
+        ret = np.vstack((ret, ret[:,::-1]))
+
+    return ret.T
+
+
+@nb.njit(parallel=True, cache=True)
 def knn_graph(batch_ids: nb.int64[:],
               k: nb.int64,
               dist_mat: nb.float64[:,:],
@@ -164,20 +298,33 @@ def knn_graph(batch_ids: nb.int64[:],
     Returns:
         np.ndarray: (2,E) Tensor of edges
     """
-    # Use the available distance matrix to build a kNN graph
-    ret = np.empty((0, 2), dtype=np.int64)
-    for b in np.unique(batch_ids):
+    # Order the nodes by batch, count their edges, preallocate
+    batches = np.unique(batch_ids)
+    nodes = np.empty(len(batch_ids), dtype=np.int64)
+    counts = np.zeros(len(batch_ids)+1, dtype=np.int64)
+    n = 0
+    for b in batches:
         clust_ids = np.where(batch_ids == b)[0]
-        if len(clust_ids) > 1:
-            subk = min(k+1, len(clust_ids))
-            submat = nbl.submatrix(dist_mat, clust_ids, clust_ids)
-            for i in range(len(submat)):
-                idxs = np.argsort(submat[i])[1:subk]
-                edges = np.empty((subk-1,2), dtype=np.int64)
-                for j, idx in enumerate(np.sort(idxs)):
-                    edges[j] = [clust_ids[i], clust_ids[idx]]
-                if len(edges):
-                    ret = np.vstack((ret, edges))
+        subk = min(k+1, len(clust_ids))
+        for i in clust_ids:
+            nodes[n] = i
+            counts[n+1] = max(0, subk-1)
+            n += 1
+    offsets = np.cumsum(counts)
+    ret = np.empty((offsets[-1], 2), dtype=np.int64)
+
+    # Use the available distance matrix to find the neighbors of each node
+    for n in nb.prange(len(nodes)):
+        if counts[n+1] == 0:
+            continue
+        i = nodes[n]
+        clust_ids = np.where(batch_ids == batch_ids[i])[0]
+        dists = np.empty(len(clust_ids), dtype=dist_mat.dtype)
+        for j in range(len(clust_ids)):
+            dists[j] = dist_mat[i, clust_ids[j]]
+        idxs = np.sort(np.argsort(dists)[1:counts[n+1]+1])
+        for j in range(len(idxs)):
+            ret[offsets[n]+j] = [i, clust_ids[idxs[j]]]
 
     # Add the reciprocal edges as to create an undirected graph, if requested
     if not directed:
@@ -187,6 +334,61 @@ def knn_graph(batch_ids: nb.int64[:],
 
 
 @nb.njit(cache=True)
+def knn_graph_sparse(batch_ids: nb.int64[:],
+                     k: nb.int64,
+                     edge_index: nb.int64[:,:],
+                     edge_dists: nb.float64[:],
+                     directed: bool = False) -> nb.int64[:,:]:
+    """
+    Function that returns an incidence matrix that connects nodes
+    that are k nearest neighbors among a sparse set of candidate edges
+    (e.g. the edges shorter than some distance, as given by
+    `inter_cluster_distance(..., sparse=True)`). Nodes with fewer than
+    k candidates are connected to all of them.
+
+    Args:
+        batch_ids (np.ndarray) : (C) List of batch ids
+        k (int)                : Number of connected neighbors for each node
+        edge_index (np.ndarray): (2,E) Candidate edges (in both directions)
+        edge_dists (np.ndarray): (E) Length of each candidate edge
+        directed (bool)        : If directed, only keep edges [i,j] for which j>=i
+    Returns:
+        np.ndarray: (2,E) Tensor of edges
+    """
+    # Order the nodes by batch
+    num_nodes = len(batch_ids)
+    node_rank = np.empty(num_nodes, dtype=np.int64)
+    n = 0
+    for b in np.unique(batch_ids):
+        for i in np.where(batch_ids == b)[0]:
+            node_rank[i] = n
+            n += 1
+
+    # Sort the candidates by source, then distance, then target (stable sorts)
+    order = np.argsort(edge_index[1], kind='mergesort')
+    order = order[np.argsort(edge_dists[order], kind='mergesort')]
+    order = order[np.argsort(node_rank[edge_index[0, order]], kind='mergesort')]
+    sources, targets = edge_index[0, order], edge_index[1, order]
+
+    # Keep the first k candidates of each source, ordered by target
+    starts = np.searchsorted(node_rank[sources], np.arange(num_nodes+1))
+    counts = np.minimum(starts[1:] - starts[:-1], k)
+    offsets = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(counts)))
+    ret = np.empty((offsets[-1], 2), dtype=np.int64)
+    for n in range(num_nodes):
+        start = starts[n]
+        neighbors = np.sort(targets[start:start+counts[n]])
+        for j in range(counts[n]):
+            ret[offsets[n]+j] = [sources[start], neighbors[j]]
+
+    # Add the reciprocal edges as to create an undirected graph, if requested
+    if not directed:
+        ret = np.vstack((ret, ret[:,::-1]))
+
+    return ret.T
+
+
+@nb.njit(parallel=True, cache=True)
 def bipartite_graph(batch_ids: nb.int64[:],
                     primaries: nb.boolean[:],
                     directed: nb.boolean = True,
@@ -203,12 +405,21 @@ def bipartite_graph(batch_ids: nb.int64[:],
     Returns:
         np.ndarray: (2,E) Tensor of edges
     """
+    # Count the secondaries of each primary, preallocate
+    primary_ids, secondary_ids = np.where(primaries)[0], np.where(~primaries)[0]
+    counts = np.zeros(len(primary_ids)+1, dtype=np.int64)
+    for p in range(len(primary_ids)):
+        counts[p+1] = np.sum(batch_ids[secondary_ids] == batch_ids[primary_ids[p]])
+    offsets = np.cumsum(counts)
+
     # Create the incidence matrix
-    ret = np.empty((0,2), dtype=np.int64)
-    for i in np.where(primaries)[0]:
-        for j in np.where(~primaries)[0]:
-            if batch_ids[i] ==  batch_ids[j]:
-                ret = np.vstack((ret, np.array([[i,j]])))
+    ret = np.empty((offsets[-1], 2), dtype=np.int64)
+    for p in nb.prange(len(primary_ids)):
+        i, k = primary_ids[p], offsets[p]
+        for j in secondary_ids:
+            if batch_ids[i] == batch_ids[j]:
+                ret[k] = [i, j]
+                k += 1
 
     # Handle directedness, by default graph is directed towards secondaries
     if directed:
@@ -222,6 +433,106 @@ def bipartite_graph(batch_ids: nb.int64[:],
     return ret.T
 
 
+@numbafy(cast_args=['voxels'], list_args=['clusts'])
+def skeleton_graph(voxels, clusts, batch_ids, beta=1., max_dist=None, directed=False):
+    """
+    Function that returns an incidence matrix of the beta-skeleton of
+    the clusters, a Delaunay-free alternative to `delaunay_graph`.
+
+    Two clusters are connected if no voxel of a third cluster of the same
+    batch lies strictly inside the lune of their closest pair of voxels
+    (p, q): the intersection of the two balls of radius beta*|pq|/2
+    centered at (1-beta/2)p + (beta/2)q and (beta/2)p + (1-beta/2)q.
+    With beta=1, this is the Gabriel graph of the clusters, with beta=2,
+    its relative neighborhood graph. If `max_dist` is specified, only the
+    clusters closer than max_dist are considered (radius-limited graph).
+
+    Args:
+        voxels (np.ndarray)   : (N,3) Tensor of voxel coordinates
+        clusts ([np.ndarray]) : (C) List of arrays of voxel IDs in each cluster
+        batch_ids (np.ndarray): (C) List of batch ids
+        beta (float)          : Lune parameter (between 1 and 2)
+        max_dist (float)      : Maximum distance between two connected clusters
+        directed (bool)       : If directed, only keep edges [i,j] for which j>=i
+    Returns:
+        np.ndarray: (2,E) Tensor of edges
+    """
+    assert beta >= 1. and beta <= 2., 'The lune parameter beta must be between 1 and 2'
+
+    # Find the candidate edges and the closest pair of voxels of each
+    clusts = list(clusts)
+    if max_dist is not None:
+        edges, dists, index = _inter_cluster_distance_kdtree(voxels, clusts, batch_ids, True, max_dist, True)
+        half = edges.shape[1]//2
+        edges, dists, index = edges[:, :half], dists[:half], index[:half]
+    else:
+        edges = complete_graph(batch_ids, directed=True)
+        dist_mat, index_mat = _inter_cluster_distance_kdtree(voxels, clusts, batch_ids, True)
+        dists, index = dist_mat[edges[0], edges[1]], index_mat[edges[0], edges[1]]
+    if not edges.shape[1]:
+        return np.empty((2,0), dtype=np.int64)
+    sizes = np.array([len(c) for c in clusts], dtype=np.int64)
+    clust_ptr = np.concatenate(([0], np.cumsum(sizes)))
+    clust_index = np.concatenate(clusts).astype(np.int64)
+    firsts = clust_index[clust_ptr[edges[0]] + index//sizes[edges[1]]]
+    seconds = clust_index[clust_ptr[edges[1]] + index%sizes[edges[1]]]
+
+    # Build the adjacency lists of the candidate graph, check the lune of each edge
+    sources, targets = np.concatenate(edges), np.concatenate(edges[::-1])
+    weights = np.concatenate((dists, dists)).astype(np.float64)
+    order = np.lexsort((targets, sources))
+    ptr = np.searchsorted(sources[order], np.arange(len(clusts)+1))
+    blocked = _lune_blocked(voxels.astype(np.float64), edges, firsts, seconds, dists.astype(np.float64),
+            beta, ptr, targets[order], weights[order], clust_index, clust_ptr)
+    ret = edges[:, ~blocked].T
+
+    # Add the reciprocal edges as to create an undirected graph, if requested
+    if not directed:
+        ret = np.vstack((ret, ret[:,::-1]))
+
+    return ret.T
+
+
+@nb.njit(parallel=True, cache=True)
+def _lune_blocked(voxels: nb.float64[:,:],
+                  edges: nb.int64[:,:],
+                  firsts: nb.int64[:],
+                  seconds: nb.int64[:],
+                  dists: nb.float64[:],
+                  beta: nb.float64,
+                  ptr: nb.int64[:],
+                  neighbors: nb.int64[:],
+                  neighbor_dists: nb.float64[:],
+                  clust_index: nb.int64[:],
+                  clust_ptr: nb.int64[:]) -> nb.boolean[:]:
+    # A voxel of a third cluster inside the lune (beta <= 2) is closer than
+    # the edge length to both ends: only check the clusters which are
+    # candidate neighbors of both ends, at most as far as the edge length
+    blocked = np.zeros(edges.shape[1], dtype=np.bool_)
+    for e in nb.prange(edges.shape[1]):
+        a, b, d = edges[0,e], edges[1,e], dists[e]
+        p, q = voxels[firsts[e]], voxels[seconds[e]]
+        center1, center2 = (1-beta/2)*p + (beta/2)*q, (beta/2)*p + (1-beta/2)*q
+        r2 = (beta*d/2)**2
+        ia, ib = ptr[a], ptr[b]
+        while ia < ptr[a+1] and ib < ptr[b+1] and not blocked[e]:
+            ca, cb = neighbors[ia], neighbors[ib]
+            if ca < cb:
+                ia += 1
+            elif cb < ca:
+                ib += 1
+            else:
+                if neighbor_dists[ia] <= d and neighbor_dists[ib] <= d:
+                    for v in clust_index[clust_ptr[ca]:clust_ptr[ca+1]]:
+                        if np.sum((voxels[v]-center1)**2) < r2 and np.sum((voxels[v]-center2)**2) < r2:
+                            blocked[e] = True
+                            break
+                ia += 1
+                ib += 1
+
+    return blocked
+
+
 @nb.njit(cache=True)
 def restrict_graph(edge_index: nb.int64[:,:],
                    dist_mat: nb.float64[:,:],
@@ -260,6 +571,34 @@ def restrict_graph(edge_index: nb.int64[:,:],
         return edge_index[:, edge_dists < edge_max_dists]
 
 
+@nb.njit(cache=True)
+def restrict_edges(edge_index: nb.int64[:,:],
+                   edge_dists: nb.float64[:],
+                   max_dist: nb.float64[:,:],
+                   classes: nb.int64[:] = None) -> nb.boolean[:]:
+    """
+    Function that finds the edges of a graph below a certain length,
+    given the length of each edge (see `restrict_graph`).
+
+    Args:
+        edge_index (np.ndarray): (2,E) Tensor of edges
+        edge_dists (np.ndarray): (E) Length of each edge
+        max_dist (np.ndarray)  : (N_c, N_c) Maximum edge length for each class type
+        classes (np.ndarray)   : (C) List of class for each cluster in the graph
+    Returns:
+        np.ndarray: (E) Mask of the edges to keep
+    """
+    if classes is None:
+        assert max_dist.shape[0] == max_dist.shape[1] == 1
+        return edge_dists < max_dist[0][0]
+    else:
+        edge_max_dists = np.empty(edge_index.shape[1], dtype=edge_dists.dtype)
+        for k in range(edge_index.shape[1]):
+            i, j = edge_index[0,k], edge_index[1,k]
+            edge_max_dists[k] = max_dist[classes[i], classes[j]]
+        return edge_dists < edge_max_dists
+
+
 @numbafy(cast_args=['data'], list_args=['clusts'], keep_torch=True, ref_arg='data')
 def get_cluster_edge_features(data, clusts, edge_index, closest_index=None, batch_col=0, coords_col=(1, 4)):
     """
@@ -431,24 +770,39 @@ def _get_edge_distances(voxels: nb.float32[:,:],
 
 
 @numbafy(cast_args=['voxels'], list_args=['clusts'])
-def inter_cluster_distance(voxels, clusts, batch_ids=None, mode='voxel', algorithm='brute', return_index=False):
+def inter_cluster_distance(voxels, clusts, batch_ids=None, mode='voxel', algorithm='brute', return_index=False, max_dist=None, sparse=False):
     """
     Finds the inter-cluster distance between every pair of clusters within
     each batch, returned as a block-diagonal matrix.
 
+    The `kdtree` algorithm is exact. It skips the pairs of clusters whose
+    bounding boxes are at least `max_dist` apart (their distance is set
+    to infinity) and finds the closest pair of voxels of the other pairs
+    by querying a KD-tree of one of the clusters.
+
     Args:
         voxels (torch.tensor) : (N,3) Tensor of voxel coordinates
         clusts ([np.ndarray]) : (C) List of arrays of voxel IDs in each cluster
         batch_ids (np.ndarray): (C) List of cluster batch IDs
         mode (str)            : Eiher use closest voxel distance (`voxel`) or centroid distance (`centroid`)
-        algorithm (str)       : `brute` is exact but slow, `recursive` uses a fast but approximate proxy
+        algorithm (str)       : `brute` is exact but slow, `recursive` uses a fast but approximate proxy,
+                                `kdtree` is exact and fast
         return_index (bool)   : If True, returns the combined index of the closest voxel pair
+        max_dist (float)      : Distance above which pairs of clusters may be skipped (`kdtree` only)
+        sparse (bool)         : If True, only returns the pairs closer than `max_dist` (`kdtree` only)
     Returns:
         torch.tensor: (C,C) Tensor of pair-wise cluster distances
+        or, if sparse:
+        np.ndarray: (2,E) Edges between clusters closer than `max_dist` (ordered as `complete_graph`)
+        np.ndarray: (E) Length of each edge
     """
     # If there is no batch_ids provided, assign 0 to all clusters
     if batch_ids is None:
-        batch_ids = np.zeros(len(clusts), dtype=np.int64) 
+        batch_ids = np.zeros(len(clusts), dtype=np.int64)
+
+    if algorithm == 'kdtree' and mode == 'voxel':
+        return _inter_cluster_distance_kdtree(voxels, list(clusts), batch_ids, return_index, max_dist, sparse)
+    assert not sparse, 'Sparse inter-cluster distances are only supported with the kdtree algorithm'
 
     if not return_index:
         return _inter_cluster_distance(voxels, clusts, batch_ids, mode, algorithm)
@@ -456,6 +810,93 @@ def inter_cluster_distance(voxels, clusts, batch_ids=None, mode='voxel', algorit
         assert mode == 'voxel', 'Cannot return index for centroid method'
         return _inter_cluster_distance_index(voxels, clusts, batch_ids, algorithm)
 
+
+def _inter_cluster_distance_kdtree(voxels, clusts, batch_ids, return_index=False, max_dist=None, sparse=False):
+    from scipy.spatial import cKDTree
+
+    # Compute a lower bound of the distance of each pair from their bounding boxes, prune
+    assert not sparse or max_dist is not None, 'Must provide max_dist to return sparse distances'
+    edges = complete_graph(batch_ids, directed=True)
+    if max_dist is not None and edges.shape[1]:
+        lows  = np.vstack([np.min(voxels[c], axis=0) for c in clusts])
+        highs = np.vstack([np.max(voxels[c], axis=0) for c in clusts])
+        i, j  = edges
+        gaps  = np.maximum(0., np.maximum(lows[i]-highs[j], lows[j]-highs[i]))
+        edges = edges[:, np.sqrt(np.sum(gaps**2, axis=1)) < max_dist]
+
+    # Without a distance cut, bound the distance of each pair with the fast recursive proxy
+    if max_dist is None:
+        proxy = _inter_cluster_distance(voxels, nb.typed.List(clusts), batch_ids, 'voxel', 'recursive')
+        bounds = proxy[edges[0], edges[1]].astype(np.float64)*(1+1e-6) + 1e-6
+    else:
+        bounds = np.full(edges.shape[1], max_dist, dtype=np.float64)
+
+    # For each cluster, query its KD-tree with the voxels of its partners
+    # which are within bound of its bounding box
+    firsts, seconds = np.full(edges.shape[1], -1, dtype=np.int64), np.full(edges.shape[1], -1, dtype=np.int64)
+    voxel_ids = np.zeros((2, edges.shape[1]), dtype=np.int64)
+    edge_order = np.argsort(edges[0], kind='stable')
+    starts = np.searchsorted(edges[0, edge_order], np.arange(len(clusts)+1))
+    for i in np.unique(edges[0]):
+        pairs    = edge_order[starts[i]:starts[i+1]]
+        partners = edges[1, pairs]
+        sizes    = np.array([len(clusts[j]) for j in partners])
+        points   = np.concatenate([clusts[j] for j in partners])
+        offsets  = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        segment  = np.repeat(np.arange(len(partners)), sizes)
+        cluster  = voxels[clusts[i]]
+        gaps     = np.maximum(0., np.maximum(cluster.min(axis=0)-voxels[points], voxels[points]-cluster.max(axis=0)))
+        near     = np.sum(gaps**2, axis=1) <= bounds[pairs][segment]**2
+        dists, index = np.full(len(points), np.inf), np.full(len(points), len(cluster))
+        dists[near], index[near] = cKDTree(cluster).query(voxels[points[near]], distance_upper_bound=np.max(bounds[pairs]))
+
+        # Closest voxel in each partner, if it is within bound
+        mins    = np.minimum.reduceat(dists, offsets)
+        ties    = np.where(dists == mins[segment])[0]
+        closest = ties[np.searchsorted(segment[ties], np.arange(len(partners)))]
+        valid   = np.isfinite(dists[closest])
+        firsts[pairs[valid]]  = index[closest[valid]]
+        seconds[pairs[valid]] = closest[valid] - offsets[valid]
+        voxel_ids[0, pairs[valid]] = clusts[i][index[closest[valid]]]
+        voxel_ids[1, pairs[valid]] = points[closest[valid]]
+
+    # Compute the distances of the closest pairs the same way cdist does
+    found = firsts > -1
+    edge_dists = np.full(edges.shape[1], np.inf, dtype=voxels.dtype)
+    diffs = voxels[voxel_ids[0, found]] - voxels[voxel_ids[1, found]]
+    edge_dists[found] = np.sqrt(np.sum(diffs**2, axis=1))
+    sizes = np.array([len(c) for c in clusts], dtype=np.int64)
+    closest_index = np.where(found, firsts*sizes[edges[1]] + seconds, -1)
+
+    # Return the sparse set of pairs within max_dist, in both directions
+    if sparse:
+        mask = edge_dists < max_dist
+        edges, edge_dists = edges[:, mask], edge_dists[mask]
+        edges = np.hstack((edges, edges[::-1]))
+        edge_dists = np.concatenate((edge_dists, edge_dists))
+        if return_index:
+            reverse_index = seconds[mask]*sizes[edges[0, :mask.sum()]] + firsts[mask]
+            return edges, edge_dists, np.concatenate((closest_index[mask], reverse_index))
+        return edges, edge_dists
+
+    # Fill the block-diagonal matrix (skipped pairs are infinitely far apart)
+    dist_mat = np.zeros((len(clusts), len(clusts)), dtype=voxels.dtype)
+    if max_dist is not None:
+        for b in np.unique(batch_ids):
+            index = np.where(batch_ids == b)[0]
+            dist_mat[np.ix_(index, index)] = np.inf
+        np.fill_diagonal(dist_mat, 0.)
+    i, j = edges
+    dist_mat[i, j] = dist_mat[j, i] = edge_dists
+    if not return_index:
+        return dist_mat
+
+    index_mat = np.full((len(clusts), len(clusts)), -1, dtype=np.int64)
+    index_mat[np.arange(len(clusts)), np.arange(len(clusts))] = np.arange(len(clusts))
+    index_mat[i, j] = closest_index
+    index_mat[j, i] = np.where(found, seconds*sizes[i] + firsts, -1)
+    return dist_mat, index_mat
+
 @nb.njit(parallel=True, cache=True)
 def _inter_cluster_distance(voxels: nb.float32[:,:],
                             clusts: nb.types.List(nb.int64[:]),
@@ -498,9 +939,8 @@ def _inter_cluster_distance_index(voxels: nb.float32[:,:],
     for k in nb.prange(len(indxi)):
         i, j = indxi[k], indxj[k]
         ii, jj, dist = nbl.closest_pair(voxels[clusts[i]], voxels[clusts[j]], algorithm)
-        index = ii*len(clusts[j]) + jj
-
-        closest_index[i,j] = closest_index[j,i] = index
+        closest_index[i,j] = ii*len(clusts[j]) + jj
+        closest_index[j,i] = jj*len(clusts[i]) + ii
         dist_mat[i,j] = dist_mat[j,i] = dist
 
     return dist_mat, closest_index
@@ -60,6 +60,20 @@ class Stopwatch:
         if data[0] < 0:
             data[0] = time.process_time() - data[1]
 
+    def record(self, key, duration):
+        '''
+        Records a time measured elsewhere (e.g. in another thread) for a
+        unique key, as if the stopwatch had been started and stopped.
+
+        Parameters
+        ----------
+        key : str
+            Key for which to record the time
+        duration : float
+            Time to record in seconds
+        '''
+        self._watch[key] = [duration, time.time() - duration]
+
     def time(self,key):
         '''
         Returns the time recorded or passed so far (if not stopped).
@@ -1,9 +1,14 @@
 # Utils to do track clustering
 import numpy as np
 import scipy
+import scipy.sparse.csgraph
+import scipy.spatial
 import sklearn
 from scipy.spatial.distance import cdist
 
+# Minkowski order of the metrics supported by the sparse radius graph
+MINKOWSKI_P = {'euclidean': 2, 'manhattan': 1, 'cityblock': 1, 'chebyshev': np.inf}
+
 def track_clustering(voxels, points, method='masked_dbscan', **kwargs):
     if method == 'masked_dbscan':
         pair_mat  = cdist(points, voxels, metric=kwargs['metric'])
@@ -37,42 +42,50 @@ def track_clustering(voxels, points, method='masked_dbscan', **kwargs):
             point_mask  = np.min(pair_mat[group_mask], axis=0) < kwargs['eps']
             point_ids   = np.unique(np.argmin(pair_mat[np.ix_(group_mask, point_mask)], axis=0))
             if len(point_ids) > 2:
-                # Build a graph on the group voxels that respect the DBSCAN distance scale
-                dist_mat  = cdist(voxels[group_mask], voxels[group_mask], metric=kwargs['metric'])
-                graph     = dist_mat * (dist_mat < kwargs['eps'])
-                cs_graph  = scipy.sparse.csr_matrix(graph)
-
-                # Find the shortest between each of the breaking points, identify segments that minimize absolute excursion
-                graph_mat, predecessors = scipy.sparse.csgraph.shortest_path(csgraph=cs_graph, directed=False, return_predecessors=True)
-                break_ix  = np.ix_(point_ids, point_ids)
-                chord_mat = dist_mat[break_ix]
-                mst_mat   = scipy.sparse.csgraph.minimum_spanning_tree(graph_mat[break_ix]-chord_mat+1e-6).toarray()
+                # Build a sparse graph on the group voxels that respect the DBSCAN distance scale
+                group_voxels = voxels[group_mask]
+                cs_graph = radius_graph(group_voxels, kwargs['eps'], kwargs['metric'])
+
+                # Find the shortest path from each of the breaking points. If the graph is
+                # dense, the all-pairs solver picks Floyd-Warshall: keep it (same tie-breaking)
+                num_voxels = len(group_voxels)
+                if cs_graph.nnz >= num_voxels*num_voxels/4:
+                    graph_mat, predecessors = scipy.sparse.csgraph.shortest_path(csgraph=cs_graph, directed=False, return_predecessors=True)
+                    point_dists, point_preds = graph_mat[point_ids], predecessors[point_ids]
+                    reach = lambda nodes: np.min(graph_mat[:,nodes], axis=1)
+                else:
+                    point_dists, point_preds = scipy.sparse.csgraph.dijkstra(csgraph=cs_graph, directed=False, indices=point_ids, return_predecessors=True)
+                    reach = lambda nodes: scipy.sparse.csgraph.dijkstra(csgraph=cs_graph, directed=False, indices=nodes, min_only=True)
+
+                # Identify segments between breaking points that minimize absolute excursion
+                chord_mat = cdist(group_voxels[point_ids], group_voxels[point_ids], metric=kwargs['metric'])
+                mst_mat   = scipy.sparse.csgraph.minimum_spanning_tree(point_dists[:, point_ids]-chord_mat+1e-6).toarray()
                 mst_edges = np.vstack(np.where(mst_mat > 0)).T
 
                 # Construct graph paths along the tree
                 paths = [[] for _ in range(len(mst_edges))]
-                for i, e in enumerate(mst_edges):
-                    k, l = point_ids[e]
+                for i, (a, b) in enumerate(mst_edges):
+                    k, l = point_ids[a], point_ids[b]
                     paths[i].append(l)
                     while l != k:
-                        l = predecessors[k,l]
+                        l = point_preds[a,l]
                         paths[i].append(l)
 
                 # Find the path closest to each of the voxels in the group. If a path does not improve reachability, remove
-                mindists  = np.vstack([np.min(graph_mat[:,p],axis=1) for p in paths])
+                mindists  = np.vstack([reach(p) for p in paths])
                 mst_tort  = mst_mat[mst_mat > 0]/chord_mat[mst_mat > 0] # tau - 1
                 tort_ord  = np.argsort(-mst_tort)
                 least_r   = np.max(np.min(mindists, axis=0)) # Least reachable point distance
-                path_mask = np.ones(len(mst_tort), dtype=np.bool)
+                path_mask = np.ones(len(mst_tort), dtype=bool)
                 for i in range(len(mst_tort)):
                     if np.sum(path_mask) == 1: break
                     path_mask[tort_ord[i]] = False
-                    reach = np.max(np.min(mindists[path_mask], axis=0))
-                    if reach > least_r:
+                    reach_r = np.max(np.min(mindists[path_mask], axis=0))
+                    if reach_r > least_r:
                         path_mask[tort_ord[i]] = True
 
                 # Associate voxels with closest remaining path
-                mindists  = np.vstack([np.min(graph_mat[:,p[min(1,len(p)-2):max(len(p)-1,2)]],axis=1) for i, p in enumerate(paths) if path_mask[i]])
+                mindists  = np.vstack([reach(p[min(1,len(p)-2):max(len(p)-1,2)]) for i, p in enumerate(paths) if path_mask[i]])
                 sublabels = np.argmin(mindists, axis=0)
                 labels[group_mask] = max(labels)+1+sublabels
 
@@ -80,3 +93,52 @@ def track_clustering(voxels, points, method='masked_dbscan', **kwargs):
 
     else:
         raise ValueError('Track clustering method not recognized:', method)
+
+
+def radius_graph(voxels, eps, metric='euclidean'):
+    """
+    Builds the sparse graph which connects the voxels closer than eps
+    to each other, weighted by their distance. It is identical to the
+    dense graph `dist_mat * (dist_mat < eps)` built from `cdist`.
+
+    Parameters
+    ----------
+    voxels : np.ndarray
+        (N, 3) Voxel coordinates
+    eps : float
+        Connection radius (strict)
+    metric : str, default 'euclidean'
+        Distance metric
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (N, N) Sparse distance graph
+    """
+    # Unsupported metrics go through the dense distance matrix
+    voxels = np.asarray(voxels, dtype=np.float64)
+    if metric not in MINKOWSKI_P:
+        dist_mat = cdist(voxels, voxels, metric=metric)
+        return scipy.sparse.csr_matrix(dist_mat * (dist_mat < eps))
+
+    # Find the pairs within eps with a KD-tree, compute their distances as cdist does
+    tree  = scipy.spatial.cKDTree(voxels)
+    pairs = tree.query_pairs(eps*(1+1e-9), p=MINKOWSKI_P[metric], output_type='ndarray')
+    diffs = np.abs(voxels[pairs[:,0]] - voxels[pairs[:,1]])
+    if metric == 'chebyshev':
+        dists = np.max(diffs, axis=1, initial=0.)
+    elif MINKOWSKI_P[metric] == 1:
+        dists = np.sum(diffs, axis=1)
+    else:
+        dists = np.sqrt(np.sum(diffs**2, axis=1))
+    keep  = (dists < eps) & (dists > 0.)
+    pairs, dists = pairs[keep], dists[keep]
+
+    # Symmetrize, order the column indices of each row
+    num_voxels = len(voxels)
+    rows = np.concatenate([pairs[:,0], pairs[:,1]])
+    cols = np.concatenate([pairs[:,1], pairs[:,0]])
+    graph = scipy.sparse.csr_matrix((np.concatenate([dists, dists]), (rows, cols)), shape=(num_voxels, num_voxels))
+    graph.sort_indices()
+
+    return graph
@@ -1,6 +1,8 @@
 import numpy as np
 from dataclasses import dataclass
-from copy import deepcopy
+from copy import copy, deepcopy
+from functools import partial
+from collections.abc import MutableMapping
 
 from .globals import *
 from .volumes import VolumeBoundaries
@@ -18,7 +20,8 @@ class Unwrapper:
         Parameters
         ----------
         batch_size : int
-             Number of events in the batch
+             Number of events in the batch (only used if the
+             data does not provide an `index` list)
         rules : dict
              Dictionary which contains a set of unwrapping rules for each
              output key of the reconstruction chain. If there is no rule
@@ -35,11 +38,12 @@ class Unwrapper:
         self.num_volumes = self.merger.num_volumes() if self.merger else 1
         self.rules = self._parse_rules(rules)
 
-    def __call__(self, data_blob, result_blob):
+    def __call__(self, data_blob, result_blob, metadata=None):
         '''
-        Main unwrapping function. Loops over the data and result keys
-        and applies the unwrapping rules. Returns the unwrapped versions
-        of the two dictionaries
+        Main unwrapping function. Builds the batch index of the reference
+        tensors and returns the unwrapped versions of the two dictionaries.
+        Each key is only unwrapped the first time it is accessed in the
+        returned dictionaries.
 
         Parameters
         ----------
@@ -47,13 +51,24 @@ class Unwrapper:
             Dictionary of array of array of minibatch data [key][num_gpus][batch_size]
         result_blob : dict
             Results dictionary, output of trainval.forward [key][num_gpus][batch_size]
+        metadata : dict, optional
+            Batch index of the input data, output of `prepare`
+
+        Returns
+        -------
+        UnwrappedBlob
+            Unwrapped data dictionary
+        UnwrappedBlob
+            Unwrapped result dictionary
         '''
-        self._build_batch_masks(data_blob, result_blob)
-        data_unwrapped, result_unwrapped = {}, {}
-        for key, value in data_blob.items():
-            data_unwrapped[key] = self._unwrap(key, value)
-        for key, value in result_blob.items():
-            result_unwrapped[key] = self._unwrap(key, value)
+        self._build_batch_masks(data_blob, result_blob, metadata)
+
+        # Freeze the batch index of this call, as the unwrapper is reused
+        state = copy(self)
+        data_unwrapped = UnwrappedBlob({key: partial(state._unwrap, key, value) \
+                for key, value in data_blob.items() if key != 'batch_offsets'})
+        result_unwrapped = UnwrappedBlob({key: partial(state._unwrap, key, value) \
+                for key, value in result_blob.items()})
 
         return data_unwrapped, result_unwrapped
 
@@ -104,11 +119,29 @@ class Unwrapper:
 
         return parsed_rules
 
-    def _build_batch_masks(self, data_blob, result_blob):
+    def prepare(self, data_blob):
         '''
-        For all the returned data objects that require a batch mask:
-        build it and store it. Also store the index offsets within that
-        batch, wherever necessary to unwrap.
+        Builds the batch index of the input data ahead of time (e.g.
+        while the previous batch is processed).
+
+        Parameters
+        ----------
+        data_blob : dict
+            Dictionary of array of array of minibatch data [key][num_gpus][batch_size]
+
+        Returns
+        -------
+        dict
+            Batch index of the input data
+        '''
+        self._build_batch_masks(data_blob, {}, partial=True)
+
+        return {'index': self.index}
+
+    def _build_batch_masks(self, data_blob, result_blob, metadata=None, partial=False):
+        '''
+        For all the returned data objects that need to be split by
+        batch entry: build the `BatchIndex` of the tensor they refer to.
 
         Parameters
         ----------
@@ -116,105 +149,199 @@ class Unwrapper:
             Dictionary of array of array of minibatch data [key][num_gpus][batch_size]
         result_blob : dict
             Results dictionary, output of trainval.forward [key][num_gpus][batch_size]
+        metadata : dict, optional
+            Batch index of the input data, output of `prepare`
+        partial : bool, default False
+            If `True`, skip the rules which refer to missing tensors
         '''
         comb_blob = dict(data_blob, **result_blob)
-        self.masks, self.offsets = {}, {}
+        self.batch_sizes = self._batch_sizes(data_blob)
+        self.index = {}
+        if metadata is not None:
+            self.index.update({k: v for k, v in metadata['index'].items() if k not in result_blob})
+        batch_offsets = data_blob.get('batch_offsets', [{}]*self.num_gpus)
+        self.batch_offsets = [{k: v for k, v in o.items() if k not in result_blob} for o in batch_offsets]
         for key in comb_blob.keys():
             # Skip outputs with no rule
             if key not in self.rules:
                 continue
 
-            # For tensors and lists of tensors, build one mask per reference tensor
+            # Skip outputs which refer to missing tensors, if requested
+            ref_keys = self.rules[key].ref_key
+            ref_keys = [ref_keys] if isinstance(ref_keys, str) else ref_keys
+            if partial and not all([k in comb_blob for k in ref_keys]):
+                continue
+
+            # For tensors and lists of tensors, index each reference tensor
             if not self.rules[key].done and self.rules[key].method in ['tensor', 'tensor_list']:
                 ref_key = self.rules[key].ref_key
-                if ref_key not in self.masks:
+                if ref_key not in self.index:
                     assert ref_key in comb_blob, f'Must provide reference tensor ({ref_key}) to unwrap {key}'
                     assert self.rules[key].method == self.rules[ref_key].method, f'Reference ({ref_key}) must be of same type as {key}'
                     if self.rules[key].method == 'tensor':
-                        self.masks[ref_key] = [self._batch_masks(comb_blob[ref_key][g]) for g in range(self.num_gpus)]
+                        self.index[ref_key] = [self._batch_index(comb_blob[ref_key][g], ref_key, g) for g in range(self.num_gpus)]
                     elif self.rules[key].method == 'tensor_list':
-                        self.masks[ref_key] = [[self._batch_masks(v) for v in comb_blob[ref_key][g]] for g in range(self.num_gpus)]
+                        self.index[ref_key] = [[self._batch_index(v, g=g) for v in comb_blob[ref_key][g]] for g in range(self.num_gpus)]
 
-            # For edge tensors, build one mask from each tensor (must figure out batch IDs of edges)
+            # For edge tensors, index the nodes and the edges (batch IDs of edges are those of their source node)
             elif self.rules[key].method == 'edge_tensor':
                 assert len(self.rules[key].ref_key) == 2, 'Must provide a reference to the edge_index and the node batch ids'
                 for ref_key in self.rules[key].ref_key:
                     assert ref_key in comb_blob, f'Must provide reference tensor ({ref_key}) to unwrap {key}'
                 ref_edge, ref_node = self.rules[key].ref_key
                 edge_index, batch_ids = comb_blob[ref_edge], comb_blob[ref_node]
-                if not self.rules[key].done and ref_edge not in self.masks:
-                    self.masks[ref_edge] = [self._batch_masks(batch_ids[g][edge_index[g][:,0]]) for g in range(self.num_gpus)]
-                if ref_node not in self.offsets:
-                    self.offsets[ref_node] = [self._batch_offsets(batch_ids[g]) for g in range(self.num_gpus)]
+                if ref_node not in self.index:
+                    self.index[ref_node] = [self._batch_index(batch_ids[g], ref_node, g) for g in range(self.num_gpus)]
+                if not self.rules[key].done and ref_edge not in self.index:
+                    self.index[ref_edge] = [self._batch_index(batch_ids[g][edge_index[g][:,0]], g=g) for g in range(self.num_gpus)]
 
-            # For an index tensor, only need to record the batch offsets within the wrapped tensor
+            # For an index tensor, index the tensor it points at
             elif self.rules[key].method == 'index_tensor':
                 ref_key = self.rules[key].ref_key
                 assert ref_key in comb_blob, f'Must provide reference tensor ({ref_key}) to unwrap {key}'
-                if not self.rules[key].done and ref_key not in self.masks:
-                    self.masks[ref_key] = [self._batch_masks(comb_blob[ref_key][g]) for g in range(self.num_gpus)]
-                if ref_key not in self.offsets:
-                    self.offsets[ref_key] = [self._batch_offsets(comb_blob[ref_key][g]) for g in range(self.num_gpus)]
+                if ref_key not in self.index:
+                    self.index[ref_key] = [self._batch_index(comb_blob[ref_key][g], ref_key, g) for g in range(self.num_gpus)]
 
-            # For lists of tensor indices, only need to record the offsets within the wrapped tensor
+            # For lists of tensor indices, index the list and the tensor it points at
             elif self.rules[key].method == 'index_list':
                 assert len(self.rules[key].ref_key) == 2, 'Must provide a reference to indexed tensor and the index batch ids'
                 for ref_key in self.rules[key].ref_key:
                     assert ref_key in comb_blob, f'Must provide reference tensor ({ref_key}) to unwrap {key}'
                 ref_tensor, ref_index = self.rules[key].ref_key
-                if not self.rules[key].done and ref_index not in self.masks:
-                    self.masks[ref_index] = [self._batch_masks(comb_blob[ref_index][g]) for g in range(self.num_gpus)]
-                if ref_tensor not in self.offsets:
-                    self.offsets[ref_tensor] = [self._batch_offsets(comb_blob[ref_tensor][g]) for g in range(self.num_gpus)]
+                if not self.rules[key].done and ref_index not in self.index:
+                    self.index[ref_index] = [self._batch_index(comb_blob[ref_index][g], ref_index, g) for g in range(self.num_gpus)]
+                if ref_tensor not in self.index:
+                    self.index[ref_tensor] = [self._batch_index(comb_blob[ref_tensor][g], ref_tensor, g) for g in range(self.num_gpus)]
 
-    def _batch_masks(self, tensor):
+    def _batch_sizes(self, data_blob):
         '''
-        Makes a list of masks for each batch entry, for a specific tensor.
+        Finds the number of entries in the minibatch of each GPU. It is
+        given by the `index` list, if provided, as the number of entries
+        in a minibatch may vary (e.g. `VoxelBudgetBatchSampler`).
 
         Parameters
         ----------
-        tensor : np.ndarray
-            Tensor with a batch ID column
+        data_blob : dict
+            Dictionary of array of array of minibatch data [key][num_gpus][batch_size]
 
         Returns
         -------
         list
-            List of batch masks
+            Number of entries in the minibatch of each GPU
         '''
-        # Create batch masks
-        masks = []
-        for b in range(self.batch_size*self.num_volumes):
-            if len(tensor.shape) == 1:
-                masks.append(np.where(tensor == b)[0])
-            else:
-                masks.append(np.where(tensor[:, BATCH_COL] == b)[0])
+        if 'index' in data_blob:
+            return [len(index) for index in data_blob['index']]
+        return [self.batch_size]*self.num_gpus
+
+    def _collate_offsets(self, key, g):
+        '''
+        Fetches the batch offsets of a tensor provided by the collate
+        function (see `CollateSparse`), if available, padded to the
+        number of (virtual) entries in the batch.
+
+        Parameters
+        ----------
+        key : str
+            Name of the tensor
+        g : int
+            GPU index
+
+        Returns
+        -------
+        np.ndarray
+            (B*V+1) Array of batch offsets, `None` if not available
+        '''
+        if key is None or key not in self.batch_offsets[g]:
+            return None
+        offsets = self.batch_offsets[g][key]
+        num_entries = self.batch_sizes[g]*self.num_volumes
+        if len(offsets) < num_entries + 1:
+            padding = np.full(num_entries + 1 - len(offsets), offsets[-1])
+            offsets = np.concatenate([offsets, padding])
 
-        return masks
+        return offsets[:num_entries+1]
 
-    def _batch_offsets(self, tensor):
+    def _batch_index(self, tensor, key=None, g=0):
         '''
-        Computes the index of the first element in a tensor
-        for each entry in the batch.
+        Builds the index of the rows of each (virtual) batch entry
+        in a specific tensor.
 
         Parameters
         ----------
         tensor : np.ndarray
-            Tensor with a batch ID column
+            Tensor with a batch ID column (or 1D array of batch IDs)
+        key : str, optional
+            Name of the tensor, used to fetch the collate batch offsets
+        g : int, default 0
+            GPU index
+
+        Returns
+        -------
+        BatchIndex
+            Index of the rows of each batch entry
+        '''
+        # If the collate function provided offsets, the entries are contiguous ranges
+        offsets = self._collate_offsets(key, g)
+        if offsets is not None:
+            return BatchIndex(bounds=offsets)
+
+        batch_ids = tensor if len(tensor.shape) == 1 else tensor[:, BATCH_COL]
+        return BatchIndex(batch_ids, self.batch_sizes[g]*self.num_volumes)
+
+    def _volume_tensor(self, key, tensor, v):
+        '''
+        Prepares the rows of a tensor which belong to one volume of
+        an entry to be merged with the other volumes.
+
+        Parameters
+        ----------
+        key : str
+            Name of the data product
+        tensor : np.ndarray
+            Rows of the tensor which belong to the volume
+        v : int
+            Volume index
 
         Returns
         -------
         np.ndarray
-            Array of batch offsets
+            Rows of the tensor, with the batch ID set to the volume ID (if
+            it is a reference tensor) and translated coordinates (if requested)
         '''
-        # Compute batch offsets
-        offsets = np.zeros(self.batch_size*self.num_volumes, np.int64)
-        for b in range(1, self.batch_size*self.num_volumes):
-            if len(tensor.shape) == 1:
-                offsets[b] = offsets[b-1] + np.sum(tensor == b-1)
+        rule = self.rules[key]
+        translate = rule.translate and v > 0
+        if key != rule.ref_key and not translate:
+            return tensor
+
+        # Do not modify the (possibly viewed) batched tensor
+        tensor = tensor.copy()
+        if key == rule.ref_key:
+            if len(tensor.shape) == 2:
+                tensor[:, BATCH_COL] = v
             else:
-                offsets[b] = offsets[b-1] + np.sum(tensor[:, BATCH_COL] == b-1)
+                tensor[:] = v
+        if translate:
+            tensor[:, COORD_COLS] = self.merger.translate(tensor[:,COORD_COLS], v)
+
+        return tensor
+
+    @staticmethod
+    def _merge(tensors):
+        '''
+        Merges the tensors of the volumes of an entry (no copy if
+        there is a single volume).
+
+        Parameters
+        ----------
+        tensors : list
+            List of tensors, one per volume
 
-        return offsets
+        Returns
+        -------
+        np.ndarray
+            Merged tensor
+        '''
+        return tensors[0] if len(tensors) == 1 else np.concatenate(tensors)
 
     def _unwrap(self, key, data):
         '''
@@ -229,95 +356,81 @@ class Unwrapper:
         '''
         # Scalars and lists are trivial to unwrap
         if key not in self.rules or self.rules[key].method in [None, 'scalar', 'list']:
-            unwrapped = self._concatenate(data)
-        else:
-            ref_key = self.rules[key].ref_key
-            unwrapped = []
-            for g in range(self.num_gpus):
-                for b in range(self.batch_size):
-                    # Tensor unwrapping
-                    if self.rules[key].method == 'tensor':
-                        tensors = []
-                        for v in range(self.num_volumes):
-                            if not self.rules[key].done:
-                                tensor = data[g][self.masks[ref_key][g][b*self.num_volumes+v]]
-                                if key == ref_key:
-                                    if len(tensor.shape) == 2:
-                                        tensor[:, BATCH_COL] = v
-                                    else:
-                                        tensor[:] = v
-                                if self.rules[key].translate:
-                                    if v > 0:
-                                        tensor[:, COORD_COLS] = self.merger.translate(tensor[:,COORD_COLS], v)
-                                tensors.append(tensor)
-                            else:
-                                tensors.append(data[g][b*self.num_volumes+v])
-                        unwrapped.append(np.concatenate(tensors))
-
-                    # Tensor list unwrapping
-                    elif self.rules[key].method == 'tensor_list':
-                        tensors = []
-                        for i, d in enumerate(data[g]):
-                            subtensors = []
-                            for v in range(self.num_volumes):
-                                subtensor = d[self.masks[ref_key][g][i][b*self.num_volumes+v]]
-                                if key == ref_key:
-                                    if len(subtensor.shape) == 2:
-                                        subtensor[:, BATCH_COL] = v
-                                    else:
-                                        subtensor[:] = v
-                                if self.rules[key].translate:
-                                    if v > 0:
-                                        subtensor[:, COORD_COLS] = self.merger.translate(subtensor[:,COORD_COLS], v)
-                                subtensors.append(subtensor)
-                            tensors.append(np.concatenate(subtensors))
-                        unwrapped.append(tensors)
-
-                    # Edge tensor unwrapping
-                    elif self.rules[key].method == 'edge_tensor':
-                        ref_edge, ref_node = ref_key
-                        tensors = []
-                        for v in range(self.num_volumes):
-                            if not self.rules[key].done:
-                                tensor = data[g][self.masks[ref_edge][g][b*self.num_volumes+v]]
-                                offset = (key == ref_edge) * self.offsets[ref_node][g][b*self.num_volumes]
-                            else:
-                                tensor = data[g][b*self.num_volumes+v]
-                                offset = (key == ref_edge) *\
-                                        (self.offsets[ref_node][g][b*self.num_volumes+v]-self.offsets[ref_node][g][b*self.num_volumes])
-                            tensors.append(tensor + offset)
-                        unwrapped.append(np.concatenate(tensors))
-
-                    # Index tensor unwrapping
-                    elif self.rules[key].method == 'index_tensor':
-                        tensors = []
-                        for v in range(self.num_volumes):
-                            if not self.rules[key].done:
-                                offset = self.offsets[ref_key][g][b*self.num_volumes]
-                                tensors.append(data[self.masks[ref_key][g][b*self.num_volumes+v]] - offset)
-                            else:
-                                offset = self.offsets[ref_key][g][b*self.num_volumes+v]-self.offsets[ref_key][g][b*self.num_volumes]
-                                tensors.append(data[g][b*self.num_volumes+v] + offset)
-
-                        unwrapped.append(np.concatenate(tensors))
-
-                    # Index list unwrapping
-                    elif self.rules[key].method == 'index_list':
-                        ref_tensor, ref_index = ref_key
-                        index_list = []
-                        for v in range(self.num_volumes):
-                            if not self.rules[key].done:
-                                offset = self.offsets[ref_tensor][g][b*self.num_volumes]
-                                for i in self.masks[ref_index][g][b*self.num_volumes+v]:
-                                    index_list.append(data[g][i] - offset)
-                            else:
-                                offset = self.offsets[ref_tensor][g][b*self.num_volumes+v]-self.offsets[ref_tensor][g][b*self.num_volumes]
-                                for index in data[g][b*self.num_volumes+v]:
-                                    index_list.append(index + offset)
-
-                        same_length = np.all([len(c) == len(index_list[0]) for c in index_list])
-                        index_list = np.array(index_list, dtype=object if not same_length else np.int64)
-                        unwrapped.append(index_list)
+            return self._concatenate(data)
+
+        rule = self.rules[key]
+        ref_key = rule.ref_key
+        unwrapped = []
+        for g in range(self.num_gpus):
+            for b in range(self.batch_sizes[g]):
+                # Virtual entries (one per volume) which make up this entry
+                first = b*self.num_volumes
+                entries = range(first, first + self.num_volumes)
+
+                # Tensor unwrapping
+                if rule.method == 'tensor':
+                    if not rule.done:
+                        index = self.index[ref_key][g]
+                        tensors = [self._volume_tensor(key, data[g][index[e]], v) for v, e in enumerate(entries)]
+                    else:
+                        tensors = [data[g][e] for e in entries]
+                    unwrapped.append(self._merge(tensors))
+
+                # Tensor list unwrapping
+                elif rule.method == 'tensor_list':
+                    tensors = []
+                    for i, d in enumerate(data[g]):
+                        index = self.index[ref_key][g][i]
+                        tensors.append(self._merge([self._volume_tensor(key, d[index[e]], v) for v, e in enumerate(entries)]))
+                    unwrapped.append(tensors)
+
+                # Edge tensor unwrapping
+                elif rule.method == 'edge_tensor':
+                    ref_edge, ref_node = ref_key
+                    nodes = self.index[ref_node][g]
+                    tensors = []
+                    for v, e in enumerate(entries):
+                        if not rule.done:
+                            tensor = data[g][self.index[ref_edge][g][e]]
+                            if key == ref_edge:
+                                # Node indices in the batch to node indices in the entry
+                                tensor = nodes.rank(tensor) - nodes.bounds[first]
+                        else:
+                            tensor = data[g][e]
+                            if key == ref_edge:
+                                # Node indices in the volume to node indices in the entry
+                                tensor = tensor + (nodes.bounds[e] - nodes.bounds[first])
+                        tensors.append(tensor)
+                    unwrapped.append(self._merge(tensors))
+
+                # Index tensor unwrapping
+                elif rule.method == 'index_tensor':
+                    index = self.index[ref_key][g]
+                    tensors = []
+                    for v, e in enumerate(entries):
+                        if not rule.done:
+                            tensors.append(index.rank(data[g][index[e]]) - index.bounds[first])
+                        else:
+                            tensors.append(data[g][e] + (index.bounds[e] - index.bounds[first]))
+                    unwrapped.append(self._merge(tensors))
+
+                # Index list unwrapping
+                elif rule.method == 'index_list':
+                    ref_tensor, ref_index = ref_key
+                    index = self.index[ref_tensor][g]
+                    index_list = []
+                    for v, e in enumerate(entries):
+                        if not rule.done:
+                            for i in self.index[ref_index][g].indices(e):
+                                index_list.append(index.rank(data[g][i]) - index.bounds[first])
+                        else:
+                            offset = index.bounds[e] - index.bounds[first]
+                            for idx in data[g][e]:
+                                index_list.append(idx + offset)
+
+                    same_length = np.all([len(c) == len(index_list[0]) for c in index_list])
+                    index_list = np.array(index_list, dtype=object if not same_length else np.int64)
+                    unwrapped.append(index_list)
 
         return unwrapped
 
@@ -334,8 +447,8 @@ class Unwrapper:
         '''
         if isinstance(data[0], (int, float)):
             if len(data) == 1:
-                return [data[g] for g in range(self.num_gpus) for i in range(self.batch_size)]
-            elif len(data) == self.batch_count:
+                return [data[g] for g in range(self.num_gpus) for i in range(self.batch_sizes[g])]
+            elif len(data) == sum(self.batch_sizes):
                 return data
             else:
                 raise ValueError('Only accept scalar arrays of size 1 or batch_size: '+\
@@ -351,6 +464,153 @@ class Unwrapper:
             raise TypeError('Unexpected data type', type(data[0]))
 
 
+class BatchIndex:
+    '''
+    Index of the rows which belong to each (virtual) batch entry of a
+    batched tensor, built by sorting its batch IDs once.
+
+    If the rows are ordered by batch ID (as they are when they come out
+    of the collate function), the rows of an entry are a slice of the
+    tensor, so that selecting them makes a view of the tensor rather
+    than a copy. Otherwise they are a range of the sorting permutation.
+    '''
+
+    def __init__(self, batch_ids=None, num_entries=None, bounds=None):
+        '''
+        Sort the batch IDs, find the bounds of each entry.
+
+        Parameters
+        ----------
+        batch_ids : np.ndarray, optional
+            (N) Batch ID of each row of the tensor
+        num_entries : int, optional
+            Number of (virtual) batch entries
+        bounds : np.ndarray, optional
+            (B+1) Offsets of the batch entries in a tensor ordered by
+            batch ID, if they are already known
+        '''
+        self.order = None
+        if bounds is None:
+            batch_ids = np.asarray(batch_ids)
+            if len(batch_ids) and np.any(batch_ids[1:] < batch_ids[:-1]):
+                self.order = np.argsort(batch_ids, kind='stable')
+                batch_ids = batch_ids[self.order]
+            bounds = np.searchsorted(batch_ids, np.arange(num_entries+1), side='left')
+
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self._inverse = None
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def __getitem__(self, entry):
+        '''
+        Rows of a batch entry, to index the batched tensor with.
+
+        Parameters
+        ----------
+        entry : int
+            Batch entry ID
+
+        Returns
+        -------
+        Union[slice, np.ndarray]
+            Slice of the tensor (or array of row indices if it is not
+            ordered by batch ID)
+        '''
+        start, end = self.bounds[entry], self.bounds[entry+1]
+        if self.order is None:
+            return slice(start, end)
+        return self.order[start:end]
+
+    def indices(self, entry):
+        '''
+        Row indices of a batch entry.
+
+        Parameters
+        ----------
+        entry : int
+            Batch entry ID
+
+        Returns
+        -------
+        np.ndarray
+            Array of row indices
+        '''
+        if self.order is None:
+            return np.arange(self.bounds[entry], self.bounds[entry+1])
+        return self[entry]
+
+    def rank(self, rows):
+        '''
+        Position of rows of the batched tensor once it is ordered by
+        batch ID. Subtracting the first bound of an entry converts row
+        indices in the batch to row indices in the entry.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            Row indices in the batched tensor
+
+        Returns
+        -------
+        np.ndarray
+            Row indices in the ordered tensor
+        '''
+        if self.order is None:
+            return rows
+        if self._inverse is None:
+            self._inverse = np.empty(len(self.order), dtype=np.int64)
+            self._inverse[self.order] = np.arange(len(self.order))
+        return self._inverse[np.asarray(rows, dtype=np.int64)]
+
+
+class UnwrappedBlob(MutableMapping):
+    '''
+    Dictionary of unwrapped data products. Each product is unwrapped the
+    first time it is accessed, so that the products which are never used
+    downstream are never unwrapped. It is pickled as a regular dictionary.
+    '''
+
+    def __init__(self, pending):
+        '''
+        Initialize the dictionary.
+
+        Parameters
+        ----------
+        pending : dict
+            Dictionary which maps each key to a function which unwraps it
+        '''
+        self._data = dict(pending)
+        self._pending = set(pending.keys())
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            self._data[key] = self._data[key]()
+            self._pending.remove(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        self._pending.discard(key)
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'UnwrappedBlob(keys={list(self._data.keys())}, pending={len(self._pending)})'
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+
 def prefix_unwrapper_rules(rules, prefix):
     '''
     Modifies the default rules of a module to account for
@@ -381,3 +641,35 @@ def prefix_unwrapper_rules(rules, prefix):
                     prules[pkey][1][i] = f'{prefix}_{value[1][i]}'
 
     return prules
+
+
+def select_unwrapper_rules(rules, keys):
+    '''
+    Selects the rules needed to unwrap a set of outputs, i.e. the
+    rules of the outputs themselves and of the outputs they refer to
+    for their batch mapping (recursively).
+
+    Parameters
+    ----------
+    rules : dict
+        Dictionary which contains a set of unwrapping rules for each
+        output key of the reconstruction chain.
+    keys : list
+        List of requested output names
+
+    Returns
+    -------
+    dict
+        Dictionary of the rules of the requested outputs and their references
+    '''
+    srules, todo = {}, list(keys)
+    while len(todo):
+        key = todo.pop()
+        if key in srules or key not in rules:
+            continue
+        srules[key] = rules[key]
+        if len(rules[key]) > 1 and rules[key][1] is not None:
+            refs = rules[key][1]
+            todo.extend([refs] if isinstance(refs, str) else refs)
+
+    return srules
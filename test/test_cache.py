@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def dataset_files(tmp_path):
+    """
+    Dummy files used to compute the cache key.
+    """
+    files = []
+    for i in range(2):
+        path = tmp_path / f'dummy_{i}.root'
+        path.write_bytes(b'0' * (i + 1))
+        files.append(str(path))
+    return files
+
+
+def test_parser_cache(tmp_path, dataset_files):
+    """
+    Tests that parser outputs are cached and read back identically.
+    """
+    from mlreco.iotools.cache import ParserCache
+
+    schema = {'input_data': {'parser': 'parse_sparse3d', 'args': {'sparse_event_list': ['sparse3d_pcluster']}}}
+    cache = ParserCache(dataset_files, schema, path=str(tmp_path / 'cache'))
+
+    events = {}
+    for entry in range(5):
+        num_points = np.random.randint(low=0, high=100)
+        events[entry] = {
+            'input_data': (np.random.randint(0, 100, size=(num_points, 3)).astype(np.int32),
+                           np.random.uniform(size=(num_points, 2)).astype(np.float32)),
+            'ghost_label': np.random.uniform(size=num_points),
+            'particles': [object() for _ in range(3)]
+        }
+        assert not len(cache.load(entry))
+        cache.store(entry, events[entry])
+
+    # A new cache instance (e.g. another process) must find the same events
+    other = ParserCache(dataset_files, schema, path=str(tmp_path / 'cache'))
+    assert other.path == cache.path
+    for entry, event in events.items():
+        result = other.load(entry)
+        assert 'particles' not in result
+        assert isinstance(result['input_data'], tuple)
+        for a, b in zip(result['input_data'], event['input_data']):
+            assert a.dtype == b.dtype and np.array_equal(a, b)
+        assert np.array_equal(result['ghost_label'], event['ghost_label'])
+
+    # Changing the schema must invalidate the cache
+    schema['input_data']['args']['sparse_event_list'].append('sparse3d_reco')
+    other = ParserCache(dataset_files, schema, path=str(tmp_path / 'cache'))
+    assert other.path != cache.path
+    assert not len(other.load(0))
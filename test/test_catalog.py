@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+
+
+def test_dataset_catalog(tmp_path):
+    """
+    Tests that the catalog counts entries and only rescans modified files.
+    """
+    h5py = pytest.importorskip('h5py')
+    from mlreco.iotools.catalog import DatasetCatalog
+
+    files = []
+    for i in range(3):
+        path = str(tmp_path / f'dummy_{i}.h5')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('events', data=np.arange(i + 1))
+            f.create_group('data')
+        files.append(path)
+
+    catalog_path = str(tmp_path / 'catalog.json')
+    catalog = DatasetCatalog(catalog_path, num_workers=2)
+    assert np.array_equal(catalog.entries(files, 'events'), [1, 2, 3])
+    assert os.path.isfile(catalog_path)
+    assert all(['data' in keys for keys in catalog.keys(files)])
+
+    # Modify one file, check that only this one is stale
+    with h5py.File(files[0], 'a') as f:
+        del f['events']
+        f.create_dataset('events', data=np.arange(5))
+    os.utime(files[0], (0, 0))
+    catalog = DatasetCatalog(catalog_path)
+    assert [catalog.is_stale(os.path.abspath(f)) for f in files] == [True, False, False]
+    assert np.array_equal(catalog.entries(files, 'events'), [5, 2, 3])
+
+
+@pytest.mark.parametrize("ext, truncate", [('.h5', False), ('.h5', True), ('.root', False)])
+def test_dataset_catalog_bad_file(tmp_path, ext, truncate):
+    """
+    Tests that a file which cannot be opened is recorded without entries
+    (instead of aborting the scan of the other files) and that counting
+    its entries fails.
+    """
+    h5py = pytest.importorskip('h5py')
+    if ext == '.root':
+        pytest.importorskip('ROOT')
+    from mlreco.iotools.catalog import DatasetCatalog
+
+    good_path, bad_path = str(tmp_path / 'good.h5'), str(tmp_path / f'bad{ext}')
+    with h5py.File(good_path, 'w') as f:
+        f.create_dataset('events', data=np.arange(3))
+    with open(bad_path, 'wb') as f:
+        if truncate:
+            with open(good_path, 'rb') as g:
+                f.write(g.read()[:512])
+        else:
+            f.write(b'\x00garbage' * 16)
+
+    catalog = DatasetCatalog(num_workers=2)
+    records = catalog.update([good_path, bad_path])
+    assert records[0]['entries'] == {'events': 3}
+    assert records[1]['entries'] == {}
+    with pytest.raises(AssertionError):
+        catalog.entries([bad_path], 'events')
@@ -27,3 +27,16 @@ def test_collate_sparse(batch):
     result = CollateSparse(batch)
 
     assert len(result) == num_products
+
+
+def test_collate_sparse_offsets(batch):
+    from mlreco.iotools.collates import CollateSparse
+    result = CollateSparse(batch, batch_offsets=True)
+    offsets = result.pop('batch_offsets')
+
+    assert len(result) == len(batch[0])
+    for key, value in result.items():
+        assert len(offsets[key]) == len(batch) + 1
+        assert offsets[key][-1] == len(value)
+        for b in range(len(batch)):
+            assert np.all(value[offsets[key][b]:offsets[key][b+1], 0] == b)
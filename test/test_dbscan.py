@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("metric", ['euclidean', 'chebyshev', 'manhattan'])
+@pytest.mark.parametrize("eps", [1.1, 1.999, 2.5])
+@pytest.mark.parametrize("min_samples", [1, 4])
+def test_lattice_dbscan(metric, eps, min_samples, num_voxels=500):
+    """
+    Tests that the lattice DBSCAN labels of each group are identical
+    to those of sklearn's DBSCAN run on that group alone.
+    """
+    from sklearn.cluster import DBSCAN
+    from mlreco.utils.dbscan import lattice_dbscan
+    rng = np.random.default_rng(seed=0)
+    voxels = rng.integers(-5, 10, size=(num_voxels, 3)).astype(np.float32)
+    groups = rng.integers(0, 4, size=num_voxels)
+
+    labels = lattice_dbscan(voxels, groups, eps=eps, min_samples=min_samples, metric=metric)
+    for g in np.unique(groups):
+        index = np.where(groups == g)[0]
+        dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric=metric)
+        assert np.array_equal(labels[index], dbscan.fit(voxels[index]).labels_)
+
+
+@pytest.mark.parametrize("metric", ['euclidean', 'chebyshev', 'sqeuclidean'])
+def test_radius_graph(metric, num_voxels=300):
+    """
+    Tests that the sparse radius graph is identical to the thresholded
+    dense distance matrix used by the closest-path track clustering.
+    """
+    from scipy.spatial.distance import cdist
+    from mlreco.utils.track_clustering import radius_graph
+    rng = np.random.default_rng(seed=0)
+    voxels = rng.integers(0, 8, size=(num_voxels, 3)).astype(np.float32)
+
+    graph = radius_graph(voxels, 1.999, metric)
+    dist_mat = cdist(voxels, voxels, metric=metric)
+    assert np.array_equal(graph.toarray(), dist_mat * (dist_mat < 1.999))
+
+
+def closest_path_dense(voxels, points, eps, min_samples, metric):
+    """
+    Previous closest-path track clustering, which runs the all-pairs
+    shortest path solver on the dense thresholded distance matrix.
+    """
+    import scipy.sparse.csgraph
+    from scipy.spatial.distance import cdist
+    from sklearn.cluster import DBSCAN
+    pair_mat = cdist(voxels, points, metric=metric)
+    labels   = DBSCAN(eps=eps, min_samples=min_samples, metric=metric).fit(voxels).labels_
+    for l in np.unique(labels):
+        group_mask  = labels == l
+        point_mask  = np.min(pair_mat[group_mask], axis=0) < eps
+        point_ids   = np.unique(np.argmin(pair_mat[np.ix_(group_mask, point_mask)], axis=0))
+        if len(point_ids) > 2:
+            dist_mat  = cdist(voxels[group_mask], voxels[group_mask], metric=metric)
+            graph     = dist_mat * (dist_mat < eps)
+            cs_graph  = scipy.sparse.csr_matrix(graph)
+
+            graph_mat, predecessors = scipy.sparse.csgraph.shortest_path(csgraph=cs_graph, directed=False, return_predecessors=True)
+            break_ix  = np.ix_(point_ids, point_ids)
+            chord_mat = dist_mat[break_ix]
+            mst_mat   = scipy.sparse.csgraph.minimum_spanning_tree(graph_mat[break_ix]-chord_mat+1e-6).toarray()
+            mst_edges = np.vstack(np.where(mst_mat > 0)).T
+
+            paths = [[] for _ in range(len(mst_edges))]
+            for i, e in enumerate(mst_edges):
+                k, l = point_ids[e]
+                paths[i].append(l)
+                while l != k:
+                    l = predecessors[k,l]
+                    paths[i].append(l)
+
+            mindists  = np.vstack([np.min(graph_mat[:,p],axis=1) for p in paths])
+            mst_tort  = mst_mat[mst_mat > 0]/chord_mat[mst_mat > 0]
+            tort_ord  = np.argsort(-mst_tort)
+            least_r   = np.max(np.min(mindists, axis=0))
+            path_mask = np.ones(len(mst_tort), dtype=bool)
+            for i in range(len(mst_tort)):
+                if np.sum(path_mask) == 1: break
+                path_mask[tort_ord[i]] = False
+                reach = np.max(np.min(mindists[path_mask], axis=0))
+                if reach > least_r:
+                    path_mask[tort_ord[i]] = True
+
+            mindists  = np.vstack([np.min(graph_mat[:,p[min(1,len(p)-2):max(len(p)-1,2)]],axis=1) for i, p in enumerate(paths) if path_mask[i]])
+            sublabels = np.argmin(mindists, axis=0)
+            labels[group_mask] = max(labels)+1+sublabels
+
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def kinked_track(num_kinks, length, seed):
+    """
+    Voxelized polyline of a given length with randomly oriented segments,
+    returned with its vertices (track ends and kinks).
+    """
+    rng = np.random.default_rng(seed)
+    vertices = np.cumsum(np.vstack([np.zeros(3), rng.normal(size=(num_kinks+1, 3))]), axis=0)
+    vertices *= length/np.sum(np.linalg.norm(np.diff(vertices, axis=0), axis=1))
+    steps = [a + np.linspace(0, 1, 10*int(np.ceil(np.linalg.norm(b-a))+1))[:,None]*(b-a) for a, b in zip(vertices[:-1], vertices[1:])]
+    return np.unique(np.round(np.vstack(steps)), axis=0), vertices
+
+
+@pytest.mark.parametrize("length, eps, dense", [(150, 1.999, False), (200, 1.5, False), (12, 10., True)])
+@pytest.mark.parametrize("seed", range(5))
+def test_closest_path(length, eps, dense, seed, num_kinks=4):
+    """
+    Tests that the closest-path track clustering labels are identical to
+    those of the previous dense implementation, both when the shortest
+    paths come from Dijkstra (sparse graph) and Floyd-Warshall (dense).
+    """
+    from mlreco.utils.track_clustering import track_clustering, radius_graph
+    voxels, points = kinked_track(num_kinks, length, seed)
+    graph = radius_graph(voxels, eps)
+    assert (graph.nnz >= len(voxels)**2/4) == dense
+
+    labels = track_clustering(voxels, points, method='closest_path', eps=eps, min_samples=1, metric='euclidean')
+    assert len(np.unique(labels)) > 1
+    assert np.array_equal(labels, closest_path_dense(voxels, points, eps, 1, 'euclidean'))
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import torch
+
+
+def random_clusters(num_clusts=100, seed=0):
+    """
+    Random walk clusters of points (with some single point clusters),
+    stored as [batch_id, x, y, z, value, semantic type].
+    """
+    rng = np.random.default_rng(seed=seed)
+    points, clusts, offset = [], [], 0
+    for c in range(num_clusts):
+        size = rng.integers(1, 40) if c % 5 else 1
+        start = rng.uniform(0, 100, size=3)
+        points.append(start + np.cumsum(rng.uniform(-1, 1, size=(size, 3)), axis=0))
+        clusts.append(np.arange(offset, offset+size))
+        offset += size
+    points = np.vstack(points)
+    values = rng.uniform(0, 1, size=(offset, 1))
+    types = rng.integers(0, 5, size=(offset, 1))
+    data = np.hstack((np.zeros((offset, 1)), points, values, types))
+
+    return torch.tensor(data, dtype=torch.float32), clusts
+
+
+@pytest.mark.parametrize("more_feats", [False, True])
+def test_clust_geo_node_encoder(more_feats):
+    """
+    Tests that the batched torch geometric node features match those
+    computed one cluster at a time.
+    """
+    pytest.importorskip('torch_scatter')
+    from mlreco.models.layers.gnn.encoders.geometric import ClustGeoNodeEncoder
+    data, clusts = random_clusters()
+    encoder = ClustGeoNodeEncoder({'use_numpy': False, 'more_feats': more_feats})
+    feats = encoder(data, clusts).numpy()
+    assert feats.shape == (len(clusts), 19 if more_feats else 16)
+
+    for c, f in zip(clusts, feats):
+        x = data[c, 1:4].numpy().astype(np.float64)
+        assert np.allclose(f[:3], x.mean(axis=0), atol=1e-4)
+        assert f[15] == len(c)
+        if len(c) > 1:
+            x = x - x.mean(axis=0)
+            A = x.T @ x
+            w, v = np.linalg.eigh(A)
+            x0 = x @ v[:,2]
+            sc = np.dot(x0, np.linalg.norm(x - np.outer(x0, v[:,2]), axis=1))
+            v0 = (1 - w[1]/w[2]) * v[:,2]
+            assert np.allclose(f[3:12], (A/w[2]).flatten(), atol=1e-4)
+            if abs(sc) > 1e-3:
+                assert np.allclose(f[12:15], np.sign(sc) * v0, atol=1e-4)
+            else: # No spread around the axis, the orientation is arbitrary
+                assert np.allclose(np.abs(f[12:15]), np.abs(v0), atol=1e-4)
+        else:
+            assert not np.any(f[3:15])
+        if more_feats:
+            values, types = data[c, 4].numpy(), data[c, 5].numpy().astype(int)
+            assert np.isclose(f[16], values.mean(), atol=1e-5)
+            assert np.isclose(f[17], values.std(ddof=1) if len(c) > 1 else 0., atol=1e-5)
+            assert f[18] == np.argmax(np.bincount(types))
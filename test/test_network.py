@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+
+def random_clusters(num_clusts=60, num_batches=2, seed=0):
+    """
+    Random walk clusters of voxels, split between batch entries.
+    """
+    rng = np.random.default_rng(seed=seed)
+    voxels, clusts, offset = [], [], 0
+    for c in range(num_clusts):
+        size = rng.integers(2, 40)
+        start = rng.integers(0, 80, size=3)
+        voxels.append(start + np.cumsum(rng.integers(-1, 2, size=(size, 3)), axis=0))
+        clusts.append(np.arange(offset, offset+size))
+        offset += size
+    batch_ids = rng.integers(0, num_batches, size=num_clusts)
+
+    return np.vstack(voxels).astype(np.float32), clusts, batch_ids
+
+
+@pytest.mark.parametrize("max_dist", [None, 6.])
+def test_inter_cluster_distance_kdtree(max_dist):
+    """
+    Tests that the KD-tree inter-cluster distances are identical to the brute
+    force ones (below max_dist) and that the closest voxel pair of each edge
+    is consistent with its orientation.
+    """
+    from mlreco.utils.gnn.network import inter_cluster_distance
+    voxels, clusts, batch_ids = random_clusters()
+    dist_mat, _ = inter_cluster_distance(voxels, clusts, batch_ids, return_index=True)
+    kd_mat, kd_index = inter_cluster_distance(voxels, clusts, batch_ids, algorithm='kdtree', return_index=True, max_dist=max_dist)
+    mask = dist_mat < (max_dist if max_dist is not None else np.inf)
+    assert np.array_equal(kd_mat[mask], dist_mat[mask])
+    assert np.all(kd_mat[~mask] >= max_dist)
+
+    if max_dist is not None:
+        edges, dists, index = inter_cluster_distance(voxels, clusts, batch_ids, algorithm='kdtree', return_index=True, max_dist=max_dist, sparse=True)
+        assert np.array_equal(dists, dist_mat[edges[0], edges[1]])
+        for (i, j), d, k in zip(edges.T, dists, index):
+            vi, vj = voxels[clusts[i][k//len(clusts[j])]], voxels[clusts[j][k%len(clusts[j])]]
+            assert np.isclose(np.linalg.norm(vi-vj), d)
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_graphs(directed, k=5):
+    """
+    Tests that the preallocated graph constructors match the reference
+    implementations, that the sparse kNN/MST constructors match the dense
+    ones given complete candidates and that the Gabriel graph is consistent.
+    """
+    from scipy.sparse.csgraph import minimum_spanning_tree
+    from mlreco.utils.gnn.network import complete_graph, knn_graph, mst_graph, \
+            bipartite_graph, knn_graph_sparse, mst_graph_sparse, skeleton_graph, \
+            inter_cluster_distance
+    voxels, clusts, batch_ids = random_clusters()
+    dist_mat = inter_cluster_distance(voxels, clusts, batch_ids)
+
+    # kNN graph, compared with sorting the distances of each node
+    ref = []
+    for b in np.unique(batch_ids):
+        clust_ids = np.where(batch_ids == b)[0]
+        for i in clust_ids:
+            idxs = np.sort(np.argsort(dist_mat[i, clust_ids], kind='stable')[1:k+1])
+            ref += [[i, clust_ids[j]] for j in idxs]
+    ref = np.array(ref).T
+    knn = knn_graph(batch_ids, k, dist_mat, directed)
+    assert np.array_equal(knn, ref if directed else np.hstack((ref, ref[::-1])))
+
+    # MST, compared with scipy's MST of each batch
+    ref = []
+    for b in np.unique(batch_ids):
+        clust_ids = np.where(batch_ids == b)[0]
+        mst = minimum_spanning_tree(np.triu(dist_mat[np.ix_(clust_ids, clust_ids)])).toarray()
+        ref.append(clust_ids[np.vstack(np.where(mst > 0))])
+    ref = np.hstack(ref)
+    mst = mst_graph(batch_ids, dist_mat, directed)
+    assert np.array_equal(mst, ref if directed else np.hstack((ref, ref[::-1])))
+
+    # Sparse constructors, given the complete graph as candidates
+    edges = complete_graph(batch_ids)
+    dists = dist_mat[edges[0], edges[1]]
+    assert np.array_equal(mst_graph_sparse(batch_ids, edges, dists, directed), mst)
+    sparse_knn = knn_graph_sparse(batch_ids, k, edges, dists, directed)
+    assert np.array_equal(np.sort(dist_mat[sparse_knn[0], sparse_knn[1]]), np.sort(dist_mat[knn[0], knn[1]]))
+
+    # Bipartite graph, primaries first then secondaries of the same batch
+    primaries = np.arange(len(batch_ids)) % 3 == 0
+    ref = np.array([[i, j] for i in np.where(primaries)[0] for j in np.where(~primaries)[0] if batch_ids[i] == batch_ids[j]]).T
+    bip = bipartite_graph(batch_ids, primaries, directed)
+    assert np.array_equal(bip, ref if directed else np.hstack((ref, ref[::-1])))
+
+    # Gabriel graph: contains the MST, radius-limited version is a subset
+    gabriel = skeleton_graph(voxels, clusts, batch_ids, directed=directed)
+    gabriel_set = set(map(tuple, gabriel.T))
+    assert set(map(tuple, mst.T)) <= gabriel_set
+    limited = skeleton_graph(voxels, clusts, batch_ids, max_dist=6., directed=directed)
+    assert set(map(tuple, limited.T)) <= gabriel_set
+    assert np.all(dist_mat[limited[0], limited[1]] < 6.)
@@ -186,6 +186,20 @@ def test_parse_tensor3d(event_tensor3d, N):
     assert output.shape[3] == len(event_tensor3d)
 
 
+def test_parse_sparse3d_memo(event_tensor3d):
+    from mlreco.iotools.parsers import parse_sparse3d
+    from mlreco.iotools.parsers.memo import EventMemo
+    memo = EventMemo()
+    with memo.event():
+        output = parse_sparse3d(event_tensor3d)
+        output_memo = parse_sparse3d(sparse_event_list=event_tensor3d)
+    assert memo.parser_stats['parse_sparse3d']['calls'] == 2
+    assert memo.parser_stats['parse_sparse3d']['hits'] == 1
+    for a, b in zip(output, output_memo):
+        assert np.array_equal(a, b)
+        assert a is not b
+
+
 @pytest.mark.parametrize("event_tensor3d", [1], indirect=True)
 def test_parse_particle_points(event_tensor3d, event_particles):
     from mlreco.iotools.parsers import parse_particle_points
@@ -221,6 +235,23 @@ def test_parse_cluster3d(event_cluster3d):
     assert output[0].shape[0] == output[1].shape[0]
 
 
+def test_parse_cluster3d_break(event_cluster3d):
+    from sklearn.cluster import DBSCAN
+    from mlreco.iotools.parsers import parse_cluster3d
+    voxels, features = parse_cluster3d([event_cluster3d])
+    _, break_features = parse_cluster3d([event_cluster3d], break_clusters=True)
+    assert break_features.shape == features.shape
+
+    # Fragment IDs must match a per-cluster DBSCAN, offset cluster by cluster
+    id_offset = 0
+    for c in np.unique(features[:, 1]):
+        index = np.where(features[:, 1] == c)[0]
+        dbscan = DBSCAN(eps=1.1, min_samples=1, metric='chebyshev')
+        frag_labels = np.unique(dbscan.fit(voxels[index]).labels_, return_inverse=True)[-1]
+        assert np.array_equal(break_features[index, 1], id_offset + frag_labels)
+        id_offset += max(frag_labels) + 1
+
+
 # TODO in larcv add a function to generate EventSparseTensor3D from EventClusterVoxel3D
 # Otherwise rounding errors when converting through numpy cause voxels to disappear in parse_cluster3d_full
 
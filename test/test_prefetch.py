@@ -0,0 +1,42 @@
+import time
+import pytest
+
+
+def slow_iterator(num_batches, delay=0.01, fail_at=None):
+    """
+    Iterator which takes some time to produce each batch.
+    """
+    for i in range(num_batches):
+        time.sleep(delay)
+        if i == fail_at:
+            raise ValueError('Corrupted batch')
+        yield i
+
+
+@pytest.mark.parametrize("depth", [1, 3])
+def test_batch_prefetcher(depth):
+    """
+    Tests that the prefetched batches come in order, that the end of the
+    iterator and errors are propagated, and that a new iterator restarts
+    the prefetching.
+    """
+    from mlreco.iotools.prefetch import BatchPrefetcher
+    prefetcher = BatchPrefetcher(lambda it: 2*next(it), depth=depth)
+
+    data_iter = slow_iterator(5)
+    for i in range(5):
+        batch, duration = prefetcher.get(data_iter)
+        assert batch == 2*i
+        assert duration > 0.
+    with pytest.raises(StopIteration):
+        prefetcher.get(data_iter)
+
+    data_iter = slow_iterator(5, fail_at=2)
+    assert prefetcher.get(data_iter)[0] == 0
+    assert prefetcher.get(data_iter)[0] == 2
+    with pytest.raises(ValueError):
+        prefetcher.get(data_iter)
+
+    data_iter = slow_iterator(5)
+    assert prefetcher.get(data_iter)[0] == 0
+    prefetcher.stop()
@@ -31,3 +31,57 @@ def test_sampler(data_size, minibatch_size):
     print('...max reuse:', used2.max(), 'for', used2.argmax())
     print('...average:', used3[np.where(used > 0)].mean())
     return True
+
+
+@pytest.mark.parametrize("num_workers,block_size,window", [(1, -1, 1), (3, 5, 2), (8, 10, 1)])
+def test_locality_sampler(num_workers, block_size, window, minibatch_size=4):
+    """
+    Tests that LocalityBatchSampler keeps each file within a single worker
+    and reduces the number of file switches w.r.t. random sampling.
+    """
+    from mlreco.iotools.samplers import LocalityBatchSampler, count_switches
+    import numpy as np
+
+    file_ids = np.repeat(np.arange(6), [20, 35, 12, 40, 8, 25])
+    s = LocalityBatchSampler(file_ids, minibatch_size, num_workers, block_size, window, seed=0)
+    indices = np.array(list(s))
+    assert len(indices) == len(s)
+    assert len(np.unique(indices)) == len(file_ids)
+
+    # If there are enough files, each worker owns its files, otherwise its entries
+    batches = indices.reshape(-1, minibatch_size)
+    labels = file_ids if num_workers <= np.max(file_ids) + 1 else np.arange(len(file_ids))
+    for w in range(num_workers):
+        worker_labels = np.unique(labels[batches[w::num_workers]])
+        for other in range(num_workers):
+            if other != w:
+                assert not np.isin(worker_labels, labels[batches[other::num_workers]]).any()
+
+    random_indices = np.random.permutation(len(file_ids))
+    random_counts = count_switches(random_indices, file_ids, minibatch_size, num_workers)
+    assert s.switch_counts['file_switches'] < random_counts['file_switches']
+
+
+@pytest.mark.parametrize("sort,max_events", [(False, -1), (False, 8), (True, -1)])
+def test_voxel_budget_sampler(sort, max_events, voxel_budget=5000):
+    """
+    Tests that VoxelBudgetBatchSampler covers each entry exactly once
+    per epoch and respects the voxel budget.
+    """
+    from mlreco.iotools.samplers import VoxelBudgetBatchSampler
+    import numpy as np
+
+    sizes = np.random.randint(low=10, high=2000, size=500)
+    sizes[:3] = 2*voxel_budget # Events larger than the budget
+    s = VoxelBudgetBatchSampler(sizes, voxel_budget, max_events=max_events, bucket_size=50, sort=sort, seed=0)
+    for epoch in range(2):
+        num_batches = len(s)
+        batches = list(s)
+        assert len(batches) == num_batches
+        indices = np.concatenate(batches)
+        assert np.array_equal(np.sort(indices), np.arange(len(sizes)))
+        for b in batches:
+            assert len(b) == 1 or np.sum(sizes[b]) <= voxel_budget
+            assert max_events < 1 or len(b) <= max_events
+        if sort:
+            assert np.all(np.diff(sizes[indices]) <= 0)
@@ -0,0 +1,50 @@
+import gc
+import numpy as np
+import pytest
+
+
+class DummyDataset:
+    """
+    Dataset of sparse events of random sizes.
+    """
+    def __len__(self):
+        return 32
+
+    def __getitem__(self, idx):
+        rng = np.random.default_rng(idx)
+        num_points = rng.integers(low=0, high=500)
+        return {'input_data': (rng.integers(0, 100, size=(num_points, 3)).astype(np.int32),
+                               rng.uniform(size=(num_points, 2)).astype(np.float32)),
+                'index': idx}
+
+
+def collate(batch):
+    """
+    Minimal sparse collate with a batch column and a non-array key.
+    """
+    voxels = [np.hstack([np.full((len(s['input_data'][0]), 1), b), *s['input_data']]) for b, s in enumerate(batch)]
+    return {'input_data': np.vstack(voxels), 'index': [s['index'] for s in batch]}
+
+
+@pytest.mark.parametrize("dtype", [None, 'float32'])
+def test_shared_memory_transport(dtype):
+    """
+    Tests that batches received through shared memory match the
+    collated batches and that the segments are recycled.
+    """
+    from torch.utils.data import DataLoader
+    from mlreco.iotools.transport import SharedMemoryTransport
+
+    transport = SharedMemoryTransport(collate, num_workers=2, pool_size=2, dtype=dtype)
+    loader = DataLoader(DummyDataset(), batch_size=4, num_workers=2, collate_fn=transport)
+    for i, batch in enumerate(loader):
+        expected = collate([DummyDataset()[j] for j in range(4*i, 4*(i+1))])
+        assert list(batch.keys()) == list(expected.keys())
+        assert batch['index'] == expected['index']
+        if dtype is not None:
+            assert batch['input_data'].dtype == np.dtype(dtype)
+        assert np.array_equal(batch['input_data'], expected['input_data'].astype(batch['input_data'].dtype))
+
+    del batch
+    gc.collect()
+    assert not any(transport.busy)
@@ -56,6 +56,103 @@ def test_unwrap_scn(dim, num_device=4, minibatch_size=8):
     assert(len(data_blob['x']) == len(outputs['y']))
     assert(data_blob['x'][0].mean() == outputs['y'][0].mean())
 
+def test_select_unwrapper_rules():
+    """
+    Tests that the rules of the requested outputs come with the rules
+    of the outputs they refer to, and only those.
+    """
+    from mlreco.utils.unwrap import select_unwrapper_rules
+    rules = {
+        'segmentation': ['tensor', 'input_data'],
+        'fragment_clusts': ['index_list', ['input_rescaled', 'fragment_batch_ids'], True],
+        'fragment_batch_ids': ['tensor'],
+        'input_rescaled': ['tensor', 'input_rescaled', False, True],
+        'edge_index': ['edge_tensor', ['edge_index', 'coordinates']],
+        'coordinates': ['tensor'],
+        'loss': ['scalar']
+    }
+    selected = select_unwrapper_rules(rules, ['fragment_clusts', 'loss', 'unknown'])
+    assert set(selected.keys()) == {'fragment_clusts', 'fragment_batch_ids', 'input_rescaled', 'loss'}
+    assert selected['fragment_clusts'] == rules['fragment_clusts']
+
+
+@pytest.mark.parametrize("training", [True, False])
+def test_trainval_unwrapper_rules(training):
+    """
+    Tests that the unwrapper of trainval only restricts the output rules
+    to the requested outputs when the model actually prunes its outputs,
+    i.e. not in training, where the model returns all of them.
+    """
+    import torch
+    from mlreco.trainval import trainval
+    from mlreco.iotools.data_parallel import DataParallel
+
+    class Model(torch.nn.Module):
+        RETURNS = {
+            'segmentation': ['tensor', 'input_data'],
+            'fragment_clusts': ['index_list', ['input_data', 'fragment_batch_ids'], True],
+            'fragment_batch_ids': ['tensor'],
+            'fragment_seg': ['tensor', 'fragment_batch_ids', True]
+        }
+        requested_outputs = ['fragment_clusts']
+
+        @property
+        def pruning(self):
+            return self.requested_outputs is not None and not self.training
+
+    trainer = trainval.__new__(trainval)
+    trainer._iotool_config = {'dataset': {'schema': {'input_data': {'parser': 'parse_sparse3d'}}}}
+    trainer._net = DataParallel(Model().train(training), device_ids=[])
+    trainer._criterion = None
+    trainer._gpus, trainer._batch_size, trainer._boundaries = [], 2, None
+
+    rules = trainer.make_unwrapper().rules
+    expected = set(Model.RETURNS) if training else {'fragment_clusts', 'fragment_batch_ids'}
+    assert set(rules) == expected | {'input_data'}
+
+
+@pytest.mark.parametrize("boundaries", [None, [[5.], None, None]])
+def test_unwrapper_batch_index(boundaries, batch_size=3):
+    """
+    Tests that tensors with unsorted batch IDs are unwrapped entry by entry,
+    that node indices of edges are made local to each entry (including when
+    merging volumes), and that keys are only unwrapped when accessed.
+    """
+    from mlreco.utils.unwrap import Unwrapper, UnwrappedBlob
+    rules = {
+        'input_data': ['tensor', 'input_data'],
+        'segmentation': ['tensor', 'input_data'],
+        'edge_index': ['edge_tensor', ['edge_index', 'input_data']]
+    }
+    unwrapper = Unwrapper(1, batch_size, rules, boundaries)
+    num_entries = batch_size*unwrapper.num_volumes
+
+    rng = np.random.default_rng(seed=0)
+    batch_ids = rng.integers(0, num_entries, size=50)
+    input_data = np.zeros((len(batch_ids), 5))
+    input_data[:, 0] = batch_ids
+    input_data[:, 4] = np.arange(len(batch_ids))
+    edge_index = np.array([[i, j] for i in range(len(batch_ids)) for j in range(len(batch_ids))
+                           if i != j and batch_ids[i] == batch_ids[j]])
+    data_blob = {'input_data': [input_data], 'index': [np.arange(batch_size)]}
+    result_blob = {'segmentation': [input_data[:, 4:]], 'edge_index': [edge_index]}
+
+    data, result = unwrapper(data_blob, result_blob)
+    assert isinstance(result, UnwrappedBlob) and len(result._pending) == 2
+    assert len(result['segmentation']) == batch_size
+    assert len(result._pending) == 1
+    for b in range(batch_size):
+        entries = range(b*unwrapper.num_volumes, (b+1)*unwrapper.num_volumes)
+        rows = np.concatenate([np.where(batch_ids == e)[0] for e in entries])
+        np.testing.assert_equal(result['segmentation'][b][:, 0], rows)
+        np.testing.assert_equal(data['input_data'][b][:, 4], rows)
+        edges = result['edge_index'][b]
+        assert len(edges) == np.sum([np.sum(batch_ids == e)**2 - np.sum(batch_ids == e) for e in entries])
+        expected = edge_index[np.isin(edge_index[:, 0], rows)]
+        np.testing.assert_equal(np.unique(rows[edges], axis=0), np.unique(expected, axis=0))
+    assert input_data[0, 0] == batch_ids[0]
+
+
 if __name__ == '__main__':
     test_unwrap_scn(2)
     test_unwrap_scn(3)
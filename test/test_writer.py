@@ -0,0 +1,229 @@
+import numpy as np
+import pytest
+
+
+def make_batch(batch_id, batch_size=3):
+    """
+    Batch with scalars, point clouds, index lists and jagged arrays.
+    """
+    rng = np.random.default_rng(batch_id)
+    data_blob = {'index': [batch_size*batch_id + i for i in range(batch_size)],
+                 'input_data': [rng.uniform(size=(rng.integers(1, 50), 5)) for _ in range(batch_size)]}
+    result_blob = {'clusts': [[np.arange(rng.integers(1, 10)) for _ in range(rng.integers(1, 4))] for _ in range(batch_size)],
+                   'jagged': [[rng.uniform(size=(rng.integers(1, 5), 3)), rng.uniform(size=(rng.integers(1, 5), 2))] for _ in range(batch_size)]}
+    return data_blob, result_blob
+
+
+@pytest.mark.parametrize("config", [{}, {'version': 1}, {'buffer_size': 4, 'chunk_size': 16, 'compression': 'gzip'}])
+def test_hdf5_writer(tmp_path, config):
+    """
+    Tests that the events written (directly or buffered) are read back as is.
+    """
+    from mlreco.iotools.writers import HDF5Writer
+    from mlreco.iotools.readers import HDF5Reader
+
+    file_name = str(tmp_path / 'output.h5')
+    batches = [make_batch(b) for b in range(5)]
+    with HDF5Writer(file_name, **config) as writer:
+        for data_blob, result_blob in batches:
+            writer.append(data_blob, result_blob)
+
+    reader = HDF5Reader(file_name)
+    assert len(reader) == 15
+    for b, (data_blob, result_blob) in enumerate(batches):
+        for i in range(3):
+            data, result = reader[3*b + i]
+            assert data['index'] == data_blob['index'][i]
+            assert np.array_equal(data['input_data'], data_blob['input_data'][i])
+            for key in ['clusts', 'jagged']:
+                assert len(result[key]) == len(result_blob[key][i])
+                for a, ref in zip(result[key], result_blob[key][i]):
+                    assert np.array_equal(a, ref)
+
+
+class IndexWriter:
+    """
+    Writer which records the event indexes in a text file.
+    """
+    def __init__(self, file_name, fail_at=None):
+        self.file_name, self.fail_at = file_name, fail_at
+        self.indexes = []
+
+    def append(self, data_blob, result_blob=None, cfg=None):
+        if data_blob['index'][0] == self.fail_at:
+            raise ValueError('Cannot write batch')
+        self.indexes.extend(data_blob['index'])
+
+    def close(self):
+        with open(self.file_name, 'w') as file:
+            file.write(','.join(map(str, self.indexes)))
+
+
+def test_background_writer(tmp_path):
+    """
+    Tests that the background writer writes all the batches in order
+    and that the errors of the writer process are raised.
+    """
+    from mlreco.iotools.background import BackgroundWriter
+
+    file_name = str(tmp_path / 'indexes.txt')
+    writer = BackgroundWriter(IndexWriter, {'file_name': file_name}, queue_size=2)
+    for b in range(20):
+        writer.append({'index': [2*b, 2*b+1]})
+    writer.close()
+    with open(file_name) as file:
+        assert file.read() == ','.join(map(str, range(40)))
+
+    writer = BackgroundWriter(IndexWriter, {'file_name': file_name, 'fail_at': 4}, queue_size=2)
+    with pytest.raises(RuntimeError, match='Cannot write batch'):
+        for b in range(20):
+            writer.append({'index': [2*b, 2*b+1]})
+        writer.close()
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_hdf5_reader_get_many(tmp_path, version):
+    """
+    Tests that reading a list of entries at once matches reading
+    them one by one, in any order, including from an unpickled reader.
+    """
+    import pickle
+    from mlreco.iotools.writers import HDF5Writer
+    from mlreco.iotools.readers import HDF5Reader
+
+    file_name = str(tmp_path / 'output.h5')
+    with HDF5Writer(file_name, buffer_size=8, version=version) as writer:
+        for b in range(5):
+            writer.append(*make_batch(b))
+
+    reader = HDF5Reader(file_name)
+    indices = [7, 2, 3, 3, 14, 0]
+    for idx, (data, result) in zip(indices, reader.get_many(indices)):
+        ref_data, ref_result = reader.get(idx)
+        assert data['index'] == ref_data['index'] == idx
+        assert np.array_equal(data['input_data'], ref_data['input_data'])
+        for a, ref in zip(result['clusts'], ref_result['clusts']):
+            assert np.array_equal(a, ref)
+
+    copy = pickle.loads(pickle.dumps(reader))
+    assert copy.get(5)[0]['index'] == 5
+    reader.close()
+
+    reader = HDF5Reader(file_name, skip_entry_list=[0, 3])
+    assert list(reader.find_entries([7, 2, 14])) == [5, 1, 12]
+    with pytest.raises(AssertionError):
+        reader.find_entries([3])
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_hdf5_dataset(tmp_path, num_workers):
+    """
+    Tests that the batches of the HDF5 dataset loader (read in worker
+    processes) match the nested entries read by the reader itself.
+    """
+    from torch.utils.data import DataLoader
+    from mlreco.iotools.writers import HDF5Writer
+    from mlreco.iotools.datasets import HDF5Dataset
+    from mlreco.iotools.collates import CollateHDF5
+
+    file_name = str(tmp_path / 'output.h5')
+    with HDF5Writer(file_name) as writer:
+        for b in range(3):
+            writer.append(*make_batch(b))
+
+    dataset = HDF5Dataset(file_name, skip_entry_list=[4])
+    assert len(dataset) == 8
+    loader = DataLoader(dataset, batch_size=3, num_workers=num_workers, collate_fn=CollateHDF5)
+    entries = [e for e in range(9) if e != 4]
+    for b, (data, result) in enumerate(loader):
+        assert data['index'] == entries[3*b:3*b+3]
+        for i, idx in enumerate(data['index']):
+            ref_data, ref_result = dataset.reader.get(entries.index(idx), nested=True)
+            assert np.array_equal(data['input_data'][i], ref_data['input_data'][0])
+            for a, ref in zip(result['jagged'][i], ref_result['jagged'][0]):
+                assert np.array_equal(a, ref)
+
+
+def test_hdf5_reader_keys(tmp_path):
+    """
+    Tests the key selection, the lazy arrays and the read accounting.
+    """
+    from mlreco.iotools.writers import HDF5Writer
+    from mlreco.iotools.readers import HDF5Reader, LazyArray
+
+    file_name = str(tmp_path / 'output.h5')
+    batch = make_batch(0)
+    with HDF5Writer(file_name) as writer:
+        writer.append(*batch)
+
+    reader = HDF5Reader(file_name, skip_keys=['jagged'], lazy_rows=0)
+    data, result = reader.get(1)
+    assert 'jagged' not in result and 'clusts' in result
+    array = data['input_data']
+    assert isinstance(array, LazyArray) and not array.loaded
+    assert array.shape == batch[0]['input_data'][1].shape
+    assert reader.read_summary()['input_data']['loaded'] == 0
+    assert np.array_equal(array[:, :3], batch[0]['input_data'][1][:, :3])
+    assert np.allclose(2*array, 2*batch[0]['input_data'][1])
+    assert reader.read_summary()['input_data'] == {'requested': 1, 'loaded': 1, 'bytes': array.nbytes}
+
+    reader = HDF5Reader(file_name, keys=['index', 'clusts'])
+    data, result = reader.get(0)
+    assert list(data.keys()) == ['index'] and list(result.keys()) == ['clusts']
+
+
+def test_hdf5_writer_objects(tmp_path):
+    """
+    Tests that the attributes of analysis objects are stored column-wise.
+    """
+    from analysis.classes import Particle
+    from mlreco.iotools.writers import HDF5Writer
+    from mlreco.iotools.readers import HDF5Reader
+
+    rng = np.random.default_rng(0)
+    particles = [Particle(group_id=i, semantic_type=i%4, index=np.arange(i+1),
+                          pid_scores=rng.uniform(size=5).astype(np.float32), length=float(i))
+                 for i in range(10)]
+    file_name = str(tmp_path / 'output.h5')
+    with HDF5Writer(file_name) as writer:
+        writer.append({'index': [0]}, {'particles': [particles]})
+
+    stored = HDF5Reader(file_name).get(0)[1]['particles']
+    assert len(stored) == len(particles)
+    for s, p in zip(stored, particles):
+        assert s['id'] == p.id and s['semantic_type'] == p.semantic_type
+        assert s['length'] == p.length
+        assert np.array_equal(s['index'], p.index)
+        assert np.array_equal(s['pid_scores'], p.pid_scores)
+
+
+def test_hdf5_shards(tmp_path):
+    """
+    Tests that the shards stitched into a virtual index file are read back
+    as a single file, in shard order.
+    """
+    import h5py
+    from mlreco.iotools.writers import HDF5Writer
+    from mlreco.iotools.readers import HDF5Reader
+    from mlreco.iotools.shards import shard_file_name, merge_shards
+
+    file_name = str(tmp_path / 'output.h5')
+    batches = [make_batch(b) for b in range(6)]
+    for shard_id in range(3):
+        with HDF5Writer(file_name, shard_id=shard_id) as writer:
+            for data_blob, result_blob in batches[2*shard_id:2*shard_id+2]:
+                writer.append(data_blob, result_blob)
+
+    assert merge_shards(file_name, [shard_file_name(file_name, s) for s in range(3)]) == 18
+    with h5py.File(file_name, 'r') as f:
+        assert 'shard_id' not in f.attrs
+        assert list(f.attrs['shard_ids']) == [0, 1, 2]
+    reader = HDF5Reader(file_name)
+    assert len(reader) == 18
+    for b, (data_blob, result_blob) in enumerate(batches):
+        for i, (data, result) in enumerate(reader.get_many([3*b, 3*b+1, 3*b+2])):
+            assert data['index'] == data_blob['index'][i]
+            assert np.array_equal(data['input_data'], data_blob['input_data'][i])
+            for key in ['clusts', 'jagged']:
+                for a, ref in zip(result[key], result_blob[key][i]):
+                    assert np.array_equal(a, ref)